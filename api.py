@@ -0,0 +1,269 @@
+"""JSON API, mounted at /api/v1.
+
+    GET /api/v1/timeline                  the logged-in user's home timeline
+    GET /api/v1/users/<id>                a profile
+    GET /api/v1/users/<id>/messages       a user's messages, newest first
+    GET /api/v1/users/<id>/following      who a user follows
+    GET /api/v1/users/<id>/followers      who follows a user
+    GET /api/v1/messages/<id>             one message
+    GET /api/v1/trending                  messages ranked by recent likes
+    POST /api/v1/following                follow/unfollow users in bulk
+
+Requests are authenticated with the site's session cookie; the timeline and
+follow lists need a logged-in user, like their HTML pages. Message lists
+page with the same ``?before=`` cursor as the site, user lists with
+``?after=<user id>``; either way the response's ``next`` is the value to
+send for the following page (null on the last one).
+
+Responses are compact JSON with a strong ETag (see caching.py), so polling
+clients get a bodiless 304 while nothing has changed.
+
+Writes take a JSON body (``Content-Type: application/json``), which a
+cross-site HTML form can't send.
+"""
+
+from flask import Blueprint, abort, current_app, g, request
+from werkzeug.exceptions import HTTPException
+
+from caching import compact_json, conditional_json, row_etag
+from follows import follow_users, unfollow_users
+from models import db, Follows, Message, User
+from pagination import get_cursor, paginate_messages
+from timelines import read_home_timeline
+from trending import trending_messages
+
+# bump when the shape of the JSON changes, so cached copies are refetched
+SCHEMA_VERSION = 2
+
+api = Blueprint('api', __name__, url_prefix='/api/v1')
+
+
+def user_json(user):
+    """A user's public profile."""
+
+    return {
+        'id': user.id,
+        'username': user.username,
+        'image_url': user.image_url,
+        'header_image_url': user.header_image_url,
+        'bio': user.bio,
+        'location': user.location,
+        'messages_count': user.messages_count,
+        'following_count': user.following_count,
+        'followers_count': user.followers_count,
+        'likes_count': user.likes_count,
+    }
+
+
+def message_json(message):
+    """A message with just enough of its author to show it."""
+
+    return {
+        'id': message.id,
+        'text': message.text,
+        'timestamp': message.timestamp.isoformat() + 'Z',
+        'like_count': message.like_count,
+        'user': {
+            'id': message.user.id,
+            'username': message.user.username,
+            'image_url': message.user.image_url,
+        },
+    }
+
+
+def user_version(user):
+    return ('user', user.id, user.updated_at)
+
+
+def message_version(message):
+    # messages can't be edited, but their like count and their author's
+    # name and picture can change
+    return ('message', message.id, message.like_count,
+            user_version(message.user))
+
+
+def message_list(messages, next_cursor):
+    """Conditional response for a page of messages."""
+
+    etag = row_etag(SCHEMA_VERSION, next_cursor,
+                    *(message_version(m) for m in messages))
+
+    return conditional_json(etag, lambda: {
+        'messages': [message_json(m) for m in messages],
+        'next': next_cursor,
+    })
+
+
+def user_list(query):
+    """Conditional response for a page of the users in `query`, by id."""
+
+    per_page = current_app.config['FOLLOWS_PER_PAGE']
+    after = request.args.get('after', 0, type=int)
+
+    users = (query
+             .filter(User.id > after)
+             .order_by(User.id)
+             .limit(per_page + 1)
+             .all())
+
+    next_after = users[per_page - 1].id if len(users) > per_page else None
+    users = users[:per_page]
+
+    etag = row_etag(SCHEMA_VERSION, next_after,
+                    *(user_version(u) for u in users))
+
+    return conditional_json(etag, lambda: {
+        'users': [user_json(u) for u in users],
+        'next': next_after,
+    })
+
+
+def login_required():
+    """Stop the request with a 401 unless someone is logged in."""
+
+    if not g.user:
+        abort(401)
+
+
+# the app's own 404 page is registered by code, which Flask prefers to a
+# handler by exception class, so 404 needs naming here too
+@api.errorhandler(404)
+@api.errorhandler(HTTPException)
+def api_error(e):
+    """Errors come back as JSON too."""
+
+    return current_app.response_class(
+        compact_json({'error': e.name}), status=e.code,
+        mimetype='application/json')
+
+
+@api.route('/timeline')
+def timeline():
+    """The logged-in user's home timeline."""
+
+    login_required()
+
+    messages, next_cursor = read_home_timeline(
+        g.user.id, get_cursor(), current_app.config['MESSAGES_PER_PAGE'])
+
+    return message_list(messages, next_cursor)
+
+
+@api.route('/users/<int:user_id>')
+def user_detail(user_id):
+    """A user's profile."""
+
+    user = User.query.get_or_404(user_id)
+
+    return conditional_json(row_etag(SCHEMA_VERSION, user_version(user)),
+                            lambda: user_json(user))
+
+
+@api.route('/users/<int:user_id>/messages')
+def user_messages(user_id):
+    """A user's messages, newest first."""
+
+    User.query.get_or_404(user_id)
+
+    messages, next_cursor = paginate_messages(
+        Message.with_authors().filter(Message.user_id == user_id),
+        get_cursor(),
+        current_app.config['MESSAGES_PER_PAGE'])
+
+    return message_list(messages, next_cursor)
+
+
+@api.route('/users/<int:user_id>/following')
+def user_following(user_id):
+    """Who the user follows."""
+
+    login_required()
+    User.query.get_or_404(user_id)
+
+    return user_list(User.query
+                     .join(Follows, Follows.user_being_followed_id == User.id)
+                     .filter(Follows.user_following_id == user_id))
+
+
+@api.route('/users/<int:user_id>/followers')
+def user_followers(user_id):
+    """Who follows the user."""
+
+    login_required()
+    User.query.get_or_404(user_id)
+
+    return user_list(User.query
+                     .join(Follows, Follows.user_following_id == User.id)
+                     .filter(Follows.user_being_followed_id == user_id))
+
+
+@api.route('/messages/<int:message_id>')
+def message_detail(message_id):
+    """One message."""
+
+    message = Message.with_authors().filter_by(id=message_id).first_or_404()
+
+    return conditional_json(row_etag(SCHEMA_VERSION, message_version(message)),
+                            lambda: message_json(message))
+
+
+@api.route('/trending')
+def trending():
+    """Messages ranked by recent likes, as of the last ranking."""
+
+    computed_at, messages = trending_messages()
+
+    etag = row_etag(SCHEMA_VERSION, computed_at,
+                    *(message_version(m) for m in messages))
+
+    return conditional_json(etag, lambda: {
+        'messages': [message_json(m) for m in messages],
+        'computed_at': computed_at and computed_at.isoformat() + 'Z',
+    })
+
+
+def _id_list(body, key):
+    """The list of user ids at `key` in the request body, or a 400."""
+
+    ids = body.get(key, [])
+
+    if not (isinstance(ids, list)
+            and all(type(uid) is int for uid in ids)):
+        abort(400)
+
+    return ids
+
+
+@api.route('/following', methods=['POST'])
+def bulk_follow():
+    """Follow and/or unfollow many users at once.
+
+    Takes ``{"follow": [ids], "unfollow": [ids]}`` and answers with the
+    result for each id, e.g. ``{"follow": [{"id": 2, "result": "followed"}],
+    "unfollow": [...]}``.
+    """
+
+    login_required()
+
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict):
+        abort(400)
+
+    follow, unfollow = _id_list(body, 'follow'), _id_list(body, 'unfollow')
+
+    if (set(follow) & set(unfollow)
+            or len(follow) + len(unfollow) > current_app.config['BULK_FOLLOW_LIMIT']):
+        abort(400)
+
+    results = {
+        'follow': follow_users(g.user.id, follow),
+        'unfollow': unfollow_users(g.user.id, unfollow),
+    }
+    db.session.commit()
+
+    response = current_app.response_class(compact_json({
+        action: [{'id': uid, 'result': result} for uid, result in by_id.items()]
+        for action, by_id in results.items()
+    }), mimetype='application/json')
+    response.headers['Cache-Control'] = 'no-store'
+    return response
@@ -1,11 +1,32 @@
 import os
 
-from flask import Flask, render_template, request, flash, redirect, session, g, jsonify
+from flask import Flask, render_template, request, flash, redirect, session, g, jsonify, abort
 from flask_debugtoolbar import DebugToolbarExtension
+from flask_migrate import Migrate
+from sqlalchemy import select
 from sqlalchemy.exc import IntegrityError
 
+from api import api
+from assets import init_assets, build_assets_command
+from caching import cache_policy, code_version, init_caching, page_not_modified
+from counters import reconcile_counters_command
+from follows import NOT_FOUND, follow_page, follow_users, unfollow_users
 from forms import UserAddForm, LoginForm, MessageForm, UserEditProfileForm
-from models import db, connect_db, User, Message
+from jobs import init_jobs, jobs_cli
+from loader import load_csvs_command
+from metrics import init_metrics
+from models import db, connect_db, User, Message, Likes
+from pagination import get_cursor, paginate_messages
+from passwords import HasherBusy, init_password_hasher
+from purge import delete_account, purge_accounts_command
+from query_plans import check_query_plans_command
+from recommend import compute_recommendations_command, recommended_users
+from search import search_users, index_user, unindex_user, include_object
+from streaming import render_list, stream_rows, with_follow_state
+from timelines import (fanout_enabled, publish_message, read_home_timeline,
+                       rebuild_timelines_command, withdraw_message)
+from trending import compute_trending_command, trending_messages
+from usercache import init_user_cache, get_user_snapshot, invalidate_user
 
 CURR_USER_KEY = "curr_user"
 
@@ -20,9 +41,99 @@ app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['SQLALCHEMY_ECHO'] = False
 app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', "it's a secret")
+
+# Fan-out-on-write home timelines (see timelines.py); off by default.
+app.config['TIMELINE_FANOUT'] = os.environ.get('TIMELINE_FANOUT') == '1'
+app.config['TIMELINE_BACKEND'] = os.environ.get('TIMELINE_BACKEND', 'database')
+app.config['TIMELINE_MAX_LENGTH'] = 800
+
+app.config['MESSAGES_PER_PAGE'] = 100
+app.config['FOLLOWS_PER_PAGE'] = 50
+# most users one POST /api/v1/following may follow or unfollow
+app.config['BULK_FOLLOW_LIMIT'] = 1000
+
+# Stream long list pages as they render (see streaming.py); off by default.
+app.config['STREAM_LIST_PAGES'] = os.environ.get('STREAM_LIST_PAGES') == '1'
+app.config['LIST_BATCH_SIZE'] = 500
+
+# Snapshots of logged-in users (see usercache.py).
+app.config['USER_CACHE_SIZE'] = 10000
+app.config['USER_CACHE_TTL'] = 60
+
+# Password hashing (see passwords.py). Existing hashes are upgraded to
+# BCRYPT_LOG_ROUNDS as their owners log in.
+app.config['BCRYPT_LOG_ROUNDS'] = int(os.environ.get('BCRYPT_LOG_ROUNDS', 12))
+app.config['PASSWORD_HASH_MODE'] = os.environ.get('PASSWORD_HASH_MODE', 'inline')
+app.config['PASSWORD_HASH_WORKERS'] = None
+app.config['PASSWORD_HASH_MAX_PENDING'] = None
+
+# User search (see search.py): 'auto', 'trigram', 'like' or 'memory'
+# (per-process, so for tests and development only).
+app.config['USER_SEARCH_BACKEND'] = os.environ.get('USER_SEARCH_BACKEND', 'auto')
+app.config['USERS_PER_PAGE'] = 30
+app.config['USER_SEARCH_MAX_PAGES'] = 50
+
+# Trending messages (see trending.py), ranked by `flask compute-trending`.
+app.config['TRENDING_SIZE'] = 50
+app.config['TRENDING_WINDOW_HOURS'] = 48
+app.config['TRENDING_HALF_LIFE_HOURS'] = 6
+app.config['TRENDING_MAX_AGE_DAYS'] = 7
+app.config['TRENDING_CACHE_TTL'] = 30
+
+# Who to follow (see recommend.py), from `flask compute-recommendations`.
+app.config['RECOMMENDATIONS_PER_USER'] = 20
+app.config['RECOMMENDATIONS_SHOWN'] = 5
+# two-hop paths held in memory at once by compute-recommendations
+app.config['RECOMMENDATIONS_CHUNK_PATHS'] = 20000000
+
+# rows a purge deletes per transaction (see purge.py)
+app.config['PURGE_BATCH_SIZE'] = 1000
+
+# Background jobs (see jobs.py): 'thread' runs them in this process too,
+# 'external' leaves them to `flask jobs work`.
+app.config['JOBS_MODE'] = os.environ.get('JOBS_MODE', 'thread')
+app.config['JOBS_THREADS'] = 4
+app.config['JOBS_POLL_SECONDS'] = 2
+app.config['JOBS_LEASE_SECONDS'] = 300
+# the first retry of a failed job waits this long, doubling each time after
+app.config['JOBS_RETRY_SECONDS'] = 10
+app.config['JOBS_RETRY_MAX_SECONDS'] = 3600
+
+# HTTP caching (see caching.py). Part of every page ETag, so it must be the
+# same in every worker and change with each deploy: the release id if set,
+# otherwise a hash of the code and templates.
+app.config['CACHE_VERSION'] = (os.environ.get('CACHE_VERSION')
+                               or code_version(app.root_path))
+# built assets are fingerprinted and cached for a year (see assets.py); this
+# covers the rest of /static, served by send_static_file under names that
+# don't change with their content, so browsers recheck those hourly
+app.config['SEND_FILE_MAX_AGE_DEFAULT'] = 3600
+
+# If set, /metrics requires "Authorization: Bearer <token>".
+app.config['METRICS_TOKEN'] = os.environ.get('METRICS_TOKEN')
+
 toolbar = DebugToolbarExtension(app)
 
 connect_db(app)
+migrate = Migrate(app, db, include_object=include_object)
+init_metrics(app)
+init_user_cache(app)
+init_password_hasher(app)
+init_caching(app)
+init_assets(app)
+init_jobs(app)
+
+app.register_blueprint(api)
+
+app.cli.add_command(rebuild_timelines_command)
+app.cli.add_command(reconcile_counters_command)
+app.cli.add_command(check_query_plans_command)
+app.cli.add_command(build_assets_command)
+app.cli.add_command(load_csvs_command)
+app.cli.add_command(compute_trending_command)
+app.cli.add_command(compute_recommendations_command)
+app.cli.add_command(purge_accounts_command)
+app.cli.add_command(jobs_cli)
 
 
 ##############################################################################
@@ -31,15 +142,33 @@ connect_db(app)
 
 @app.before_request
 def add_user_to_g():
-    """If we're logged in, add curr user to Flask global."""
+    """If we're logged in, add curr user to Flask global.
+
+    This is a cached, read-only snapshot; use `g.user.load()` to make changes.
+    """
 
     if CURR_USER_KEY in session:
-        g.user = User.query.get(session[CURR_USER_KEY])
+        g.user = get_user_snapshot(session[CURR_USER_KEY])
 
     else:
         g.user = None
 
 
+@app.after_request
+def refresh_user_snapshot(response):
+    """Drop the logged-in user's snapshot after anything they POST.
+
+    Posting, following and liking all move their counters, which the
+    snapshot carries for the home page sidebar. Others following them only
+    show up once it expires (``USER_CACHE_TTL``).
+    """
+
+    if request.method == 'POST' and g.get('user'):
+        invalidate_user(g.user.id)
+
+    return response
+
+
 def do_login(user):
     """Log in user."""
 
@@ -53,6 +182,12 @@ def do_logout():
         del session[CURR_USER_KEY]
 
 
+def viewer_version():
+    """`(id, updated_at)` of the logged-in user, or None, for page ETags."""
+
+    return (g.user.id, g.user.row_version()) if g.user else None
+
+
 @app.route('/signup', methods=["GET", "POST"])
 def signup():
     """Handle user signup.
@@ -81,6 +216,8 @@ def signup():
             flash("Username already taken", 'danger')
             return render_template('users/signup.html', form=form)
 
+        index_user(user)
+
         do_login(user)
 
         return redirect("/")
@@ -100,6 +237,8 @@ def login():
                                  form.password.data)
 
         if user:
+            # keeps the password if authenticate() rehashed it
+            db.session.commit()
             do_login(user)
             flash(f"Hello, {user.username}!", "success")
             return redirect("/")
@@ -125,17 +264,21 @@ def logout():
 def list_users():
     """Page with listing of users.
 
-    Can take a 'q' param in querystring to search by that username.
+    Can take a 'q' param in querystring to search by that username, and
+    a 'page' param (1-based).
     """
 
-    search = request.args.get('q')
+    search = request.args.get('q', '').strip()
+    page = request.args.get('page', 1, type=int)
 
-    if not search:
-        users = User.query.all()
-    else:
-        users = User.query.filter(User.username.like(f"%{search}%")).all()
+    if page < 1:
+        abort(400)
+
+    users, has_next = search_users(search, page, app.config['USERS_PER_PAGE'])
 
-    return render_template('users/index.html', users=users)
+    return render_list('users/index.html',
+                       users=with_follow_state(users, g.user),
+                       search=search, page=page, has_next=has_next)
 
 
 @app.route('/users/<int:user_id>')
@@ -144,40 +287,59 @@ def users_show(user_id):
 
     user = User.query.get_or_404(user_id)
 
+    # every message here is the user's own, and posting or deleting one
+    # bumps their updated_at
+    viewer = viewer_version()
+    not_modified = page_not_modified(
+        'users_show', user.id, user.updated_at, viewer,
+        last_modified=max(user.updated_at, viewer[1]) if viewer else user.updated_at)
+    if not_modified:
+        return not_modified
+
     # snagging messages in order from the database;
     # user.messages won't be in order by default
-    messages = (Message
-                .query
-                .filter(Message.user_id == user_id)
-                .order_by(Message.timestamp.desc())
-                .limit(100)
-                .all())
-    likes=user.likes
-    return render_template('users/show.html', user=user, messages=messages, likes=likes)
+    messages, next_cursor = paginate_messages(
+        Message.with_authors().filter(Message.user_id == user_id),
+        get_cursor(),
+        app.config['MESSAGES_PER_PAGE'])
+    liked_ids = (g.user.liked_ids_among(m.id for m in messages)
+                 if g.user else set())
+    return render_template('users/show.html', user=user, messages=messages,
+                           liked_ids=liked_ids, next_cursor=next_cursor)
 
 
 @app.route('/users/<int:user_id>/following')
 def show_following(user_id):
-    """Show list of people this user is following."""
+    """Show list of people this user is following, most recently followed
+    first, a page at a time (`?before=` cursor)."""
 
     if not g.user:
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
     user = User.query.get_or_404(user_id)
-    return render_template('users/following.html', user=user)
+    cards, next_cursor = follow_page(user_id, 'following', g.user.id,
+                                     get_cursor(), app.config['FOLLOWS_PER_PAGE'])
+
+    return render_list('users/following.html', user=user, cards=cards,
+                       next_cursor=next_cursor)
 
 
 @app.route('/users/<int:user_id>/followers')
 def users_followers(user_id):
-    """Show list of followers of this user."""
+    """Show list of followers of this user, most recent first, a page at a
+    time (`?before=` cursor)."""
 
     if not g.user:
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
     user = User.query.get_or_404(user_id)
-    return render_template('users/followers.html', user=user)
+    cards, next_cursor = follow_page(user_id, 'followers', g.user.id,
+                                     get_cursor(), app.config['FOLLOWS_PER_PAGE'])
+
+    return render_list('users/followers.html', user=user, cards=cards,
+                       next_cursor=next_cursor)
 
 
 @app.route('/users/follow/<int:follow_id>', methods=['POST'])
@@ -188,8 +350,11 @@ def add_follow(follow_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    followed_user = User.query.get_or_404(follow_id)
-    g.user.following.append(followed_user)
+    result = follow_users(g.user.id, [follow_id])[follow_id]
+
+    if result == NOT_FOUND:
+        abort(404)
+
     db.session.commit()
 
     return redirect(f"/users/{g.user.id}/following")
@@ -203,14 +368,14 @@ def stop_following(follow_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    followed_user = User.query.get(follow_id)
-    g.user.following.remove(followed_user)
+    unfollow_users(g.user.id, [follow_id])
     db.session.commit()
 
     return redirect(f"/users/{g.user.id}/following")
 
 
 @app.route('/users/profile', methods=["GET", "POST"])
+@cache_policy('no-store')
 def profile():
     """Update profile for current user."""
 
@@ -221,16 +386,20 @@ def profile():
     form = UserEditProfileForm()
 
     if form.validate_on_submit():
-        if User.authenticate(g.user.username, form.password.data):
-            g.user.username = form.username.data
-            g.user.email = form.email.data
-            g.user.image_url = form.image_url.data or g.user.image_url
-            g.user.header_image_url = form.header_image_url.data or g.user.header_image_url
-            g.user.location = form.location.data or g.user.location
-            g.user.bio = form.bio.data or g.user.bio
+        user = User.authenticate(g.user.username, form.password.data)
+
+        if user:
+            user.username = form.username.data
+            user.email = form.email.data
+            user.image_url = form.image_url.data or user.image_url
+            user.header_image_url = form.header_image_url.data or user.header_image_url
+            user.location = form.location.data or user.location
+            user.bio = form.bio.data or user.bio
 
             db.session.commit()
-            return redirect(f"/users/{g.user.id}")
+            invalidate_user(user.id)
+            index_user(user)
+            return redirect(f"/users/{user.id}")
 
         flash("Incorrect password! Please try again.", 'danger')
 
@@ -246,8 +415,11 @@ def delete_user():
 
     do_logout()
 
-    db.session.delete(g.user)
+    # hidden right away; a background job removes the rows
+    delete_account(g.user.load())
     db.session.commit()
+    invalidate_user(g.user.id)
+    unindex_user(g.user.id)
 
     return redirect("/signup")
 
@@ -269,8 +441,13 @@ def messages_add():
     form = MessageForm()
 
     if form.validate_on_submit():
-        msg = Message(text=form.text.data)
-        g.user.messages.append(msg)
+        msg = Message(text=form.text.data, user_id=g.user.id)
+        db.session.add(msg)
+
+        if fanout_enabled():
+            db.session.flush()
+            publish_message(msg)
+
         db.session.commit()
 
         return redirect(f"/users/{g.user.id}")
@@ -282,8 +459,18 @@ def messages_add():
 def messages_show(message_id):
     """Show a message."""
 
-    msg = Message.query.get_or_404(message_id)
-    return render_template('messages/show.html', message=msg)
+    msg = Message.with_authors().filter_by(id=message_id).first_or_404()
+
+    viewer = viewer_version()
+    changed = [msg.timestamp, msg.user.updated_at] + ([viewer[1]] if viewer else [])
+    not_modified = page_not_modified(
+        'messages_show', msg.id, msg.user.id, msg.user.updated_at, viewer,
+        last_modified=max(changed))
+    if not_modified:
+        return not_modified
+
+    liked_ids = g.user.liked_ids_among([msg.id]) if g.user else set()
+    return render_template('messages/show.html', message=msg, liked_ids=liked_ids)
 
 
 @app.route('/messages/<int:message_id>/delete', methods=["POST"])
@@ -296,6 +483,10 @@ def messages_destroy(message_id):
 
     msg = Message.query.get(message_id)
     db.session.delete(msg)
+
+    if fanout_enabled():
+        withdraw_message(message_id)
+
     db.session.commit()
 
     return redirect(f"/users/{g.user.id}")
@@ -310,44 +501,42 @@ def homepage():
     """Show homepage:
 
     - anon users: no messages
-    - logged in: 100 most recent messages of followed_users
+    - logged in: 100 most recent messages of followed_users, with a
+      `?before=` cursor for older pages
     """
 
     if g.user:
-        
-        # grab all user ids current user is following
-        user_ids_following = [u.id for u in g.user.following] + [g.user.id]
+        messages, next_cursor = read_home_timeline(
+            g.user.id, get_cursor(), app.config['MESSAGES_PER_PAGE'])
+        liked_ids = g.user.liked_ids_among(m.id for m in messages)
+        recommendations = recommended_users(g.user.id,
+                                            app.config['RECOMMENDATIONS_SHOWN'])
 
-        # filter for most recent 100 messages from followed user ids
-        messages = (Message
-                    .query
-                    .filter(Message.user_id.in_(user_ids_following))
-                    .order_by(Message.timestamp.desc())
-                    .limit(100)
-                    .all())
-
-        return render_template('home.html', messages=messages, likes=g.user.likes)
+        # the sidebar card's counts come from the snapshot
+        return render_template('home.html', user=g.user, messages=messages,
+                               liked_ids=liked_ids, next_cursor=next_cursor,
+                               recommendations=recommendations)
 
     else:
         return render_template('home-anon.html')
 
 
-##############################################################################
-# Turn off all caching in Flask
-#   (useful for dev; in production, this kind of stuff is typically
-#   handled elsewhere)
-#
-# https://stackoverflow.com/questions/34066804/disabling-caching-in-flask
+@app.route('/trending')
+def trending():
+    """Recent messages that are being liked fastest, from the last ranking."""
 
-@app.after_request
-def add_header(req):
-    """Add non-caching headers on every request."""
+    computed_at, messages = trending_messages()
 
-    req.headers["Cache-Control"] = "no-cache, no-store, must-revalidate"
-    req.headers["Pragma"] = "no-cache"
-    req.headers["Expires"] = "0"
-    req.headers['Cache-Control'] = 'public, max-age=0'
-    return req
+    not_modified = page_not_modified(
+        'trending', computed_at, viewer_version(),
+        *((m.id, m.like_count, m.user.updated_at) for m in messages))
+    if not_modified:
+        return not_modified
+
+    liked_ids = g.user.liked_ids_among(m.id for m in messages) if g.user else set()
+
+    return render_template('messages/trending.html', messages=messages,
+                           liked_ids=liked_ids)
 
 
 ##############################################################################
@@ -362,8 +551,15 @@ def show_likes(user_id):
         return redirect("/")
 
     user = User.query.get_or_404(user_id)
-    likes = user.likes
-    return render_template('users/likes.html', user=user, likes=likes)
+
+    # most recently liked first
+    likes = (Message
+             .with_authors()
+             .join(Likes, Likes.message_id == Message.id)
+             .filter(Likes.user_id == user_id)
+             .order_by(Likes.id.desc()))
+
+    return render_list('users/likes.html', user=user, likes=stream_rows(likes))
 
 
 @app.route('/users/toggle_like/<int:message_id>', methods=['POST'])
@@ -373,24 +569,23 @@ def toggle_like(message_id):
     if not g.user:
         flash("Access unauthorized.", "danger")
         return redirect("/")
-    
-    msg = Message.query.get_or_404(message_id)
-    
-    if msg.user_id == g.user.id:
+
+    author_id = db.session.scalar(
+        select(Message.user_id).where(Message.id == message_id))
+
+    if author_id is None:
+        abort(404)
+
+    if author_id == g.user.id:
         return abort(403)
-    
-    liked_msgs = g.user.likes
-    
-    if msg in liked_msgs:
-        g.user.likes = [like for like in liked_msgs if like != msg]
-        msg_liked = False
-    else:
-        g.user.likes.append(msg)
-        msg_liked = True
-    
+
+    msg_liked = Likes.toggle(g.user.id, message_id)
     db.session.commit()
-    
-    return jsonify({'msg_liked': msg_liked})
+
+    return jsonify({'msg_liked': msg_liked,
+                    'like_count': db.session.scalar(
+                        select(Message.like_count)
+                        .where(Message.id == message_id))})
 
 
 
@@ -400,4 +595,11 @@ def toggle_like(message_id):
 def page_not_found(e):
     """404 NOT FOUND page."""
 
-    return render_template('404.html'), 404
\ No newline at end of file
+    return render_template('404.html'), 404
+
+
+@app.errorhandler(HasherBusy)
+def hasher_busy(e):
+    """Too many logins/signups at once: ask the client to retry."""
+
+    return "Busy, please try again in a moment.", 503, {'Retry-After': '1'}
\ No newline at end of file
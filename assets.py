@@ -0,0 +1,205 @@
+"""Fingerprinted, precompressed static assets.
+
+`flask build-assets` copies everything under ``static/`` into
+``ASSETS_DIR`` (``static/dist`` by default) with a content hash in each
+name (``style.css`` -> ``style.1a2b3c4d5e6f.css``), rewrites the
+``url(/static/...)`` references inside stylesheets to match, writes ``.gz``
+(and ``.br``, when the optional ``brotli`` package is installed) next to
+anything that compresses, and records the mapping in ``manifest.json``.
+
+Templates link assets with ``{{ asset_url('stylesheets/style.css') }}``.
+Once the manifest exists that's the fingerprinted name, served from
+/static/dist/ with a year-long ``immutable`` Cache-Control (a changed file
+gets a new name) and the best encoding the browser accepts. Without a
+build it's the plain /static/ URL, so development needs no extra step.
+"""
+
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import re
+import shutil
+
+import click
+from flask import current_app, request, send_from_directory, url_for
+from flask.cli import with_appcontext
+
+MANIFEST = 'manifest.json'
+
+IMMUTABLE = 'public, max-age=31536000, immutable'
+
+# already compressed; gzip would only add a few bytes
+INCOMPRESSIBLE = {'.jpg', '.jpeg', '.png', '.gif', '.webp', '.woff', '.woff2'}
+
+CSS_URL = re.compile(r"""url\((['"]?)/static/([^'")]+)\1\)""")
+
+
+def _brotli():
+    """The `brotli` module, or None if it isn't installed."""
+
+    try:
+        import brotli
+    except ImportError:
+        return None
+    return brotli
+
+
+def fingerprint(path, content):
+    """`path` with a hash of `content` before its extension."""
+
+    digest = hashlib.sha256(content).hexdigest()[:12]
+    stem, ext = os.path.splitext(path)
+    return f"{stem}.{digest}{ext}"
+
+
+def _write(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(content)
+
+
+def _write_compressed(path, content):
+    """Write `.gz`/`.br` variants of `path`, where they come out smaller."""
+
+    # mtime=0 keeps the output identical from build to build
+    gzipped = gzip.compress(content, compresslevel=9, mtime=0)
+    if len(gzipped) < len(content):
+        _write(path + '.gz', gzipped)
+
+    brotli = _brotli()
+    if brotli is not None:
+        compressed = brotli.compress(content)
+        if len(compressed) < len(content):
+            _write(path + '.br', compressed)
+
+
+def _rewrite_css_urls(css, manifest):
+    """Point ``url(/static/...)`` references at the fingerprinted files."""
+
+    def rewrite(match):
+        quote, path = match.groups()
+        hashed = manifest.get(path)
+        if hashed is None:
+            return match.group(0)
+        return f"url({quote}/static/dist/{hashed}{quote})"
+
+    return CSS_URL.sub(rewrite, css)
+
+
+def build_assets(source_dir, out_dir):
+    """Build fingerprinted copies of `source_dir` into `out_dir`.
+
+    Returns the manifest: ``{original path: fingerprinted path}``, both
+    relative and with forward slashes.
+    """
+
+    out_dir = os.path.abspath(out_dir)
+    paths = []
+
+    for root, dirs, files in os.walk(source_dir):
+        # don't feed a previous build back in
+        dirs[:] = sorted(d for d in dirs
+                         if os.path.abspath(os.path.join(root, d)) != out_dir)
+        for name in sorted(files):
+            full = os.path.join(root, name)
+            paths.append(os.path.relpath(full, source_dir).replace(os.sep, '/'))
+
+    if os.path.isdir(out_dir):
+        shutil.rmtree(out_dir)
+
+    manifest = {}
+
+    # stylesheets last, so the files they point at already have their names
+    for path in sorted(paths, key=lambda p: p.endswith('.css')):
+        with open(os.path.join(source_dir, path), 'rb') as f:
+            content = f.read()
+
+        if path.endswith('.css'):
+            content = _rewrite_css_urls(content.decode('utf-8'),
+                                        manifest).encode('utf-8')
+
+        hashed = fingerprint(path, content)
+        target = os.path.join(out_dir, hashed)
+        _write(target, content)
+
+        if os.path.splitext(path)[1].lower() not in INCOMPRESSIBLE:
+            _write_compressed(target, content)
+
+        manifest[path] = hashed
+
+    _write(os.path.join(out_dir, MANIFEST),
+           json.dumps(manifest, indent=2, sort_keys=True).encode())
+    return manifest
+
+
+def load_manifest(app):
+    """Read `app`'s asset manifest; empty if assets haven't been built."""
+
+    try:
+        with open(os.path.join(app.config['ASSETS_DIR'], MANIFEST)) as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        manifest = {}
+
+    app.extensions['assets'] = manifest
+    return manifest
+
+
+def asset_url(path):
+    """URL for the static file `path`, fingerprinted if it's been built."""
+
+    hashed = current_app.extensions['assets'].get(path)
+
+    if hashed is None:
+        return url_for('static', filename=path)
+
+    return url_for('built_asset', filename=hashed)
+
+
+def send_asset(filename):
+    """Serve a built asset, precompressed if the browser accepts it."""
+
+    directory = current_app.config['ASSETS_DIR']
+    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    encoding = None
+
+    for candidate, suffix in (('br', '.br'), ('gzip', '.gz')):
+        if (request.accept_encodings[candidate]
+                and os.path.isfile(os.path.join(directory, filename + suffix))):
+            encoding = candidate
+            filename += suffix
+            break
+
+    response = send_from_directory(directory, filename, mimetype=mimetype,
+                                   max_age=31536000)
+
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    response.headers['Cache-Control'] = IMMUTABLE
+    return response
+
+
+def init_assets(app):
+    """Serve built assets and give templates `asset_url`."""
+
+    app.config.setdefault('ASSETS_DIR', os.path.join(app.static_folder, 'dist'))
+
+    load_manifest(app)
+    app.jinja_env.globals['asset_url'] = asset_url
+    app.add_url_rule('/static/dist/<path:filename>', 'built_asset', send_asset)
+
+
+@click.command('build-assets')
+@with_appcontext
+def build_assets_command():
+    """Fingerprint and precompress static/ into ASSETS_DIR."""
+
+    manifest = build_assets(current_app.static_folder,
+                            current_app.config['ASSETS_DIR'])
+    load_manifest(current_app)
+
+    click.echo(f"Built {len(manifest)} asset(s) into {current_app.config['ASSETS_DIR']}"
+               + ("" if _brotli() else " (no brotli installed: .gz only)"))
@@ -0,0 +1,115 @@
+"""Login throughput under concurrency, for each password hashing mode.
+
+Logs a bench user in over and over from several client threads, through the
+Flask test client, and reports logins/second, latency percentiles and how
+many requests were turned away with a 503 because hashing was saturated.
+
+    python bench/login_throughput.py --concurrency 1 4 16 --rounds 10
+
+Runs against DATABASE_URL (default postgresql:///warbler-test) and only
+adds/updates its own bench user there.
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import threading
+from time import perf_counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+os.environ.setdefault('DATABASE_URL', "postgresql:///warbler-test")
+
+from app import app  # noqa: E402
+from models import db, User  # noqa: E402
+from passwords import MODES, init_password_hasher  # noqa: E402
+
+USERNAME = "login-bench"
+PASSWORD = "login-bench-password"
+
+
+def setup_user():
+    """Create the bench user, hashed at the configured cost."""
+
+    with app.app_context():
+        db.create_all()
+        user = User.query.filter_by(username=USERNAME).first()
+        if user is None:
+            User.signup(USERNAME, "login-bench@test.com", PASSWORD, None)
+        else:
+            user.password = app.extensions['password_hasher'].hash(PASSWORD)
+        db.session.commit()
+
+
+def run(concurrency, requests_per_client):
+    """Log in `requests_per_client` times from each of `concurrency` threads."""
+
+    latencies = []
+    statuses = []
+    lock = threading.Lock()
+
+    def client_loop():
+        client = app.test_client()
+        for _ in range(requests_per_client):
+            start = perf_counter()
+            resp = client.post("/login", data={"username": USERNAME,
+                                               "password": PASSWORD})
+            elapsed = perf_counter() - start
+            with lock:
+                latencies.append(elapsed)
+                statuses.append(resp.status_code)
+
+    threads = [threading.Thread(target=client_loop) for _ in range(concurrency)]
+    start = perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = perf_counter() - start
+
+    latencies.sort()
+    ok = statuses.count(302)
+
+    return {
+        'logins_per_sec': ok / wall,
+        'p50_ms': 1000 * statistics.median(latencies),
+        'p99_ms': 1000 * latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))],
+        'busy': statuses.count(503),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--modes', nargs='+', choices=MODES, default=list(MODES))
+    parser.add_argument('--concurrency', nargs='+', type=int, default=[1, 4, 16])
+    parser.add_argument('--requests', type=int, default=10,
+                        help='logins per client thread')
+    parser.add_argument('--rounds', type=int, default=12, help='bcrypt cost')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='hashing pool size (default: CPU count)')
+    parser.add_argument('--max-pending', type=int, default=None,
+                        help='hashing queue limit (default: 4 x workers)')
+    args = parser.parse_args()
+
+    app.config['WTF_CSRF_ENABLED'] = False
+    app.config['BCRYPT_LOG_ROUNDS'] = args.rounds
+    app.config['PASSWORD_HASH_WORKERS'] = args.workers
+    app.config['PASSWORD_HASH_MAX_PENDING'] = args.max_pending
+
+    print(f"{'mode':8} {'clients':>7} {'logins/s':>9} {'p50 ms':>8} {'p99 ms':>8} {'503s':>5}")
+
+    for mode in args.modes:
+        app.config['PASSWORD_HASH_MODE'] = mode
+        init_password_hasher(app)
+        setup_user()
+
+        for concurrency in args.concurrency:
+            r = run(concurrency, args.requests)
+            print(f"{mode:8} {concurrency:7} {r['logins_per_sec']:9.1f} "
+                  f"{r['p50_ms']:8.1f} {r['p99_ms']:8.1f} {r['busy']:5}")
+
+    app.extensions['password_hasher'].shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,282 @@
+"""Replay a recorded request trace and report latency and queries per route.
+
+A trace is JSONL, one request per line:
+
+    {"method": "POST", "path": "/users/toggle_like/12", "user": 7, "body": {}}
+
+`method` defaults to GET, `user` (logged in through a signed session
+cookie) and `body` (form fields) are optional. Requests go through the
+Flask test client, or with --server over HTTP to a threaded WSGI server
+started in this process, from --concurrency client threads.
+
+For each route (Flask endpoint) it reports p50/p95/p99 latency, SQL
+statements per request and server errors, plus overall throughput. Save a
+run with --save and later runs compare against it with --baseline, exiting
+1 if a route got slower than --tolerance allows or runs more queries.
+
+    python seed.py
+    python bench/replay.py bench/traces/sample.jsonl --save /tmp/baseline.json
+    python bench/replay.py bench/traces/sample.jsonl --baseline /tmp/baseline.json
+
+Runs against DATABASE_URL (default postgresql:///warbler). The sample
+trace expects the data from generator/; it likes and unlikes in pairs, so
+replaying it leaves the likes much as they were.
+"""
+
+import argparse
+import http.client
+import itertools
+import json
+import logging
+import os
+import sys
+import threading
+from collections import defaultdict
+from time import perf_counter
+from urllib.parse import urlencode
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+os.environ.setdefault('DATABASE_URL', "postgresql:///warbler")
+
+from flask import g, request  # noqa: E402
+from werkzeug.serving import make_server  # noqa: E402
+
+from app import app, CURR_USER_KEY  # noqa: E402
+
+REPLAY_HEADER = 'X-Replay-Id'
+
+
+def load_trace(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def percentile(ordered, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+class ServerSide:
+    """What the app saw of each replayed request: its endpoint and queries.
+
+    Recorded at teardown, so queries run while a streamed page is being
+    sent are counted too.
+    """
+
+    def __init__(self, app):
+        self.seen = {}
+        app.teardown_request(self.record)
+
+    def record(self, exc):
+        replay_id = request.headers.get(REPLAY_HEADER)
+        if replay_id is not None:
+            self.seen[replay_id] = (request.endpoint or "<unmatched>",
+                                    g.get('db_queries', 0))
+
+
+def session_signer():
+    """Signed session cookie values for user ids, made the way the app does."""
+
+    serializer = app.session_interface.get_signing_serializer(app)
+    cookies = {}
+
+    def sign(user_id):
+        if user_id not in cookies:
+            cookies[user_id] = serializer.dumps({CURR_USER_KEY: user_id})
+        return cookies[user_id]
+
+    return sign
+
+
+class TestClientTransport:
+
+    def __init__(self):
+        self.client = app.test_client()
+
+    def send(self, method, path, headers, body, session):
+        # the test client sends its own cookie jar, whatever the headers say
+        name = app.config['SESSION_COOKIE_NAME']
+        if session is None:
+            self.client.delete_cookie('localhost', name)
+        else:
+            self.client.set_cookie('localhost', name, session)
+
+        resp = self.client.open(path, method=method, headers=headers, data=body)
+        resp.get_data()
+        resp.close()
+        return resp.status_code
+
+
+class HTTPTransport:
+
+    def __init__(self, port):
+        self.connection = http.client.HTTPConnection('127.0.0.1', port)
+
+    def send(self, method, path, headers, body, session):
+        if session is not None:
+            headers['Cookie'] = f"{app.config['SESSION_COOKIE_NAME']}={session}"
+        if body:
+            body = urlencode(body)
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        self.connection.request(method, path, body=body or None, headers=headers)
+        resp = self.connection.getresponse()
+        resp.read()
+        return resp.status
+
+
+def replay(trace, concurrency, make_transport, server_side):
+    """Send every request in `trace`; returns `(samples, wall seconds)`.
+
+    Each sample is ``(route, status, seconds, queries)``.
+    """
+
+    sign = session_signer()
+    positions = itertools.count()
+    samples = []
+    lock = threading.Lock()
+
+    def client_loop():
+        transport = make_transport()
+
+        for position in positions:
+            if position >= len(trace):
+                return
+            entry = trace[position]
+
+            user = entry.get('user')
+            session = sign(user) if user is not None else None
+
+            start = perf_counter()
+            status = transport.send(entry.get('method', 'GET'), entry['path'],
+                                    {REPLAY_HEADER: str(position)},
+                                    entry.get('body'), session)
+            elapsed = perf_counter() - start
+
+            route, queries = server_side.seen.pop(str(position), ("<lost>", 0))
+            with lock:
+                samples.append((route, status, elapsed, queries))
+
+    threads = [threading.Thread(target=client_loop) for _ in range(concurrency)]
+    start = perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    return samples, perf_counter() - start
+
+
+def summarize(samples, wall):
+    """Per-route and overall numbers, as saved for --baseline."""
+
+    by_route = defaultdict(list)
+    for route, status, seconds, queries in samples:
+        by_route[route].append((status, seconds, queries))
+
+    routes = {}
+    for route, rows in sorted(by_route.items()):
+        latencies = sorted(seconds for _, seconds, _ in rows)
+        routes[route] = {
+            'requests': len(rows),
+            'p50_ms': 1000 * percentile(latencies, 0.50),
+            'p95_ms': 1000 * percentile(latencies, 0.95),
+            'p99_ms': 1000 * percentile(latencies, 0.99),
+            'queries': sum(queries for _, _, queries in rows) / len(rows),
+            'errors': sum(status >= 500 for status, _, _ in rows),
+        }
+
+    return {
+        'requests': len(samples),
+        'seconds': wall,
+        'throughput': len(samples) / wall,
+        'routes': routes,
+    }
+
+
+def compare(summary, baseline, tolerance):
+    """Regression messages for routes that got slower or chattier."""
+
+    problems = []
+
+    for route, before in baseline['routes'].items():
+        now = summary['routes'].get(route)
+        if now is None:
+            continue
+        if now['p95_ms'] > before['p95_ms'] * (1 + tolerance):
+            problems.append(f"{route}: p95 {before['p95_ms']:.1f} -> "
+                            f"{now['p95_ms']:.1f} ms")
+        # counts vary a little with the data (a like or an unlike)
+        if now['queries'] > before['queries'] + 0.5:
+            problems.append(f"{route}: {before['queries']:.1f} -> "
+                            f"{now['queries']:.1f} queries per request")
+        if now['errors'] > before['errors']:
+            problems.append(f"{route}: {now['errors']} server error(s)")
+
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('trace')
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--repeat', type=int, default=1,
+                        help='replay the trace this many times over')
+    parser.add_argument('--warmup', type=int, default=50,
+                        help='requests sent, and not counted, before the run')
+    parser.add_argument('--server', action='store_true',
+                        help='go over HTTP to a local WSGI server')
+    parser.add_argument('--save', metavar='JSON', help='write the summary here')
+    parser.add_argument('--baseline', metavar='JSON',
+                        help='compare against a summary saved earlier')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='allowed p95 slowdown, as a fraction')
+    args = parser.parse_args()
+
+    app.config['WTF_CSRF_ENABLED'] = False
+    trace = load_trace(args.trace) * args.repeat
+    server_side = ServerSide(app)
+
+    server = None
+    if args.server:
+        logging.getLogger('werkzeug').setLevel(logging.WARNING)
+        server = make_server('127.0.0.1', 0, app, threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+
+        def make_transport():
+            return HTTPTransport(server.server_port)
+    else:
+        make_transport = TestClientTransport
+
+    try:
+        replay(trace[:args.warmup], args.concurrency, make_transport, server_side)
+        summary = summarize(*replay(trace, args.concurrency, make_transport,
+                                    server_side))
+    finally:
+        if server is not None:
+            server.shutdown()
+
+    print(f"{'route':24} {'reqs':>6} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} "
+          f"{'queries':>8} {'5xx':>4}")
+    for route, r in summary['routes'].items():
+        print(f"{route:24} {r['requests']:6} {r['p50_ms']:8.1f} {r['p95_ms']:8.1f} "
+              f"{r['p99_ms']:8.1f} {r['queries']:8.1f} {r['errors']:4}")
+    print(f"{summary['requests']} requests in {summary['seconds']:.1f}s "
+          f"({summary['throughput']:.1f} req/s, concurrency {args.concurrency})")
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(summary, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            problems = compare(summary, json.load(f), args.tolerance)
+        for problem in problems:
+            print(f"REGRESSION {problem}")
+        if problems:
+            raise SystemExit(1)
+        print("No regressions against the baseline.")
+
+
+if __name__ == '__main__':
+    main()
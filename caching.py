@@ -0,0 +1,163 @@
+"""Conditional GET: strong ETags from row versions, and 304 responses.
+
+A response's ETag is a hash of the versions of the rows it's built from:
+message ids (messages never change) and ``User.updated_at`` (bumped by every
+update of a user row, counters included). That can be worked out from the
+rows alone, so a client that already has the current version gets a 304
+before anything is serialized.
+
+HTML pages get their Cache-Control from the policy declared on the view
+with `cache_policy`, ``private, no-cache`` by default: browsers may keep a
+page but must check with us before reusing it, and shared caches must not
+keep pages at all since they depend on who's logged in. Views that can tell
+cheaply whether a page changed (`messages_show`, `users_show`) call
+`page_not_modified` before rendering, which answers a conditional request
+with a 304 and otherwise has the rendered page tagged with validators.
+"""
+
+import glob
+import hashlib
+import json
+import os
+from datetime import timezone
+
+from flask import Response, current_app, g, request, session
+
+DEFAULT_POLICY = 'private, no-cache'
+
+
+def code_version(root):
+    """A hash of what pages are rendered with: the app's modules, templates
+    and asset manifest under `root`.
+
+    The same in every process running the same release, and different
+    after a deploy that could change a page.
+    """
+
+    paths = sorted(glob.glob(os.path.join(root, '*.py'))
+                   + glob.glob(os.path.join(root, 'templates', '**', '*'),
+                               recursive=True)
+                   + glob.glob(os.path.join(root, 'static', 'dist', 'manifest.json')))
+
+    digest = hashlib.sha1()
+    for path in paths:
+        if os.path.isfile(path):
+            digest.update(os.path.relpath(path, root).encode())
+            with open(path, 'rb') as f:
+                digest.update(f.read())
+
+    return digest.hexdigest()[:12]
+
+
+def row_etag(*versions):
+    """A strong ETag for a response built from rows at these `versions`."""
+
+    return hashlib.sha1(repr(versions).encode()).hexdigest()
+
+
+def compact_json(payload):
+    """Serialize `payload` without any optional whitespace."""
+
+    return json.dumps(payload, separators=(',', ':'), ensure_ascii=False)
+
+
+def client_has(etag, last_modified=None):
+    """Does the conditional request show the client already has this version?
+
+    If-None-Match wins over If-Modified-Since, as RFC 9110 says.
+    """
+
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+
+    if request.if_modified_since and last_modified is not None:
+        # HTTP dates have whole-second resolution
+        stamp = last_modified.replace(microsecond=0, tzinfo=timezone.utc)
+        return stamp <= request.if_modified_since
+
+    return False
+
+
+def conditional_json(etag, build, cache_control=DEFAULT_POLICY):
+    """A JSON response tagged `etag`, or a 304 if the client already has it.
+
+    `build` is only called, to make the payload, when the body is needed.
+    ``no-cache`` lets clients keep the response but has them revalidate it
+    each time, which is cheap once they hold the ETag.
+    """
+
+    if client_has(etag):
+        response = Response(status=304)
+    else:
+        response = Response(compact_json(build()), mimetype='application/json')
+
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = cache_control
+    # responses depend on who's logged in
+    response.vary.add('Cookie')
+    return response
+
+
+def cache_policy(cache_control):
+    """View decorator: send `cache_control` as the page's Cache-Control.
+
+    Goes below ``@app.route`` so the route registers the marked function.
+    """
+
+    def decorate(view):
+        view.cache_control = cache_control
+        return view
+
+    return decorate
+
+
+def page_not_modified(*versions, last_modified=None):
+    """Validate the current page against the client's copy.
+
+    `versions` must cover everything the page shows, the viewer included.
+    Returns a 304 response if the client is up to date; otherwise returns
+    None and the rendered page gets the ETag and Last-Modified.
+    """
+
+    etag = row_etag(current_app.config['CACHE_VERSION'], *versions)
+
+    # a pending flash message isn't part of any version; render it
+    if '_flashes' in session:
+        return None
+
+    g.page_validators = (etag, last_modified)
+
+    if not client_has(etag, last_modified):
+        return None
+
+    response = Response(status=304)
+    response.set_etag(etag)
+    return response
+
+
+def _apply_cache_policy(response):
+    """after_request: Cache-Control from the view's policy, plus validators."""
+
+    validators = g.pop('page_validators', None)
+    if validators and response.status_code == 200:
+        etag, last_modified = validators
+        response.set_etag(etag)
+        if last_modified is not None:
+            response.last_modified = last_modified.replace(tzinfo=timezone.utc)
+
+    # static files and the API set their own
+    if 'Cache-Control' not in response.headers:
+        view = current_app.view_functions.get(request.endpoint)
+        response.headers['Cache-Control'] = getattr(view, 'cache_control',
+                                                    DEFAULT_POLICY)
+
+    if validators:
+        response.vary.add('Cookie')
+
+    return response
+
+
+def init_caching(app):
+    """Apply per-view cache policies to `app`'s responses."""
+
+    app.after_request(_apply_cache_policy)
@@ -0,0 +1,79 @@
+"""Bulk reconciliation of the denormalized counters on `User` and `Message`.
+
+Day to day the counters are maintained incrementally (see the listeners in
+models.py). Bulk loads that skip the ORM, or any drift, are fixed by
+recomputing them from the source tables with aggregate SQL.
+"""
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import func, select
+
+from models import db, Follows, Likes, Message, User
+
+
+def _count(column, key, table=None):
+    """Correlated `count(*)` of rows whose `key` points at the outer row.
+
+    The outer row is a user unless `table` says otherwise.
+    """
+
+    table = User.__table__ if table is None else table
+
+    return (select(func.count())
+            .select_from(column.table)
+            .where(key == table.c.id)
+            .scalar_subquery())
+
+
+def _reconcile(table, fresh, batch_size):
+    """Set `fresh` counters on `table` wherever they're off, by id range."""
+
+    drifted = db.or_(*(table.c[name] != value for name, value in fresh.items()))
+
+    max_id = db.session.scalar(select(func.max(table.c.id))) or 0
+    fixed = 0
+
+    for low in range(0, max_id + 1, batch_size):
+        result = db.session.execute(
+            table.update()
+            .where(table.c.id.between(low, low + batch_size - 1), drifted)
+            .values(fresh))
+        db.session.commit()
+        fixed += result.rowcount
+
+    return fixed
+
+
+def reconcile_counters(batch_size=10000):
+    """Recompute every counter, committing one id range at a time.
+
+    Returns the number of rows whose counters were wrong.
+    """
+
+    fixed = _reconcile(User.__table__, {
+        'messages_count': _count(Message.id, Message.user_id),
+        'following_count': _count(Follows.user_following_id,
+                                  Follows.user_following_id),
+        'followers_count': _count(Follows.user_being_followed_id,
+                                  Follows.user_being_followed_id),
+        'likes_count': _count(Likes.id, Likes.user_id),
+    }, batch_size)
+
+    messages = Message.__table__
+    fixed += _reconcile(messages, {
+        'like_count': _count(Likes.id, Likes.message_id, messages),
+    }, batch_size)
+
+    return fixed
+
+
+@click.command('reconcile-counters')
+@click.option('--batch-size', default=10000, show_default=True,
+              help='Users per transaction.')
+@with_appcontext
+def reconcile_counters_command(batch_size):
+    """Recompute follower/following/message/like counts from scratch."""
+
+    fixed = reconcile_counters(batch_size)
+    click.echo(f"Fixed counters on {fixed} row(s).")
@@ -0,0 +1,165 @@
+"""Following and unfollowing users in bulk, and listing follows.
+
+`follow_users` and `unfollow_users` take any number of user ids and apply
+them with one ``INSERT ... ON CONFLICT DO NOTHING RETURNING`` or one
+``DELETE ... WHERE IN ... RETURNING`` against ``follows``, so the follower's
+existing follows are never loaded. What came back from RETURNING drives the
+counters and the precomputed timelines, and the result for each id says
+what happened to it. The single follow/unfollow views use the same code.
+
+`follow_page` reads the followers/following pages: newest follow first,
+keyset-paginated on ``(created_at, user id)`` like the message listings,
+with whether the viewer follows each user and each user follows the viewer
+worked out by outer joins in the same query.
+"""
+
+from collections import namedtuple
+
+from sqlalchemy import and_, delete, select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import aliased
+
+from models import db, adjust_counts, Follows, User
+from pagination import encode_cursor, keyset_filter
+from timelines import fanout_enabled, get_timeline_store
+
+FOLLOWED = 'followed'
+ALREADY_FOLLOWING = 'already_following'
+UNFOLLOWED = 'unfollowed'
+NOT_FOLLOWING = 'not_following'
+NOT_FOUND = 'not_found'
+SELF = 'self'
+
+
+def _unique(user_ids):
+    return list(dict.fromkeys(user_ids))
+
+
+def _update_timeline(follower_id, changed, per_author):
+    """Bring the follower's precomputed timeline in line with the change.
+
+    `per_author` is the store method for a single author, ``backfill`` or
+    ``prune``; for many authors, one rebuild is cheaper.
+    """
+
+    if not (changed and fanout_enabled()):
+        return
+
+    store = get_timeline_store()
+
+    if len(changed) == 1:
+        getattr(store, per_author)(follower_id, next(iter(changed)))
+    else:
+        store.rebuild(follower_id)
+
+
+def follow_users(follower_id, user_ids):
+    """Have `follower_id` follow each of `user_ids`.
+
+    Returns ``{user id: result}`` in the order given, the result being
+    FOLLOWED, ALREADY_FOLLOWING, NOT_FOUND or SELF. The caller commits.
+    """
+
+    user_ids = _unique(user_ids)
+    existing = set(db.session.scalars(
+        select(User.id).where(User.id.in_(user_ids)))) if user_ids else set()
+    wanted = [uid for uid in user_ids if uid in existing and uid != follower_id]
+
+    added = set()
+    if wanted:
+        connection = db.session.connection()
+        added = set(connection.execute(
+            insert(Follows.__table__)
+            .values([{'user_being_followed_id': uid,
+                      'user_following_id': follower_id} for uid in wanted])
+            .on_conflict_do_nothing()
+            .returning(Follows.user_being_followed_id)).scalars())
+
+        if added:
+            adjust_counts(connection, 'following_count', len(added), follower_id)
+            adjust_counts(connection, 'followers_count', 1, sorted(added))
+
+    _update_timeline(follower_id, added, 'backfill')
+
+    return {uid: (SELF if uid == follower_id
+                  else NOT_FOUND if uid not in existing
+                  else FOLLOWED if uid in added
+                  else ALREADY_FOLLOWING)
+            for uid in user_ids}
+
+
+def unfollow_users(follower_id, user_ids):
+    """Have `follower_id` stop following each of `user_ids`.
+
+    Returns ``{user id: result}`` in the order given, the result being
+    UNFOLLOWED or NOT_FOLLOWING (which includes ids of no user at all).
+    The caller commits.
+    """
+
+    user_ids = _unique(user_ids)
+
+    removed = set()
+    if user_ids:
+        connection = db.session.connection()
+        removed = set(connection.execute(
+            delete(Follows.__table__)
+            .where(Follows.user_following_id == follower_id,
+                   Follows.user_being_followed_id.in_(user_ids))
+            .returning(Follows.user_being_followed_id)).scalars())
+
+        if removed:
+            adjust_counts(connection, 'following_count', -len(removed), follower_id)
+            adjust_counts(connection, 'followers_count', -1, sorted(removed))
+
+    _update_timeline(follower_id, removed, 'prune')
+
+    return {uid: UNFOLLOWED if uid in removed else NOT_FOLLOWING
+            for uid in user_ids}
+
+
+FollowCard = namedtuple('FollowCard', 'user you_follow follows_you')
+
+
+def follow_page(user_id, listing, viewer_id, before, per_page):
+    """One page of `user_id`'s ``'followers'`` or ``'following'``.
+
+    Newest follow first, from the decoded cursor `before` (None for the
+    first page). Returns ``(cards, next_cursor)``: a FollowCard per user,
+    saying whether `viewer_id` follows them and they follow `viewer_id`.
+    """
+
+    if listing == 'followers':
+        owner, other = Follows.user_being_followed_id, Follows.user_following_id
+    else:
+        owner, other = Follows.user_following_id, Follows.user_being_followed_id
+
+    you_follow = aliased(Follows)
+    follows_you = aliased(Follows)
+
+    query = (select(User, Follows.created_at,
+                    you_follow.user_following_id.is_not(None),
+                    follows_you.user_following_id.is_not(None))
+             # User first, so deleted accounts are filtered out
+             .join(Follows, User.id == other)
+             .outerjoin(you_follow,
+                        and_(you_follow.user_following_id == viewer_id,
+                             you_follow.user_being_followed_id == other))
+             .outerjoin(follows_you,
+                        and_(follows_you.user_following_id == other,
+                             follows_you.user_being_followed_id == viewer_id))
+             .where(owner == user_id)
+             .order_by(Follows.created_at.desc(), other.desc())
+             .limit(per_page + 1))
+
+    if before:
+        query = query.where(keyset_filter(Follows.created_at, other, before))
+
+    rows = db.session.execute(query).all()
+    cards = [FollowCard(user, bool(yours), bool(theirs))
+             for user, _, yours, theirs in rows[:per_page]]
+
+    if len(rows) > per_page:
+        last = rows[per_page - 1]
+        return cards, encode_cursor(last.created_at, last.User.id)
+
+    return cards, None
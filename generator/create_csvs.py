@@ -3,75 +3,216 @@
 Students won't need to run this for the exercise; they will just use the CSV
 files that this generates. You should only need to run this if you wanted to
 tweak the CSV formats or generate fewer/more rows.
+
+It runs offline and streams rows straight into the files, so memory use
+doesn't depend on how many rows are asked for. Every block of ids gets its
+own seeded random generator: the same arguments always give the same rows,
+however many shards or workers they're split across. For a load test
+dataset:
+
+    python generator/create_csvs.py --users 1000000 --messages 20000000 \\
+        --shards 16 --out /tmp/snapshot
+    flask load-csvs /tmp/snapshot
+
+Each user follows an exponentially distributed number of others, picked by
+a power law, so a few users have huge followings and most have a handful.
+Authors are picked the same way, and timestamps crowd towards --end.
 """
 
+import argparse
 import csv
-from random import choice, randint, sample
-from itertools import permutations
-import requests
-from faker import Faker
-from helpers import get_random_datetime
+import os
+import time
+from collections import namedtuple
+from datetime import datetime, timedelta
+from multiprocessing import Pool
+from random import Random
+
+from helpers import (CITIES, DOMAINS, FIRST_NAMES, LAST_NAMES,
+                     power_law_rank, scatter, sentence, skewed_datetime)
 
 MAX_WARBLER_LENGTH = 140
 
-USERS_CSV_HEADERS = ['email', 'username', 'image_url', 'password', 'bio', 'header_image_url', 'location']
-MESSAGES_CSV_HEADERS = ['text', 'timestamp', 'user_id']
-FOLLOWS_CSV_HEADERS = ['user_being_followed_id', 'user_following_id']
+USERS_CSV_HEADERS = ['id', 'email', 'username', 'image_url', 'password', 'bio', 'header_image_url', 'location']
+MESSAGES_CSV_HEADERS = ['id', 'text', 'timestamp', 'user_id']
+FOLLOWS_CSV_HEADERS = ['user_being_followed_id', 'user_following_id', 'created_at']
 
 NUM_USERS = 300
 NUM_MESSAGES = 1000
-NUM_FOLLWERS = 5000
+FOLLOWS_PER_USER = 17
+
+# ids per seeded block; shards are whole numbers of blocks
+BLOCK_SIZE = 10000
 
-fake = Faker()
+# "password"
+PASSWORD = '$2b$12$Q1PUFjhN/AWRQ21LbGYvjeLpZZB6lfZ1BPwifHALGO6oIbyC3CmJe'
 
-# Generate random profile image URLs to use for users
+# Profile and header images, with nothing fetched at generation time
 
-image_urls = [
+image_urls = ["/static/images/default-pic.png"] + [
     f"https://randomuser.me/api/portraits/{kind}/{i}.jpg"
     for kind, count in [("lego", 10), ("men", 100), ("women", 100)]
     for i in range(count)
 ]
 
-# Generate random header image URLs to use for users
-
 header_image_urls = [
-    requests.get(f"http://www.splashbase.co/api/v1/images/{i}").json()['url']
-    for i in range(1, 46)
+    "/static/images/warbler-hero.jpg",
+    "/static/images/signed-out-home.jpg",
 ]
 
-with open('generator/users.csv', 'w') as users_csv:
-    users_writer = csv.DictWriter(users_csv, fieldnames=USERS_CSV_HEADERS)
-    users_writer.writeheader()
-
-    for i in range(NUM_USERS):
-        users_writer.writerow(dict(
-            email=fake.email(),
-            username=fake.user_name(),
-            image_url=choice(image_urls),
-            password='$2b$12$Q1PUFjhN/AWRQ21LbGYvjeLpZZB6lfZ1BPwifHALGO6oIbyC3CmJe',
-            bio=fake.sentence(),
-            header_image_url=choice(header_image_urls),
-            location=fake.city()
-        ))
-
-with open('generator/messages.csv', 'w') as messages_csv:
-    messages_writer = csv.DictWriter(messages_csv, fieldnames=MESSAGES_CSV_HEADERS)
-    messages_writer.writeheader()
-
-    for i in range(NUM_MESSAGES):
-        messages_writer.writerow(dict(
-            text=fake.paragraph()[:MAX_WARBLER_LENGTH],
-            timestamp=get_random_datetime(),
-            user_id=randint(1, NUM_USERS)
-        ))
-
-# Generate follows.csv from random pairings of users
-
-with open('generator/follows.csv', 'w') as follows_csv:
-    all_pairs = list(permutations(range(1, NUM_USERS + 1), 2))
-
-    users_writer = csv.DictWriter(follows_csv, fieldnames=FOLLOWS_CSV_HEADERS)
-    users_writer.writeheader()
-
-    for followed_user, follower in sample(all_pairs, NUM_FOLLWERS):
-        users_writer.writerow(dict(user_being_followed_id=followed_user, user_following_id=follower))
+Options = namedtuple('Options', 'seed users messages follows_per_user end span skew')
+
+
+def blocks(options, table, first_block, stop_block, count):
+    """`(rng, ids)` for each block of `table`'s 1-based ids in the range."""
+
+    for block in range(first_block, stop_block):
+        rng = Random(f"{options.seed}/{table}/{block}")
+        first_id = block * BLOCK_SIZE + 1
+        yield rng, range(first_id, min(first_id + BLOCK_SIZE, count + 1))
+
+
+def popular_users(options):
+    """Pick a user id by popularity rank, the popular ones spread over all ids."""
+
+    place = scatter(options.users, Random(f"{options.seed}/scatter").randrange(options.users))
+    return lambda rng: place(power_law_rank(rng, options.users)) + 1
+
+
+def user_rows(options, first_block, stop_block):
+
+    for rng, ids in blocks(options, 'users', first_block, stop_block, options.users):
+        for user_id in ids:
+            first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+            yield dict(
+                id=user_id,
+                email=f"{first}.{last}{user_id}@{rng.choice(DOMAINS)}",
+                username=f"{first}{last}{user_id}",
+                image_url=rng.choice(image_urls),
+                password=PASSWORD,
+                bio=sentence(rng, MAX_WARBLER_LENGTH),
+                header_image_url=rng.choice(header_image_urls),
+                location=rng.choice(CITIES),
+            )
+
+
+def message_rows(options, first_block, stop_block):
+
+    author = popular_users(options)
+
+    for rng, ids in blocks(options, 'messages', first_block, stop_block, options.messages):
+        for message_id in ids:
+            yield dict(
+                id=message_id,
+                text=sentence(rng, MAX_WARBLER_LENGTH),
+                timestamp=skewed_datetime(rng, options.end, options.span, options.skew),
+                user_id=author(rng),
+            )
+
+
+def follow_rows(options, first_block, stop_block):
+
+    followee = popular_users(options)
+
+    for rng, ids in blocks(options, 'follows', first_block, stop_block, options.users):
+        for follower in ids:
+            wanted = min(options.users - 1,
+                         round(rng.expovariate(1 / options.follows_per_user)))
+            following = set()
+
+            # popular users get picked again and again; give up eventually
+            for _ in range(wanted * 10):
+                if len(following) == wanted:
+                    break
+                followed = followee(rng)
+                if followed != follower and followed not in following:
+                    following.add(followed)
+                    yield dict(user_being_followed_id=followed, user_following_id=follower,
+                               created_at=skewed_datetime(rng, options.end, options.span,
+                                                          options.skew))
+
+
+TABLES = {
+    'users': (USERS_CSV_HEADERS, user_rows, lambda options: options.users),
+    'messages': (MESSAGES_CSV_HEADERS, message_rows, lambda options: options.messages),
+    'follows': (FOLLOWS_CSV_HEADERS, follow_rows, lambda options: options.users),
+}
+
+
+def shard_tasks(options, shards, out):
+    """`(table, path, first block, stop block, options)` for each output file."""
+
+    tasks = []
+
+    for table, (headers, rows, count) in TABLES.items():
+        total_blocks = -(-count(options) // BLOCK_SIZE)
+        parts = max(1, min(shards, total_blocks))
+
+        for shard in range(parts):
+            name = f"{table}.csv" if shards == 1 else f"{table}.{shard:04d}.csv"
+            tasks.append((table, os.path.join(out, name),
+                          total_blocks * shard // parts,
+                          total_blocks * (shard + 1) // parts,
+                          options))
+
+    return tasks
+
+
+def write_shard(task):
+    """Write one file; returns `(path, rows)`."""
+
+    table, path, first_block, stop_block, options = task
+    headers, rows, count = TABLES[table]
+    written = 0
+
+    with open(path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=headers)
+        writer.writeheader()
+        for row in rows(options, first_block, stop_block):
+            writer.writerow(row)
+            written += 1
+
+    return path, written
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument('--users', type=int, default=NUM_USERS)
+    parser.add_argument('--messages', type=int, default=NUM_MESSAGES)
+    parser.add_argument('--follows-per-user', type=float, default=FOLLOWS_PER_USER,
+                        help='average number of users each user follows')
+    parser.add_argument('--seed', default='warbler')
+    parser.add_argument('--end', type=datetime.fromisoformat,
+                        default=datetime.utcnow().replace(hour=0, minute=0, second=0,
+                                                          microsecond=0),
+                        help='newest message timestamp (default: today); '
+                             'pin it for repeatable output')
+    parser.add_argument('--days', type=float, default=730,
+                        help='how far back messages go')
+    parser.add_argument('--skew', type=float, default=3,
+                        help='1 spreads messages evenly; higher favours recent ones')
+    parser.add_argument('--shards', type=int, default=1,
+                        help='files per table, written as TABLE.NNNN.csv')
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--out', default='generator')
+    args = parser.parse_args(argv)
+
+    options = Options(args.seed, args.users, args.messages, args.follows_per_user,
+                      args.end, timedelta(days=args.days), args.skew)
+    os.makedirs(args.out, exist_ok=True)
+
+    start = time.perf_counter()
+    total = 0
+
+    with Pool(args.workers) as pool:
+        for path, rows in pool.imap_unordered(write_shard,
+                                              shard_tasks(options, args.shards, args.out)):
+            print(f"{path}: {rows} rows")
+            total += rows
+
+    elapsed = time.perf_counter() - start
+    print(f"Wrote {total} rows in {elapsed:.1f}s ({total / elapsed:,.0f} rows/s)")
+
+
+if __name__ == '__main__':
+    main()
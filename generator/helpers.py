@@ -1,14 +1,91 @@
 """Support functions for CSV generation."""
 
-from datetime import datetime
-from random import uniform
+from datetime import timedelta
+from math import gcd
 
+FIRST_NAMES = """
+    aaron abby adam alex alice amir ana andre anna ben bianca carl carmen
+    chen chris clara dan dana david diego elena eli emma eric eva felix fiona
+    gabe grace hana harry ian ida isaac ivy jack jade james jana jin john
+    jose julia kai kate ken kim lara leo lena liam lucy maya max mei mia nate
+    nina noah nora omar oscar owen paul priya quinn rafa rosa ryan sam sara
+    sean sofia tara theo tom uma victor vera will xena yara yuki zach zoe
+""".split()
 
-def get_random_datetime(year_gap=2):
-    """Get a random datetime within the last few years."""
+LAST_NAMES = """
+    adams ahmed baker bell brooks brown chen clark cole cruz davis diaz
+    evans fisher flores garcia gray green hall hill hughes ito james jones
+    kaur kelly khan kim king lee lewis lopez martin moore morgan murphy
+    nguyen ortiz park patel perez price reed reyes rivera ross ruiz sato
+    scott shah silva smith stone taylor thomas torres turner walker ward
+    white wilson wood wright young
+""".split()
 
-    now = datetime.now()
-    then = now.replace(year=now.year - year_gap)
-    random_timestamp = uniform(then.timestamp(), now.timestamp())
+DOMAINS = ["example.com", "example.net", "example.org", "mail.test"]
 
-    return datetime.fromtimestamp(random_timestamp)
+CITIES = """
+    Austin Berlin Boston Cairo Chicago Denver Dublin Houston Lagos Lima
+    Lisbon London Madrid Melbourne Miami Montreal Mumbai Nairobi Oakland
+    Osaka Paris Portland Seattle Seoul Sydney Taipei Toronto Vancouver
+""".split()
+
+WORDS = """
+    about after again air all also always another answer around away back
+    because before best better big book both bring build call came change
+    city close coffee come could day different dinner does done down during
+    each early end even every face family far feel few find first follow
+    food found friend from game get give going good great group hand happy
+    hard have head hear help here high home hope house idea important into
+    just keep kind know large last late learn leave left life light like
+    line little live long look lot love made make many maybe mean might
+    money more morning most move much music must name need never new next
+    night nothing now number often old once only open other over own paper
+    part people place plan play point post problem put question quite read
+    real really right road room run same saw say school see seem set share
+    should show side since small something soon start still story study
+    sure take talk team tell thing think those thought through time today
+    together tonight took top town tried turn under until upon use very wait
+    walk want watch water way week weekend well went while why will with
+    without word work world would write year yes yesterday young
+""".split()
+
+
+def scatter(count, salt):
+    """A bijection on ``range(count)``: ``lambda i: (i * stride + salt) % count``.
+
+    Lets popularity ranks map onto ids spread over the whole id range,
+    without holding a permutation in memory.
+    """
+
+    stride = int(count * 0.6180339887) | 1
+    while gcd(stride, count) != 1:
+        stride += 2
+
+    return lambda i: (i * stride + salt) % count
+
+
+def power_law_rank(rng, count):
+    """A rank in ``range(count)``, low ranks far more likely (roughly Zipf).
+
+    ``int(N ** random())`` is log-uniform, so each rank's probability falls
+    off as 1/rank, like follower counts on real social networks.
+    """
+
+    return int((count + 1) ** rng.random()) - 1
+
+
+def skewed_datetime(rng, end, span, skew):
+    """A datetime in the `span` before `end`, recent ones more likely.
+
+    `skew` of 1 is uniform; larger values crowd timestamps towards `end`.
+    """
+
+    return end - timedelta(seconds=span.total_seconds() * rng.random() ** skew)
+
+
+def sentence(rng, max_length):
+    """Some random words, capitalized and ending in a full stop."""
+
+    words = rng.choices(WORDS, k=rng.randint(4, 24))
+    text = " ".join(words).capitalize()[:max_length - 1].rstrip()
+    return text + "."
@@ -0,0 +1,455 @@
+"""Background jobs: deferred work, kept in the database, run off the request.
+
+Work that needn't finish before the response (fanning a message out to
+followers' timelines, purging a deleted account) is queued with `enqueue`
+as a row of the ``jobs`` table, in the same transaction as the change that
+called for it: if the request rolls back the job goes too, and once it
+commits the job can't be lost. Postgres is the queue; there's no broker.
+
+A `Worker` claims due jobs, lowest ``priority`` first, and runs them on a
+thread pool, each in its own app context and session. With ``JOBS_MODE``
+``thread`` (the default) every web process runs one, woken as soon as a
+request commits a job; with ``external`` they're left to `flask jobs work`.
+Any number of workers can share the table:
+
+* they claim one at a time, under an advisory lock, so a job type's
+  ``concurrency`` caps how many of it run at once across all of them;
+* a claim holds for ``JOBS_LEASE_SECONDS`` and is renewed while the job
+  runs, so the jobs of a worker that died are claimed again once it lapses;
+* a job that raises is tried again after ``JOBS_RETRY_SECONDS``, doubling
+  each time up to ``JOBS_RETRY_MAX_SECONDS``, until it's had
+  ``max_attempts``; then it's left ``failed`` for `flask jobs retry`.
+
+So a job can run more than once; job functions must be safe to repeat.
+"""
+
+import os
+import signal
+import socket
+import threading
+import time
+import traceback
+import uuid
+from collections import Counter, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import click
+from flask import current_app, has_app_context
+from flask.cli import with_appcontext
+from sqlalchemy import and_, case, delete, event, func, select, update
+from sqlalchemy.orm import Session
+
+from models import db, Job
+
+MODES = ('thread', 'external')
+STATUSES = ('queued', 'running', 'done', 'failed')
+
+# held (for the transaction) by whichever worker is claiming jobs
+CLAIM_LOCK = 0x6a6f6273
+
+jobs = Job.__table__
+
+JobType = namedtuple('JobType', 'function priority max_attempts concurrency')
+
+JOB_TYPES = {}
+
+
+def job(name, priority=0, max_attempts=5, concurrency=None):
+    """Function decorator: register it as the job `name`.
+
+    It's called with the job's payload as keyword arguments, in an app
+    context, and the session is committed when it returns. At most
+    `concurrency` jobs of this name run at once (any number if None).
+    """
+
+    def register(function):
+        JOB_TYPES[name] = JobType(function, priority, max_attempts, concurrency)
+        return function
+
+    return register
+
+
+def enqueue(name, delay=None, priority=None, **payload):
+    """Queue the job `name`, to be called with `payload`. The caller commits.
+
+    `delay` (a timedelta) holds it back that long; `priority` overrides the
+    job type's. Returns the new Job.
+    """
+
+    job_type = JOB_TYPES[name]
+    queued = Job(name=name,
+                 payload=payload,
+                 priority=job_type.priority if priority is None else priority,
+                 max_attempts=job_type.max_attempts,
+                 run_at=datetime.utcnow() + (delay or timedelta()))
+
+    db.session.add(queued)
+    db.session.info['jobs_queued'] = True
+    return queued
+
+
+@event.listens_for(Session, 'after_commit')
+def _wake_worker(session):
+    if session.info.pop('jobs_queued', False) and has_app_context():
+        worker = current_app.extensions.get('jobs')
+        if worker is not None:
+            worker.wake()
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_queued(session):
+    session.info.pop('jobs_queued', None)
+
+
+def retry_delay(attempts):
+    """How long a job that has failed `attempts` times waits to run again."""
+
+    config = current_app.config
+    seconds = min(config['JOBS_RETRY_SECONDS'] * 2 ** (attempts - 1),
+                  config['JOBS_RETRY_MAX_SECONDS'])
+    return timedelta(seconds=seconds)
+
+
+def _release_lapsed(connection, now):
+    """Give up the claims of workers that stopped renewing them."""
+
+    spent = jobs.c.attempts >= jobs.c.max_attempts
+    connection.execute(
+        update(jobs)
+        .where(jobs.c.status == 'running', jobs.c.locked_until < now)
+        .values(status=case((spent, 'failed'), else_='queued'),
+                finished_at=case((spent, now), else_=None),
+                run_at=now,
+                locked_by=None,
+                locked_until=None,
+                last_error="worker stopped renewing its claim"))
+
+
+def claim_jobs(worker_id, limit, lease):
+    """Claim up to `limit` due jobs for `worker_id`, for `lease` (a timedelta).
+
+    Job types at their concurrency limit are passed over. Returns the
+    claimed jobs' `(id, name, payload)`, most urgent first. Commits.
+    """
+
+    now = datetime.utcnow()
+    connection = db.session.connection()
+    connection.execute(select(func.pg_advisory_xact_lock(CLAIM_LOCK)))
+
+    _release_lapsed(connection, now)
+
+    running = Counter(dict(connection.execute(
+        select(jobs.c.name, func.count())
+        .where(jobs.c.status == 'running')
+        .group_by(jobs.c.name)).all()))
+
+    claimed = []
+
+    while len(claimed) < limit:
+        names = [name for name, job_type in JOB_TYPES.items()
+                 if job_type.concurrency is None
+                 or running[name] < job_type.concurrency]
+        if not names:
+            break
+
+        due = connection.execute(
+            select(jobs.c.id, jobs.c.name, jobs.c.payload)
+            .where(jobs.c.status == 'queued',
+                   jobs.c.run_at <= now,
+                   jobs.c.name.in_(names))
+            .order_by(jobs.c.priority, jobs.c.run_at, jobs.c.id)
+            .limit(limit - len(claimed))).all()
+
+        taken = []
+        for row in due:
+            concurrency = JOB_TYPES[row.name].concurrency
+            if concurrency is None or running[row.name] < concurrency:
+                running[row.name] += 1
+                taken.append(row)
+
+        if taken:
+            connection.execute(
+                update(jobs)
+                .where(jobs.c.id.in_([row.id for row in taken]))
+                .values(status='running',
+                        attempts=jobs.c.attempts + 1,
+                        locked_by=worker_id,
+                        locked_until=now + lease))
+            claimed.extend(taken)
+
+        # all taken: nothing else is due. Otherwise a type filled up, so
+        # look again without it.
+        if len(taken) == len(due):
+            break
+
+    db.session.commit()
+    return [tuple(row) for row in claimed]
+
+
+def renew_claims(worker_id, lease):
+    """Extend the claims on the jobs `worker_id` is running. Commits."""
+
+    db.session.execute(
+        update(jobs)
+        .where(jobs.c.status == 'running', jobs.c.locked_by == worker_id)
+        .values(locked_until=datetime.utcnow() + lease))
+    db.session.commit()
+
+
+def finish_job(worker_id, job_id, error=None):
+    """Record that a claimed job succeeded, or failed with `error`. Commits.
+
+    Does nothing if the claim lapsed and the job is no longer the worker's.
+    """
+
+    now = datetime.utcnow()
+    mine = and_(jobs.c.id == job_id,
+                jobs.c.status == 'running',
+                jobs.c.locked_by == worker_id)
+    values = dict(locked_by=None, locked_until=None)
+
+    if error is None:
+        values.update(status='done', finished_at=now)
+    else:
+        row = db.session.execute(
+            select(jobs.c.attempts, jobs.c.max_attempts).where(mine)).first()
+        if row is None:
+            return
+
+        values['last_error'] = error
+        if row.attempts >= row.max_attempts:
+            values.update(status='failed', finished_at=now)
+        else:
+            values.update(status='queued', run_at=now + retry_delay(row.attempts))
+
+    db.session.execute(update(jobs).where(mine).values(values))
+    db.session.commit()
+
+
+def run_job(worker_id, job_id, name, payload):
+    """Run a claimed job and record how it went."""
+
+    try:
+        JOB_TYPES[name].function(**payload)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        current_app.logger.exception("job %s (%s) failed", job_id, name)
+        finish_job(worker_id, job_id, traceback.format_exc())
+    else:
+        finish_job(worker_id, job_id)
+
+
+class Worker:
+    """Claims jobs and runs them on `threads` threads, in `app`'s context."""
+
+    def __init__(self, app, threads=None):
+        config = app.config
+
+        self.app = app
+        self.threads = threads or config['JOBS_THREADS']
+        self.poll_interval = config['JOBS_POLL_SECONDS']
+        self.lease = timedelta(seconds=config['JOBS_LEASE_SECONDS'])
+        self.id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+        self._running = set()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+
+    def wake(self):
+        """Look for jobs now rather than at the next poll."""
+
+        self._wake.set()
+
+    def stop(self):
+        """Claim nothing more; `run` returns once running jobs finish."""
+
+        self._stop.set()
+        self._wake.set()
+
+    def run(self, burst=False):
+        """Work until stopped or, with `burst`, until nothing is left due."""
+
+        executor = ThreadPoolExecutor(self.threads, thread_name_prefix='jobs')
+        renewed = time.monotonic()
+
+        try:
+            with self.app.app_context():
+                while not self._stop.is_set():
+                    self._wake.clear()
+                    self._running = {f for f in self._running if not f.done()}
+                    free = self.threads - len(self._running)
+
+                    try:
+                        claimed = claim_jobs(self.id, free, self.lease) if free else []
+
+                        if (self._running and time.monotonic() - renewed
+                                > self.lease.total_seconds() / 3):
+                            renew_claims(self.id, self.lease)
+                            renewed = time.monotonic()
+                    except Exception:
+                        # the database went away, say; try again next poll
+                        db.session.rollback()
+                        self.app.logger.exception("job worker %s", self.id)
+                        claimed = []
+
+                    for job_id, name, payload in claimed:
+                        future = executor.submit(self._run, job_id, name, payload)
+                        future.add_done_callback(lambda _: self._wake.set())
+                        self._running.add(future)
+
+                    if burst and not self._running:
+                        break
+
+                    # a full batch means there may be more due right away
+                    if not free or len(claimed) < free:
+                        self._wake.wait(self.poll_interval)
+        finally:
+            executor.shutdown(wait=True)
+
+    def _run(self, job_id, name, payload):
+        with self.app.app_context():
+            run_job(self.id, job_id, name, payload)
+
+
+def init_jobs(app):
+    """Run a worker in this process, from its first request, if the mode says.
+
+    Not while testing: tests run jobs themselves with `Worker.run`.
+    """
+
+    if app.config['JOBS_MODE'] not in MODES:
+        raise ValueError(f"unknown jobs mode: {app.config['JOBS_MODE']!r}")
+
+    app.extensions['jobs'] = None
+    starting = threading.Lock()
+
+    @app.before_request
+    def start_job_worker():
+        if (app.extensions['jobs'] is not None
+                or app.config['JOBS_MODE'] != 'thread' or app.testing):
+            return
+
+        with starting:
+            if app.extensions['jobs'] is None:
+                worker = Worker(app)
+                threading.Thread(target=worker.run, name='jobs-worker',
+                                 daemon=True).start()
+                app.extensions['jobs'] = worker
+
+
+##############################################################################
+# flask jobs ...
+
+
+@click.group('jobs')
+def jobs_cli():
+    """Run and inspect background jobs."""
+
+
+@jobs_cli.command('work')
+@click.option('--threads', type=int, help='Jobs run at once (JOBS_THREADS).')
+@click.option('--burst', is_flag=True, help='Stop once nothing is due.')
+@with_appcontext
+def work_command(threads, burst):
+    """Run jobs until stopped."""
+
+    worker = Worker(current_app._get_current_object(), threads)
+    signal.signal(signal.SIGTERM, lambda signum, frame: worker.stop())
+
+    click.echo(f"Worker {worker.id} running {worker.threads} thread(s).")
+    try:
+        worker.run(burst)
+    except KeyboardInterrupt:
+        pass
+    click.echo("Stopped.")
+
+
+@jobs_cli.command('stats')
+@with_appcontext
+def stats_command():
+    """Jobs by name and status, and how long the oldest due one has waited."""
+
+    now = datetime.utcnow()
+    # queued but not due yet: delayed, or waiting to be retried
+    state = case((and_(jobs.c.status == 'queued', jobs.c.run_at > now), 'waiting'),
+                 else_=jobs.c.status)
+    rows = db.session.execute(
+        select(jobs.c.name, state, func.count(), func.min(jobs.c.run_at))
+        .group_by(jobs.c.name, state)
+        .order_by(jobs.c.name)).all()
+
+    columns = ('queued', 'waiting', 'running', 'failed', 'done')
+    table = {}
+    for name, status, count, oldest in rows:
+        counts = table.setdefault(name, dict.fromkeys(columns, 0))
+        counts[status] = count
+        if status == 'queued':
+            counts['oldest'] = now - oldest
+
+    click.echo(f"{'job':<24}" + "".join(f"{c:>9}" for c in columns)
+               + "  oldest due")
+    for name, counts in table.items():
+        oldest = counts.get('oldest')
+        click.echo(f"{name:<24}" + "".join(f"{counts[c]:>9}" for c in columns)
+                   + (f"  {int(oldest.total_seconds())}s ago" if oldest else ""))
+
+
+@jobs_cli.command('list')
+@click.option('--status', type=click.Choice(STATUSES),
+              help='Only these (default: all but done).')
+@click.option('--name', help='Only jobs with this name.')
+@click.option('--limit', type=int, default=20, show_default=True)
+@with_appcontext
+def list_command(status, name, limit):
+    """Show jobs, most urgent first, with their last error."""
+
+    query = (Job.query.filter(Job.status == status) if status
+             else Job.query.filter(Job.status != 'done'))
+    if name:
+        query = query.filter(Job.name == name)
+
+    for queued in query.order_by(Job.priority, Job.run_at, Job.id).limit(limit):
+        click.echo(f"#{queued.id} {queued.name} {queued.payload} {queued.status}, "
+                   f"priority {queued.priority}, "
+                   f"{queued.attempts}/{queued.max_attempts} attempts, "
+                   f"run at {queued.run_at:%Y-%m-%d %H:%M:%S}")
+        if queued.last_error:
+            click.echo(f"    {queued.last_error.strip().splitlines()[-1]}")
+
+
+@jobs_cli.command('retry')
+@click.argument('job_ids', nargs=-1, type=int)
+@click.option('--all', 'every', is_flag=True, help='Every failed job.')
+@with_appcontext
+def retry_command(job_ids, every):
+    """Queue failed jobs again, with their attempts reset."""
+
+    if not (job_ids or every):
+        raise click.UsageError("Give job ids, or --all.")
+
+    failed = jobs.c.status == 'failed'
+    if job_ids:
+        failed = and_(failed, jobs.c.id.in_(job_ids))
+
+    result = db.session.execute(
+        update(jobs).where(failed).values(status='queued', attempts=0,
+                                          run_at=datetime.utcnow(),
+                                          finished_at=None))
+    db.session.commit()
+    click.echo(f"Queued {result.rowcount} job(s) again.")
+
+
+@jobs_cli.command('prune')
+@click.option('--days', type=int, default=7, show_default=True,
+              help='Keep finished jobs this many days.')
+@with_appcontext
+def prune_command(days):
+    """Delete jobs that finished successfully a while ago."""
+
+    result = db.session.execute(
+        delete(jobs).where(jobs.c.status == 'done',
+                           jobs.c.finished_at < datetime.utcnow() - timedelta(days=days)))
+    db.session.commit()
+    click.echo(f"Deleted {result.rowcount} job(s).")
@@ -0,0 +1,358 @@
+"""Bulk loading of Warbler's CSV snapshots.
+
+`flask load-csvs DIRECTORY` loads ``users.csv``, ``messages.csv`` and
+``follows.csv`` (whichever are present, each possibly split into shards
+like ``users.0000.csv``) into the tables of the same name.
+On PostgreSQL each file is streamed through ``COPY ... FROM STDIN`` in
+fixed-size chunks, so memory use doesn't grow with the file; other
+databases get batched executemany INSERTs instead.
+
+A fresh load (the default) empties every table first; ``--append`` adds
+to what's there. Either way the schema must already be in place (`flask db
+upgrade`): the loader never creates or drops tables, so whatever the
+migrations made (the trigram search index, say) survives a reload. Secondary indexes, unique and foreign key constraints are
+dropped for the load and rebuilt once afterwards (on PostgreSQL, and by
+default only for fresh loads), which is much cheaper than maintaining them
+row by row. Tables whose foreign keys only point at tables that are already
+loaded go in parallel, as do the shards of a table, each on its own
+connection.
+
+COPY skips the ORM, so the user counters are reconciled at the end, and
+serial sequences are moved past any ids that came from the files.
+"""
+
+import csv
+import glob
+import os
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from itertools import islice
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import DateTime, Integer, func, inspect, select, text
+from sqlalchemy.exc import DBAPIError
+
+from counters import reconcile_counters
+from models import db, Follows, Message, User
+
+# in dependency order
+TABLES = [User.__table__, Message.__table__, Follows.__table__]
+
+COPY_CHUNK_SIZE = 1 << 20
+
+TableLoad = namedtuple('TableLoad', 'table rows seconds')
+
+
+def load_stages(tables):
+    """Group `tables` into stages that can each be loaded in parallel.
+
+    A table goes in the first stage after every table it references
+    (among `tables`) has been loaded.
+    """
+
+    pending = list(tables)
+    stages = []
+
+    while pending:
+        stage = [t for t in pending
+                 if all(fk.column.table is t or fk.column.table not in pending
+                        for fk in t.foreign_keys)]
+        if not stage:
+            raise ValueError("circular foreign keys between tables")
+        stages.append(stage)
+        pending = [t for t in pending if t not in stage]
+
+    return stages
+
+
+def _header(path):
+    with open(path, newline='') as f:
+        return next(csv.reader(f))
+
+
+def copy_table(engine, table, path, chunk_size=COPY_CHUNK_SIZE):
+    """Stream the CSV at `path` into `table` with COPY; returns the row count."""
+
+    preparer = engine.dialect.identifier_preparer
+    columns = ', '.join(preparer.quote(c) for c in _header(path))
+    sql = (f"COPY {preparer.format_table(table)} ({columns}) "
+           "FROM STDIN WITH (FORMAT csv, HEADER true)")
+
+    connection = engine.raw_connection()
+    try:
+        with connection.cursor() as cursor, open(path, newline='') as f:
+            cursor.copy_expert(sql, f, size=chunk_size)
+            rows = cursor.rowcount
+        connection.commit()
+    finally:
+        connection.close()
+
+    return rows
+
+
+def _converter(column):
+    """Parse a CSV field for `column`; empty fields are NULL, as with COPY."""
+
+    if isinstance(column.type, DateTime):
+        parse = datetime.fromisoformat
+    elif isinstance(column.type, Integer):
+        parse = int
+    else:
+        parse = str
+
+    return lambda value: parse(value) if value != '' else None
+
+
+def insert_table(engine, table, path, batch_size=5000):
+    """Load the CSV at `path` into `table` with batched INSERTs.
+
+    The fallback for databases without COPY. Returns the row count.
+    """
+
+    rows = 0
+
+    with open(path, newline='') as f, engine.begin() as connection:
+        reader = csv.reader(f)
+        header = next(reader)
+        converters = [_converter(table.c[name]) for name in header]
+
+        while True:
+            batch = [{name: convert(value)
+                      for name, convert, value in zip(header, converters, row)}
+                     for row in islice(reader, batch_size)]
+            if not batch:
+                break
+            connection.execute(table.insert(), batch)
+            rows += len(batch)
+
+    return rows
+
+
+def load_table(engine, table, path, batch_size=5000):
+    """Load one CSV into `table`, the fastest way `engine` supports."""
+
+    start = time.perf_counter()
+
+    if engine.dialect.name == 'postgresql':
+        rows = copy_table(engine, table, path)
+    else:
+        rows = insert_table(engine, table, path, batch_size)
+
+    return TableLoad(table.name, rows, time.perf_counter() - start)
+
+
+def drop_deferrable(connection, tables):
+    """Drop `tables`' foreign keys, unique constraints and secondary indexes.
+
+    PostgreSQL only. Returns the DDL that puts them back, in order.
+    """
+
+    names = [t.name for t in tables]
+
+    constraints = connection.execute(text(
+        "SELECT conrelid::regclass::text, conname, contype, "
+        "       pg_get_constraintdef(oid) "
+        "FROM pg_constraint "
+        "WHERE conrelid = ANY(CAST(:tables AS regclass[])) "
+        "  AND contype IN ('f', 'u') "
+        # foreign keys go first and come back last
+        "ORDER BY contype = 'f' DESC, conname"),
+        {'tables': names}).all()
+
+    indexes = connection.execute(text(
+        "SELECT indexname, indexdef FROM pg_indexes i "
+        "WHERE schemaname = current_schema() AND tablename = ANY(:tables) "
+        "  AND NOT EXISTS (SELECT 1 FROM pg_constraint c "
+        "                  WHERE c.conname = i.indexname) "
+        "ORDER BY indexname"),
+        {'tables': names}).all()
+
+    quote = connection.dialect.identifier_preparer.quote
+    restore = []
+
+    for table, name, kind, definition in constraints:
+        connection.execute(text(
+            f"ALTER TABLE {table} DROP CONSTRAINT {quote(name)}"))
+        restore.insert(0, f"ALTER TABLE {table} ADD CONSTRAINT {quote(name)} "
+                          f"{definition}")
+
+    for name, definition in indexes:
+        connection.execute(text(f"DROP INDEX {quote(name)}"))
+        restore.insert(0, definition)
+
+    return restore
+
+
+def restore_deferred(engine, restore):
+    """Run the DDL `drop_deferrable` returned, each statement on its own.
+
+    One that fails (a duplicate key or a dangling reference in the loaded
+    rows, say) doesn't stop the rest. Returns `(ddl, error)` for each
+    failure.
+    """
+
+    failures = []
+
+    for ddl in restore:
+        try:
+            with engine.begin() as connection:
+                connection.execute(text(ddl))
+        except DBAPIError as exc:
+            failures.append((ddl, str(exc.orig).strip().splitlines()[0]))
+
+    return failures
+
+
+def empty_tables(connection):
+    """Delete every row of every table the app defines."""
+
+    tables = db.metadata.sorted_tables
+
+    if connection.dialect.name == 'postgresql':
+        quote = connection.dialect.identifier_preparer.quote
+        connection.execute(text(
+            f"TRUNCATE {', '.join(quote(t.name) for t in tables)} "
+            "RESTART IDENTITY CASCADE"))
+    else:
+        for table in reversed(tables):
+            connection.execute(table.delete())
+
+
+def reset_sequences(connection, tables):
+    """Move each serial id sequence past the largest id in its table."""
+
+    for table in tables:
+        if 'id' not in table.c:
+            continue
+        connection.execute(
+            select(func.setval(
+                func.pg_get_serial_sequence(table.name, 'id'),
+                func.coalesce(select(func.max(table.c.id)).scalar_subquery(), 0) + 1,
+                False)))
+
+
+def find_csvs(directory):
+    """``{table name: [CSV paths]}`` for the files in `directory`.
+
+    A table's rows are in ``TABLE.csv`` and/or shards ``TABLE.NNNN.csv``.
+    """
+
+    sources = {}
+
+    for table in TABLES:
+        paths = sorted(glob.glob(os.path.join(directory, f"{table.name}.csv"))
+                       + glob.glob(os.path.join(directory, f"{table.name}.*.csv")))
+        if paths:
+            sources[table.name] = paths
+
+    return sources
+
+
+def load_csvs(sources, append=False, defer_indexes=None, workers=4,
+              batch_size=5000):
+    """Load `sources`, ``{table name: [CSV paths]}``, into the database.
+
+    Without `append` every table is emptied first. The tables must exist
+    (`flask db upgrade`). `defer_indexes` defaults to deferring for fresh
+    loads only. Returns a `TableLoad` per
+    table, in load order; a sharded table's time is its slowest shard's.
+
+    Raises RuntimeError naming any index or constraint the loaded rows
+    wouldn't allow back; everything else is restored regardless.
+    """
+
+    engine = db.engine
+    postgres = engine.dialect.name == 'postgresql'
+    tables = [t for t in TABLES if t.name in sources]
+
+    missing = [t.name for t in tables if not inspect(engine).has_table(t.name)]
+    if missing:
+        raise RuntimeError(f"no {', '.join(missing)} table(s); "
+                           "run `flask db upgrade` first")
+
+    if not append:
+        with engine.begin() as connection:
+            empty_tables(connection)
+
+    if defer_indexes is None:
+        defer_indexes = not append
+    restore = []
+
+    if defer_indexes and postgres:
+        with engine.begin() as connection:
+            restore = drop_deferrable(connection, tables)
+
+    results = []
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for stage in load_stages(tables):
+                files = [(t, path) for t in stage for path in sources[t.name]]
+                loads = list(pool.map(
+                    lambda file: load_table(engine, *file, batch_size), files))
+
+                for t in stage:
+                    mine = [load for load in loads if load.table == t.name]
+                    results.append(TableLoad(t.name,
+                                             sum(load.rows for load in mine),
+                                             max(load.seconds for load in mine)))
+    finally:
+        failures = restore_deferred(engine, restore)
+
+    if postgres:
+        with engine.begin() as connection:
+            reset_sequences(connection, tables)
+
+    # COPY skips the listeners that keep the counters, and the in-process
+    # caches of user rows and search postings
+    reconcile_counters()
+    current_app.extensions['user_cache'].clear()
+    current_app.extensions.pop('user_search', None)
+
+    if failures:
+        raise RuntimeError(
+            "loaded, but could not restore:\n" +
+            "\n".join(f"  {ddl}\n    {error}" for ddl, error in failures))
+
+    return results
+
+
+@click.command('load-csvs')
+@click.argument('directory', default='generator',
+                type=click.Path(exists=True, file_okay=False))
+@click.option('--append', is_flag=True,
+              help='Add to the existing tables instead of emptying them.')
+@click.option('--defer-indexes/--keep-indexes', default=None,
+              help='Rebuild indexes and constraints after loading '
+                   '(default: only for a fresh load).')
+@click.option('--workers', default=4, show_default=True,
+              help='Files loaded at once, where foreign keys allow.')
+@click.option('--batch-size', default=5000, show_default=True,
+              help='Rows per INSERT when COPY is not available.')
+@with_appcontext
+def load_csvs_command(directory, append, defer_indexes, workers, batch_size):
+    """Bulk load users/messages/follows CSVs from DIRECTORY."""
+
+    sources = find_csvs(directory)
+
+    if not sources:
+        raise click.UsageError(f"No users/messages/follows CSVs in {directory}")
+
+    start = time.perf_counter()
+    try:
+        results = load_csvs(sources, append, defer_indexes, workers, batch_size)
+    except RuntimeError as exc:
+        raise click.ClickException(str(exc))
+    elapsed = time.perf_counter() - start
+
+    for load in results:
+        rate = load.rows / load.seconds if load.seconds else 0
+        click.echo(f"{load.table}: {load.rows} rows in {load.seconds:.2f}s "
+                   f"({rate:,.0f} rows/s)")
+
+    total = sum(load.rows for load in results)
+    click.echo(f"Loaded {total} rows in {elapsed:.2f}s "
+               f"({total / elapsed:,.0f} rows/s overall)")
@@ -0,0 +1,189 @@
+"""Per-route latency and database metrics, served at /metrics.
+
+Every request records its latency, status code, number of SQL statements
+and time spent in the database, per endpoint. The numbers are exposed in
+the Prometheus text format. Recording is a couple of `perf_counter()` calls
+per request and statement plus a short critical section, so it can stay
+switched on in production.
+
+Each process keeps its own numbers; scrape every worker (or run one worker
+per container) when serving with several processes.
+"""
+
+import bisect
+import threading
+from time import perf_counter
+
+from flask import Response, abort, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (1, 2, 3, 5, 10, 20, 50, 100, 250)
+
+
+class Histogram:
+    """A Prometheus-style histogram with one series per label value."""
+
+    def __init__(self, name, help_text, buckets):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self._series = {}
+
+    def observe(self, label, value):
+        """Record `value`; the caller holds the registry lock."""
+
+        series = self._series.get(label)
+        if series is None:
+            # one slot per bucket, then +Inf, sum, count
+            series = self._series[label] = [0] * (len(self.buckets) + 3)
+
+        series[bisect.bisect_left(self.buckets, value)] += 1
+        series[-2] += value
+        series[-1] += 1
+
+    def render(self, label_name):
+        yield f"# HELP {self.name} {self.help_text}"
+        yield f"# TYPE {self.name} histogram"
+
+        for label, series in sorted(self._series.items()):
+            labels = f'{label_name}="{label}"'
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), series):
+                cumulative += count
+                yield f'{self.name}_bucket{{{labels},le="{bound}"}} {cumulative}'
+            yield f"{self.name}_sum{{{labels}}} {series[-2]}"
+            yield f"{self.name}_count{{{labels}}} {series[-1]}"
+
+
+class Metrics:
+    """Everything recorded by this process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = {}
+        self.latency = Histogram(
+            "warbler_request_duration_seconds",
+            "Time to handle a request, by endpoint.",
+            LATENCY_BUCKETS)
+        self.db_queries = Histogram(
+            "warbler_request_db_queries",
+            "SQL statements run per request, by endpoint.",
+            QUERY_COUNT_BUCKETS)
+        self.db_time = Histogram(
+            "warbler_request_db_seconds",
+            "Time spent in the database per request, by endpoint.",
+            LATENCY_BUCKETS)
+
+    def observe_request(self, endpoint, method, status, seconds, queries, db_seconds):
+        """Record one finished request."""
+
+        key = (endpoint, method, status)
+
+        with self._lock:
+            self.requests[key] = self.requests.get(key, 0) + 1
+            self.latency.observe(endpoint, seconds)
+            self.db_queries.observe(endpoint, queries)
+            self.db_time.observe(endpoint, db_seconds)
+
+    def render(self):
+        """The current numbers in Prometheus text exposition format."""
+
+        with self._lock:
+            lines = [
+                "# HELP warbler_requests_total Requests handled, by endpoint and status.",
+                "# TYPE warbler_requests_total counter",
+            ]
+            for (endpoint, method, status), count in sorted(self.requests.items()):
+                lines.append(
+                    f'warbler_requests_total{{endpoint="{endpoint}",'
+                    f'method="{method}",status="{status}"}} {count}')
+
+            for histogram in (self.latency, self.db_queries, self.db_time):
+                lines.extend(histogram.render("endpoint"))
+
+        return "\n".join(lines) + "\n"
+
+
+def _start_request():
+    g.metrics_start = perf_counter()
+    g.db_queries = 0
+    g.db_seconds = 0.0
+
+
+# The start time goes on the statement's execution context, which is
+# dropped with it even when the statement fails (and after_cursor_execute
+# never fires), rather than on the long-lived pooled connection.
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None and has_request_context():
+        context._query_start = perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, '_query_start', None)
+
+    if started is None:
+        return
+
+    elapsed = perf_counter() - started
+
+    if has_request_context() and 'db_queries' in g:
+        g.db_queries += 1
+        g.db_seconds += elapsed
+
+
+def init_metrics(app):
+    """Record metrics for `app` and serve them at /metrics.
+
+    If `METRICS_TOKEN` is set, /metrics requires it as a bearer token.
+    """
+
+    metrics = app.extensions['metrics'] = Metrics()
+
+    if not event.contains(Engine, 'before_cursor_execute', _before_cursor_execute):
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+
+    app.before_request(_start_request)
+
+    @app.after_request
+    def record_request(response):
+        if 'metrics_start' not in g:
+            return response
+
+        # `g` outlives the request context for a streamed body, and still
+        # collects the queries run while the body is generated
+        stats = g._get_current_object()
+        endpoint = request.endpoint or "<unmatched>"
+        method = request.method
+
+        def record():
+            metrics.observe_request(
+                endpoint,
+                method,
+                response.status_code,
+                perf_counter() - stats.metrics_start,
+                stats.db_queries,
+                stats.db_seconds)
+
+        # a streamed page is only done once the server has sent all of it
+        if response.is_streamed:
+            response.call_on_close(record)
+        else:
+            record()
+
+        return response
+
+    @app.route('/metrics')
+    def metrics_endpoint():
+        """Prometheus scrape endpoint."""
+
+        token = app.config.get('METRICS_TOKEN')
+        if token and request.headers.get('Authorization') != f"Bearer {token}":
+            abort(403)
+
+        return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+    return metrics
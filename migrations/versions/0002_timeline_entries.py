@@ -0,0 +1,43 @@
+"""timeline_entries for fan-out-on-write home timelines
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-17 09:10:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0002'
+down_revision = '0001'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'timeline_entries',
+        sa.Column('owner_id', sa.Integer(), nullable=False),
+        sa.Column('message_id', sa.Integer(), nullable=False),
+        sa.Column('author_id', sa.Integer(), nullable=False),
+        sa.Column('timestamp', sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(['author_id'], ['users.id'], ondelete='cascade'),
+        sa.ForeignKeyConstraint(['message_id'], ['messages.id'],
+                                ondelete='cascade'),
+        sa.ForeignKeyConstraint(['owner_id'], ['users.id'], ondelete='cascade'),
+        sa.PrimaryKeyConstraint('owner_id', 'message_id'),
+    )
+    op.create_index('ix_timeline_entries_owner_timestamp', 'timeline_entries',
+                    ['owner_id', 'timestamp', 'message_id'])
+    op.create_index('ix_timeline_entries_owner_author', 'timeline_entries',
+                    ['owner_id', 'author_id'])
+
+
+def downgrade():
+    op.drop_index('ix_timeline_entries_owner_author',
+                  table_name='timeline_entries')
+    op.drop_index('ix_timeline_entries_owner_timestamp',
+                  table_name='timeline_entries')
+    op.drop_table('timeline_entries')
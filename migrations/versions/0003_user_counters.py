@@ -0,0 +1,43 @@
+"""denormalized counters on users
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-17 09:20:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0003'
+down_revision = '0002'
+branch_labels = None
+depends_on = None
+
+COUNTERS = ['messages_count', 'following_count', 'followers_count', 'likes_count']
+
+
+def upgrade():
+    for name in COUNTERS:
+        op.add_column('users', sa.Column(name, sa.Integer(), nullable=False,
+                                         server_default='0'))
+
+    # fill them in for existing rows; `flask reconcile-counters` does the
+    # same thing in batches if this is too big for one transaction
+    op.execute("""
+        UPDATE users SET
+            messages_count = (SELECT count(*) FROM messages
+                              WHERE messages.user_id = users.id),
+            following_count = (SELECT count(*) FROM follows
+                               WHERE follows.user_following_id = users.id),
+            followers_count = (SELECT count(*) FROM follows
+                               WHERE follows.user_being_followed_id = users.id),
+            likes_count = (SELECT count(*) FROM likes
+                           WHERE likes.user_id = users.id)
+    """)
+
+
+def downgrade():
+    for name in reversed(COUNTERS):
+        op.drop_column('users', name)
@@ -0,0 +1,38 @@
+"""indexes for the hot query shapes; allow many likes per message
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-17 09:30:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0004'
+down_revision = '0003'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_messages_user_timestamp', 'messages',
+                    ['user_id', sa.text('timestamp DESC'), sa.text('id DESC')])
+    op.create_index('ix_follows_following_followed', 'follows',
+                    ['user_following_id', 'user_being_followed_id'])
+
+    # message_id was unique, so only one user could ever like a message;
+    # uniqueness belongs on the (user, message) pair
+    op.drop_constraint('likes_message_id_key', 'likes', type_='unique')
+    op.create_unique_constraint('uq_likes_user_message', 'likes',
+                                ['user_id', 'message_id'])
+    op.create_index('ix_likes_message_id', 'likes', ['message_id'])
+
+
+def downgrade():
+    op.drop_index('ix_likes_message_id', table_name='likes')
+    op.drop_constraint('uq_likes_user_message', 'likes', type_='unique')
+    op.create_unique_constraint('likes_message_id_key', 'likes', ['message_id'])
+    op.drop_index('ix_follows_following_followed', table_name='follows')
+    op.drop_index('ix_messages_user_timestamp', table_name='messages')
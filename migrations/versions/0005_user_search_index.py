@@ -0,0 +1,43 @@
+"""trigram index for user search (only where pg_trgm is available)
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-17 11:00:00.000000
+
+"""
+import logging
+
+from alembic import op
+import sqlalchemy as sa
+
+logger = logging.getLogger('alembic.runtime.migration')
+
+
+# revision identifiers, used by Alembic.
+revision = '0005'
+down_revision = '0004'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    bind = op.get_bind()
+
+    if bind.dialect.name != 'postgresql':
+        return
+
+    available = bind.execute(sa.text(
+        "SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'")).first()
+    if available is None:
+        # search falls back to plain LIKE matching (see search.py)
+        logger.warning("pg_trgm is not available; skipping the user search index")
+        return
+
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    op.execute("CREATE INDEX ix_users_username_trgm ON users "
+               "USING gin (lower(username) gin_trgm_ops)")
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute("DROP INDEX IF EXISTS ix_users_username_trgm")
@@ -0,0 +1,26 @@
+"""row version timestamp on users
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-17 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0006'
+down_revision = '0005'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('users', sa.Column(
+        'updated_at', sa.DateTime(), nullable=False,
+        server_default=sa.text("(now() at time zone 'utc')")))
+
+
+def downgrade():
+    op.drop_column('users', 'updated_at')
@@ -0,0 +1,49 @@
+"""per-message like counts, like timestamps and trending messages
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2026-10-17 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0007'
+down_revision = '0006'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('messages', sa.Column(
+        'like_count', sa.Integer(), nullable=False, server_default='0'))
+    op.execute(
+        "UPDATE messages SET like_count = counts.n "
+        "FROM (SELECT message_id, count(*) AS n FROM likes "
+        "      GROUP BY message_id) AS counts "
+        "WHERE messages.id = counts.message_id")
+
+    # existing likes have no recorded time; they count as liked just now
+    op.add_column('likes', sa.Column(
+        'created_at', sa.DateTime(), nullable=False,
+        server_default=sa.text("(now() at time zone 'utc')")))
+    op.create_index('ix_likes_created_at', 'likes', ['created_at'])
+
+    op.create_table(
+        'trending_messages',
+        sa.Column('message_id', sa.Integer(), nullable=False),
+        sa.Column('score', sa.Float(), nullable=False),
+        sa.Column('computed_at', sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(['message_id'], ['messages.id'],
+                                ondelete='cascade'),
+        sa.PrimaryKeyConstraint('message_id'),
+    )
+
+
+def downgrade():
+    op.drop_table('trending_messages')
+    op.drop_index('ix_likes_created_at', table_name='likes')
+    op.drop_column('likes', 'created_at')
+    op.drop_column('messages', 'like_count')
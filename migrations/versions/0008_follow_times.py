@@ -0,0 +1,37 @@
+"""follow timestamps for the paginated followers/following pages
+
+Revision ID: 0008
+Revises: 0007
+Create Date: 2026-10-17 14:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0008'
+down_revision = '0007'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # existing follows have no recorded time; they count as made just now
+    op.add_column('follows', sa.Column(
+        'created_at', sa.DateTime(), nullable=False,
+        server_default=sa.text("(now() at time zone 'utc')")))
+    op.create_index('ix_follows_followed_created', 'follows',
+                    ['user_being_followed_id', 'created_at', 'user_following_id'])
+    op.create_index('ix_follows_following_created', 'follows',
+                    ['user_following_id', 'created_at', 'user_being_followed_id'])
+    # the new index answers everything this one did
+    op.drop_index('ix_follows_following_followed', table_name='follows')
+
+
+def downgrade():
+    op.create_index('ix_follows_following_followed', 'follows',
+                    ['user_following_id', 'user_being_followed_id'])
+    op.drop_index('ix_follows_following_created', table_name='follows')
+    op.drop_index('ix_follows_followed_created', table_name='follows')
+    op.drop_column('follows', 'created_at')
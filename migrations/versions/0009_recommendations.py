@@ -0,0 +1,37 @@
+"""who-to-follow recommendations
+
+Revision ID: 0009
+Revises: 0008
+Create Date: 2026-10-17 16:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0009'
+down_revision = '0008'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'recommendations',
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('recommended_id', sa.Integer(), nullable=False),
+        sa.Column('score', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='cascade'),
+        sa.ForeignKeyConstraint(['recommended_id'], ['users.id'],
+                                ondelete='cascade'),
+        sa.PrimaryKeyConstraint('user_id', 'recommended_id'),
+    )
+    op.create_index('ix_recommendations_recommended_id', 'recommendations',
+                    ['recommended_id'])
+
+
+def downgrade():
+    op.drop_index('ix_recommendations_recommended_id',
+                  table_name='recommendations')
+    op.drop_table('recommendations')
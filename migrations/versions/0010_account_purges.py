@@ -0,0 +1,38 @@
+"""soft-deleted accounts and their background purges
+
+Revision ID: 0010
+Revises: 0009
+Create Date: 2026-10-17 18:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0010'
+down_revision = '0009'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('users', sa.Column('deleted_at', sa.DateTime(), nullable=True))
+    op.create_index('ix_users_deleted', 'users', ['id'],
+                    postgresql_where=sa.text('deleted_at IS NOT NULL'))
+
+    op.create_table(
+        'account_purges',
+        sa.Column('user_id', sa.Integer(), autoincrement=False, nullable=False),
+        sa.Column('stage', sa.Text(), nullable=False),
+        sa.Column('rows_deleted', sa.Integer(), nullable=False),
+        sa.Column('requested_at', sa.DateTime(), nullable=False),
+        sa.Column('finished_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('user_id'),
+    )
+
+
+def downgrade():
+    op.drop_table('account_purges')
+    op.drop_index('ix_users_deleted', table_name='users')
+    op.drop_column('users', 'deleted_at')
@@ -2,10 +2,13 @@
 
 from datetime import datetime
 
-from flask_bcrypt import Bcrypt
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import delete, event, func, select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session, with_loader_criteria
+
+from passwords import HasherBusy, get_hasher
 
-bcrypt = Bcrypt()
 db = SQLAlchemy()
 
 
@@ -26,6 +29,34 @@ class Follows(db.Model):
         primary_key=True,
     )
 
+    # the followers/following pages list the newest follows first
+    created_at = db.Column(
+        db.DateTime,
+        nullable=False,
+        default=datetime.utcnow,
+        server_default=db.text("(now() at time zone 'utc')"),
+    )
+
+    # "who follows X" and "who does X follow", newest follow first; the
+    # primary key answers "does X follow Y"
+    __table_args__ = (
+        db.Index('ix_follows_followed_created',
+                 'user_being_followed_id', 'created_at', 'user_following_id'),
+        db.Index('ix_follows_following_created',
+                 'user_following_id', 'created_at', 'user_being_followed_id'),
+    )
+
+    @classmethod
+    def exists(cls, follower_id, followed_id):
+        """Does `follower_id` follow `followed_id`? (A primary key lookup.)"""
+
+        return db.session.scalar(
+            select(
+                select(cls)
+                .where(cls.user_following_id == follower_id,
+                       cls.user_being_followed_id == followed_id)
+                .exists()))
+
 
 class Likes(db.Model):
     """Mapping user likes to warbles."""
@@ -45,9 +76,60 @@ class Likes(db.Model):
     message_id = db.Column(
         db.Integer,
         db.ForeignKey('messages.id', ondelete='cascade'),
-        unique=True
     )
 
+    # trending.py weighs likes by how recent they are
+    created_at = db.Column(
+        db.DateTime,
+        nullable=False,
+        default=datetime.utcnow,
+        server_default=db.text("(now() at time zone 'utc')"),
+    )
+
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'message_id',
+                            name='uq_likes_user_message'),
+        db.Index('ix_likes_message_id', 'message_id'),
+        db.Index('ix_likes_created_at', 'created_at'),
+    )
+
+    @classmethod
+    def toggle(cls, user_id, message_id):
+        """Unlike the message if `user_id` likes it, else like it.
+
+        A DELETE ... RETURNING, then if nothing was there an INSERT ... ON
+        CONFLICT DO NOTHING, both on the (user_id, message_id) unique index,
+        so a double-click can neither add two likes nor fail. Returns whether
+        the message is liked afterwards. The caller commits.
+        """
+
+        likes = cls.__table__
+        connection = db.session.connection()
+
+        removed = connection.execute(
+            delete(likes)
+            .where(likes.c.user_id == user_id, likes.c.message_id == message_id)
+            .returning(likes.c.id)).first()
+
+        if removed:
+            adjust_counts(connection, 'likes_count', -1, user_id)
+            adjust_counts(connection, 'like_count', -1, message_id,
+                          Message.__table__)
+            return False
+
+        added = connection.execute(
+            insert(likes)
+            .values(user_id=user_id, message_id=message_id)
+            .on_conflict_do_nothing(constraint='uq_likes_user_message')
+            .returning(likes.c.id)).first()
+
+        # nothing added: a concurrent request liked it first
+        if added:
+            adjust_counts(connection, 'likes_count', 1, user_id)
+            adjust_counts(connection, 'like_count', 1, message_id,
+                          Message.__table__)
+        return True
+
 
 class User(db.Model):
     """User in the system."""
@@ -94,25 +176,84 @@ class User(db.Model):
         nullable=False,
     )
 
-    messages = db.relationship('Message')
+    # Denormalized counts, kept in step by the listeners at the bottom of
+    # this module (and rebuilt by `flask reconcile-counters`).
+
+    messages_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    following_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    followers_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    likes_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    # bumped by every UPDATE of the row, counters included; the API's ETags
+    # use it as the row version
+    updated_at = db.Column(
+        db.DateTime,
+        nullable=False,
+        default=datetime.utcnow,
+        onupdate=datetime.utcnow,
+        server_default=db.text("(now() at time zone 'utc')"),
+    )
+
+    # set when the account is deleted; the row itself goes once its purge
+    # (see purge.py) has removed everything else of theirs
+    deleted_at = db.Column(
+        db.DateTime,
+    )
+
+    # the (few) accounts waiting to be purged, for hiding their messages
+    __table_args__ = (
+        db.Index('ix_users_deleted', 'id',
+                 postgresql_where=db.text('deleted_at IS NOT NULL')),
+    )
+
+    # Deleting a user leaves its messages, follows and likes to the
+    # database's ON DELETE CASCADE instead of loading them all first.
+
+    messages = db.relationship('Message', passive_deletes='all')
 
     followers = db.relationship(
         "User",
         secondary="follows",
         primaryjoin=(Follows.user_being_followed_id == id),
-        secondaryjoin=(Follows.user_following_id == id)
+        secondaryjoin=(Follows.user_following_id == id),
+        passive_deletes=True,
     )
 
     following = db.relationship(
         "User",
         secondary="follows",
         primaryjoin=(Follows.user_following_id == id),
-        secondaryjoin=(Follows.user_being_followed_id == id)
+        secondaryjoin=(Follows.user_being_followed_id == id),
+        passive_deletes=True,
     )
 
     likes = db.relationship(
         'Message',
-        secondary="likes"
+        secondary="likes",
+        passive_deletes=True,
     )
 
     def __repr__(self):
@@ -121,14 +262,46 @@ class User(db.Model):
     def is_followed_by(self, other_user):
         """Is this user followed by `other_user`?"""
 
-        found_user_list = [user for user in self.followers if user == other_user]
-        return len(found_user_list) == 1
+        return Follows.exists(other_user.id, self.id)
 
     def is_following(self, other_user):
         """Is this user following `other_use`?"""
 
-        found_user_list = [user for user in self.following if user == other_user]
-        return len(found_user_list) == 1
+        return Follows.exists(self.id, other_user.id)
+
+    def following_ids_among(self, user_ids):
+        """Which of `user_ids` does this user follow? Returns a set.
+
+        One indexed query for a whole page of users, instead of calling
+        `is_following` per card.
+        """
+
+        user_ids = list(user_ids)
+
+        if not user_ids:
+            return set()
+
+        return set(db.session.scalars(
+            select(Follows.user_being_followed_id)
+            .where(Follows.user_following_id == self.id,
+                   Follows.user_being_followed_id.in_(user_ids))))
+
+    def liked_ids_among(self, message_ids):
+        """Which of `message_ids` has this user liked? Returns a set.
+
+        Only the messages actually on the page are looked up, so the cost
+        doesn't grow with how many likes the user has overall.
+        """
+
+        message_ids = list(message_ids)
+
+        if not message_ids:
+            return set()
+
+        return set(db.session.scalars(
+            select(Likes.message_id)
+            .where(Likes.user_id == self.id,
+                   Likes.message_id.in_(message_ids))))
 
     @classmethod
     def signup(cls, username, email, password, image_url):
@@ -137,7 +310,7 @@ class User(db.Model):
         Hashes password and adds user to system.
         """
 
-        hashed_pwd = bcrypt.generate_password_hash(password).decode('UTF-8')
+        hashed_pwd = get_hasher().hash(password)
 
         user = User(
             username=username,
@@ -158,13 +331,22 @@ class User(db.Model):
         and, if it finds such a user, returns that user object.
 
         If can't find matching user (or if password is wrong), returns False.
+
+        A password hashed at a different cost than the configured one is
+        rehashed; the caller commits it along with anything else.
         """
 
         user = cls.query.filter_by(username=username).first()
 
         if user:
-            is_auth = bcrypt.check_password_hash(user.password, password)
+            hasher = get_hasher()
+            is_auth = hasher.check(user.password, password)
             if is_auth:
+                if hasher.needs_rehash(user.password):
+                    try:
+                        user.password = hasher.hash(password)
+                    except HasherBusy:
+                        pass  # not worth failing the login over; next time
                 return user
 
         return False
@@ -188,7 +370,7 @@ class Message(db.Model):
     timestamp = db.Column(
         db.DateTime,
         nullable=False,
-        default=datetime.utcnow(),
+        default=datetime.utcnow,
     )
 
     user_id = db.Column(
@@ -197,8 +379,395 @@ class Message(db.Model):
         nullable=False,
     )
 
+    # denormalized, like the counters on User
+    like_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
     user = db.relationship('User')
 
+    @classmethod
+    def with_authors(cls):
+        """Message query that loads each message's author in the same SELECT.
+
+        Use it for anything that renders a list of messages, so showing
+        `msg.user` doesn't cost a query per author.
+        """
+
+        return cls.query.options(db.joinedload(cls.user))
+
+
+# timelines and profile pages: a user's messages, newest first
+db.Index('ix_messages_user_timestamp',
+         Message.user_id, Message.timestamp.desc(), Message.id.desc())
+
+
+class TimelineEntry(db.Model):
+    """A message fanned out onto one user's precomputed home timeline."""
+
+    __tablename__ = 'timeline_entries'
+
+    owner_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='cascade'),
+        primary_key=True,
+    )
+
+    message_id = db.Column(
+        db.Integer,
+        db.ForeignKey('messages.id', ondelete='cascade'),
+        primary_key=True,
+    )
+
+    author_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='cascade'),
+        nullable=False,
+    )
+
+    timestamp = db.Column(
+        db.DateTime,
+        nullable=False,
+    )
+
+    __table_args__ = (
+        db.Index('ix_timeline_entries_owner_timestamp',
+                 'owner_id', 'timestamp', 'message_id'),
+        db.Index('ix_timeline_entries_owner_author', 'owner_id', 'author_id'),
+    )
+
+
+class TrendingMessage(db.Model):
+    """One of the messages ranked by `flask compute-trending`."""
+
+    __tablename__ = 'trending_messages'
+
+    message_id = db.Column(
+        db.Integer,
+        db.ForeignKey('messages.id', ondelete='cascade'),
+        primary_key=True,
+    )
+
+    score = db.Column(
+        db.Float,
+        nullable=False,
+    )
+
+    computed_at = db.Column(
+        db.DateTime,
+        nullable=False,
+    )
+
+
+class AccountPurge(db.Model):
+    """A deleted account whose rows are being purged; see purge.py.
+
+    Kept after the user row goes, as a record of the purge.
+    """
+
+    __tablename__ = 'account_purges'
+
+    # the purged user's id, not one of our own
+    user_id = db.Column(
+        db.Integer,
+        primary_key=True,
+        autoincrement=False,
+    )
+
+    # what's being removed now; see purge.STAGES
+    stage = db.Column(
+        db.Text,
+        nullable=False,
+    )
+
+    rows_deleted = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+    )
+
+    requested_at = db.Column(
+        db.DateTime,
+        nullable=False,
+        default=datetime.utcnow,
+    )
+
+    finished_at = db.Column(
+        db.DateTime,
+    )
+
+
+class Recommendation(db.Model):
+    """An account suggested to a user by `flask compute-recommendations`."""
+
+    __tablename__ = 'recommendations'
+
+    user_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='cascade'),
+        primary_key=True,
+    )
+
+    recommended_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='cascade'),
+        primary_key=True,
+    )
+
+    # how many of the accounts the user follows follow this one
+    score = db.Column(
+        db.Integer,
+        nullable=False,
+    )
+
+    # for the cascade when the recommended account is deleted
+    __table_args__ = (
+        db.Index('ix_recommendations_recommended_id', 'recommended_id'),
+    )
+
+
+class Job(db.Model):
+    """A piece of deferred work for the job worker; see jobs.py."""
+
+    __tablename__ = 'jobs'
+
+    id = db.Column(
+        db.Integer,
+        primary_key=True,
+    )
+
+    # a name registered with `jobs.job`
+    name = db.Column(
+        db.Text,
+        nullable=False,
+    )
+
+    # keyword arguments for the job's function
+    payload = db.Column(
+        db.JSON,
+        nullable=False,
+        default=dict,
+    )
+
+    # lower runs first
+    priority = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+    )
+
+    # queued, running, done or failed
+    status = db.Column(
+        db.Text,
+        nullable=False,
+        default='queued',
+    )
+
+    attempts = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+    )
+
+    max_attempts = db.Column(
+        db.Integer,
+        nullable=False,
+    )
+
+    # not claimed before this; pushed back after each failure
+    run_at = db.Column(
+        db.DateTime,
+        nullable=False,
+        default=datetime.utcnow,
+    )
+
+    # the worker running it, and until when, unless it renews its claim
+    locked_by = db.Column(
+        db.Text,
+    )
+
+    locked_until = db.Column(
+        db.DateTime,
+    )
+
+    last_error = db.Column(
+        db.Text,
+    )
+
+    created_at = db.Column(
+        db.DateTime,
+        nullable=False,
+        default=datetime.utcnow,
+    )
+
+    finished_at = db.Column(
+        db.DateTime,
+    )
+
+    # claiming (status 'queued', in order) and counting what's running
+    __table_args__ = (
+        db.Index('ix_jobs_status_priority', 'status', 'priority', 'run_at', 'id'),
+    )
+
+
+##############################################################################
+# Deleted accounts
+#
+# A deleted account, and its messages, are left out of every ORM query run
+# through the session until their purge removes them for good.
+# Pass ``execution_options(include_deleted=True)`` to see them anyway.
+# Core statements on the tables (as the purge and the counters use) and
+# writes aren't filtered.
+
+
+@event.listens_for(Session, 'do_orm_execute')
+def _hide_deleted_accounts(execute_state):
+    if (not execute_state.is_select
+            or execute_state.is_column_load
+            or execute_state.is_relationship_load
+            or execute_state.execution_options.get('include_deleted', False)):
+        return
+
+    # the table, not the entity, or the first criterion would apply here too
+    users = User.__table__
+
+    execute_state.statement = execute_state.statement.options(
+        with_loader_criteria(User, lambda cls: cls.deleted_at.is_(None),
+                             include_aliases=True),
+        with_loader_criteria(Message, lambda cls: cls.user_id.not_in(
+            select(users.c.id).where(users.c.deleted_at.is_not(None))),
+            include_aliases=True),
+    )
+
+
+##############################################################################
+# Counter maintenance
+#
+# Inserting or deleting Message, Follows and Likes rows through the session
+# adjusts the owning users' counters (and the liked message's like_count)
+# in the same flush. Rows removed by the
+# database's ON DELETE CASCADE are accounted for before the parent row goes.
+# (Appending to the `User.following`/`likes` collections bypasses this; add
+# Follows/Likes rows instead.)
+
+
+def adjust_counts(connection, column, delta, user_ids, table=None):
+    """Add `delta` to `column` for the users selected by `user_ids`.
+
+    `user_ids` is a single id or a SELECT of ids. With `table` (the messages
+    table, for ``like_count``) they're ids of that table's rows instead.
+    """
+
+    table = User.__table__ if table is None else table
+    where = (table.c.id == user_ids if isinstance(user_ids, int)
+             else table.c.id.in_(user_ids))
+
+    connection.execute(
+        table.update().where(where).values({column: table.c[column] + delta}))
+
+
+@event.listens_for(Message, 'after_insert')
+def _message_added(mapper, connection, msg):
+    adjust_counts(connection, 'messages_count', 1, msg.user_id)
+
+
+@event.listens_for(Message, 'after_delete')
+def _message_removed(mapper, connection, msg):
+    adjust_counts(connection, 'messages_count', -1, msg.user_id)
+
+
+@event.listens_for(Follows, 'after_insert')
+def _follow_added(mapper, connection, follow):
+    adjust_counts(connection, 'following_count', 1, follow.user_following_id)
+    adjust_counts(connection, 'followers_count', 1, follow.user_being_followed_id)
+
+
+@event.listens_for(Follows, 'after_delete')
+def _follow_removed(mapper, connection, follow):
+    adjust_counts(connection, 'following_count', -1, follow.user_following_id)
+    adjust_counts(connection, 'followers_count', -1, follow.user_being_followed_id)
+
+
+@event.listens_for(Likes, 'after_insert')
+def _like_added(mapper, connection, like):
+    adjust_counts(connection, 'likes_count', 1, like.user_id)
+    adjust_counts(connection, 'like_count', 1, like.message_id,
+                  Message.__table__)
+
+
+@event.listens_for(Likes, 'after_delete')
+def _like_removed(mapper, connection, like):
+    adjust_counts(connection, 'likes_count', -1, like.user_id)
+    adjust_counts(connection, 'like_count', -1, like.message_id,
+                  Message.__table__)
+
+
+def _uncount_rows(connection, column, key, source, where, table=None):
+    """Take one off `column` for every row of `source` matching `where`.
+
+    `key` is the column of `source` holding the ids to charge, so a user
+    with three such rows loses three. Like `adjust_counts`, `table` defaults
+    to users.
+    """
+
+    table = User.__table__ if table is None else table
+    times = (select(func.count())
+             .select_from(source)
+             .where(key == table.c.id, where)
+             .scalar_subquery())
+
+    connection.execute(
+        table.update()
+        .where(table.c.id.in_(select(key).select_from(source).where(where)))
+        .values({column: table.c[column] - times}))
+
+
+@event.listens_for(Session, 'before_flush')
+def _before_cascading_deletes(session, flush_context, instances):
+    """Uncount rows the database is about to cascade-delete.
+
+    This runs before the flush touches anything, so the follows and likes
+    that ON DELETE CASCADE will remove are still there to be counted.
+    """
+
+    deleted_users = [o.id for o in session.deleted if isinstance(o, User)]
+    deleted_msgs = [o.id for o in session.deleted
+                    if isinstance(o, Message) and o.user_id not in deleted_users]
+
+    if not (deleted_users or deleted_msgs):
+        return
+
+    connection = session.connection()
+
+    if deleted_users:
+        uncount_user_rows(connection, deleted_users)
+
+    if deleted_msgs:
+        _uncount_rows(connection, 'likes_count', Likes.user_id, Likes,
+                      Likes.message_id.in_(deleted_msgs))
+
+
+def uncount_user_rows(connection, user_ids):
+    """Uncount the follows and likes that go away with `user_ids`' accounts."""
+
+    # their likes of other users' messages
+    _uncount_rows(connection, 'like_count', Likes.message_id, Likes,
+                  Likes.user_id.in_(user_ids), Message.__table__)
+
+    _uncount_rows(connection, 'followers_count', Follows.user_being_followed_id,
+                  Follows, Follows.user_following_id.in_(user_ids))
+    _uncount_rows(connection, 'following_count', Follows.user_following_id,
+                  Follows, Follows.user_being_followed_id.in_(user_ids))
+
+    # other users' likes of the deleted users' messages
+    _uncount_rows(connection, 'likes_count', Likes.user_id,
+                  Likes.__table__.join(Message.__table__,
+                                       Message.id == Likes.message_id),
+                  Message.user_id.in_(user_ids))
+
 
 def connect_db(app):
     """Connect this database to provided Flask app.
@@ -0,0 +1,93 @@
+"""Keyset (cursor) pagination for message listings.
+
+Pages are keyed on ``(timestamp, id)`` rather than an OFFSET, so fetching
+page 500 is the same index range scan as fetching page 1. The position is
+handed to clients as an opaque ``?before=`` token.
+"""
+
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import datetime
+
+from flask import abort, request
+from sqlalchemy import tuple_
+
+from models import Message
+
+
+def encode_cursor(timestamp, row_id):
+    """Make an opaque token pointing just past `(timestamp, row_id)`."""
+
+    raw = f"{timestamp.isoformat()}|{row_id}".encode()
+    return urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(token):
+    """Turn a token back into `(timestamp, row_id)`.
+
+    Raises ValueError if the token is malformed.
+    """
+
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        timestamp, row_id = urlsafe_b64decode(padded).decode().split("|")
+        return datetime.fromisoformat(timestamp), int(row_id)
+    except (TypeError, UnicodeDecodeError, ValueError) as exc:
+        raise ValueError(f"bad cursor: {token!r}") from exc
+
+
+def get_cursor():
+    """Decode the request's `?before=` token, if any (400 if it's bad)."""
+
+    token = request.args.get('before')
+
+    if not token:
+        return None
+
+    try:
+        return decode_cursor(token)
+    except ValueError:
+        abort(400)
+
+
+def keyset_filter(timestamp_col, id_col, before):
+    """SQL criterion for rows strictly older than the `before` position."""
+
+    return tuple_(timestamp_col, id_col) < tuple_(*before)
+
+
+def newest_first(query, before, limit):
+    """A Message query cut down to `limit` rows older than `before`, newest
+    first (not yet run)."""
+
+    if before:
+        query = query.filter(keyset_filter(Message.timestamp, Message.id, before))
+
+    return query.order_by(Message.timestamp.desc(), Message.id.desc()).limit(limit)
+
+
+def newest_messages(query, before, limit):
+    """Up to `limit` rows of a Message query older than `before`, newest first."""
+
+    return newest_first(query, before, limit).all()
+
+
+def paginate_messages(query, before, per_page):
+    """Fetch one page of a Message query, newest first.
+
+    `before` is a decoded cursor or None for the first page. Returns
+    `(messages, next_cursor)`; `next_cursor` is None on the last page.
+    """
+
+    return page_of(newest_messages(query, before, per_page + 1), per_page)
+
+
+def page_of(rows, per_page):
+    """Split `per_page + 1` fetched messages into `(page, next_cursor)`."""
+
+    page = rows[:per_page]
+
+    if len(rows) > per_page:
+        last = page[-1]
+        return page, encode_cursor(last.timestamp, last.id)
+
+    return page, None
@@ -0,0 +1,163 @@
+"""Password hashing with a tunable cost, optionally off the request worker.
+
+bcrypt is deliberately slow: at the default cost of 12 one hash or check
+takes a few hundred milliseconds of CPU. Signups, logins and profile saves
+all pay it, and a burst of logins can tie up every worker at once.
+
+`PasswordHasher` runs the work in one of three modes:
+
+* ``inline``: in the calling thread, as before.
+* ``thread``: in a bounded thread pool. bcrypt releases the GIL while it
+  hashes, so this caps how many CPUs hashing may take without blocking the
+  rest of the process.
+* ``process``: in a bounded process pool, for runtimes where threads don't
+  help.
+
+In the pooled modes at most `max_pending` hashes may be running or queued.
+Past that the hasher raises `HasherBusy` immediately instead of making
+requests wait behind a growing queue; the app turns that into a 503.
+
+The cost comes from ``BCRYPT_LOG_ROUNDS``. Hashes made at a different cost
+keep working, and `User.authenticate` rehashes them at the current cost the
+next time their owner logs in.
+"""
+
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import bcrypt
+from flask import current_app, has_app_context
+
+DEFAULT_ROUNDS = 12
+MODES = ('inline', 'thread', 'process')
+
+
+class HasherBusy(Exception):
+    """Too much hashing is already queued; try again shortly."""
+
+
+def hash_password(password, rounds):
+    """bcrypt `password` at cost `rounds`; returns the hash as a string."""
+
+    return bcrypt.hashpw(password.encode('utf-8'),
+                         bcrypt.gensalt(rounds)).decode('utf-8')
+
+
+def check_password(pw_hash, password):
+    """Does `password` match the bcrypt hash `pw_hash`?"""
+
+    return bcrypt.checkpw(password.encode('utf-8'), pw_hash.encode('utf-8'))
+
+
+def hash_rounds(pw_hash):
+    """The cost a bcrypt hash was made with (``$2b$<cost>$...``), or None."""
+
+    try:
+        return int(pw_hash.split('$')[2])
+    except (IndexError, ValueError):
+        return None
+
+
+class PasswordHasher:
+    """Hashes and checks passwords at cost `rounds`, in the given mode."""
+
+    def __init__(self, rounds=DEFAULT_ROUNDS, mode='inline', workers=None,
+                 max_pending=None):
+        if mode not in MODES:
+            raise ValueError(f"unknown password hash mode: {mode!r}")
+
+        self.rounds = rounds
+        self.mode = mode
+        self._executor = None
+
+        # hashing is CPU-bound, so more workers than cores only adds latency
+        workers = workers or os.cpu_count() or 1
+
+        if mode == 'thread':
+            self._executor = ThreadPoolExecutor(workers, thread_name_prefix='bcrypt')
+        elif mode == 'process':
+            self._executor = ProcessPoolExecutor(workers)
+
+        if self._executor is not None:
+            max_pending = max_pending or 4 * workers
+            self._slots = threading.BoundedSemaphore(max_pending)
+
+        self.max_pending = max_pending
+
+    def _run(self, fn, *args):
+        """Call `fn(*args)` according to the mode and return its result."""
+
+        if self._executor is None:
+            return fn(*args)
+
+        if not self._slots.acquire(blocking=False):
+            raise HasherBusy()
+
+        try:
+            future = self._executor.submit(fn, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+
+        future.add_done_callback(lambda _: self._slots.release())
+        return future.result()
+
+    def hash(self, password):
+        """Hash `password` at the configured cost."""
+
+        if not password:
+            raise ValueError("Password must be non-empty.")
+
+        return self._run(hash_password, password, self.rounds)
+
+    def check(self, pw_hash, password):
+        """Does `password` match `pw_hash`?"""
+
+        return self._run(check_password, pw_hash, password)
+
+    def needs_rehash(self, pw_hash):
+        """Was `pw_hash` made at a cost other than the configured one?"""
+
+        return hash_rounds(pw_hash) != self.rounds
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+
+
+def init_password_hasher(app):
+    """Set up password hashing for `app` from its config.
+
+    ``BCRYPT_LOG_ROUNDS`` is the cost; ``PASSWORD_HASH_MODE`` is one of
+    `MODES`; ``PASSWORD_HASH_WORKERS`` and ``PASSWORD_HASH_MAX_PENDING``
+    size the pool in the pooled modes.
+    """
+
+    hasher = PasswordHasher(
+        rounds=app.config.get('BCRYPT_LOG_ROUNDS', DEFAULT_ROUNDS),
+        mode=app.config.get('PASSWORD_HASH_MODE', 'inline'),
+        workers=app.config.get('PASSWORD_HASH_WORKERS'),
+        max_pending=app.config.get('PASSWORD_HASH_MAX_PENDING'),
+    )
+
+    old = app.extensions.get('password_hasher')
+    if old is not None:
+        old.shutdown()
+
+    app.extensions['password_hasher'] = hasher
+    return hasher
+
+
+_inline_hasher = PasswordHasher()
+
+
+def get_hasher():
+    """The current app's hasher; hashes inline at the default cost outside an app."""
+
+    if has_app_context():
+        hasher = current_app.extensions.get('password_hasher')
+        if hasher is not None:
+            return hasher
+
+    return _inline_hasher
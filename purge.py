@@ -0,0 +1,208 @@
+"""Deleting accounts: hidden at once, their rows removed in the background.
+
+`delete_account` marks the user deleted, records an ``account_purges`` row
+and queues a ``purge_account`` job (see jobs.py). From then on the account
+and its messages are left out of every ORM query (see models.py), so the
+request doesn't wait on the cascade.
+
+The job then removes what was theirs a stage at a time, ``PURGE_BATCH_SIZE``
+rows per short transaction, fixing the counters of the users and messages
+on the other end from what each DELETE returned. Every batch commits
+together with the purge's progress, so a purge that dies part way carries
+on from its stage when the job is retried. The user row goes last, once
+little is left to cascade, and the purge is marked finished.
+`flask purge-accounts` finishes any purges left over, all at once.
+"""
+
+from collections import Counter, defaultdict
+from datetime import datetime
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import delete, select
+
+from jobs import enqueue, job
+from models import (db, adjust_counts, uncount_user_rows, AccountPurge,
+                    Follows, Likes, Message, User)
+from timelines import fanout_enabled, get_timeline_store
+
+# in order; each is repeated until a batch finds nothing left
+STAGES = ('likes', 'liked', 'followers', 'following', 'messages', 'account')
+
+likes = Likes.__table__
+follows = Follows.__table__
+messages = Message.__table__
+
+
+def delete_account(user):
+    """Hide `user`'s account and queue its purge. The caller commits."""
+
+    user.deleted_at = datetime.utcnow()
+    db.session.add(AccountPurge(user_id=user.id, stage=STAGES[0]))
+    enqueue('purge_account', user_id=user.id)
+
+
+def _uncount(connection, column, ids, table=None):
+    """Take one off `column` for every time an id appears in `ids`."""
+
+    by_times = defaultdict(list)
+    for row_id, times in Counter(ids).items():
+        by_times[times].append(row_id)
+
+    for times, row_ids in by_times.items():
+        adjust_counts(connection, column, -times, sorted(row_ids), table)
+
+
+def _delete_batch(connection, table, key, where, batch_size, *returning):
+    """Delete up to `batch_size` rows of `table` matching `where`.
+
+    `key` picks the batch; with `where` it must identify a row. Returns the
+    `returning` columns of each row deleted.
+    """
+
+    batch = select(key).where(where).limit(batch_size)
+    return connection.execute(
+        delete(table).where(where, key.in_(batch)).returning(*returning)).all()
+
+
+# Each stage also keeps the deleted user's own counters (and their
+# messages' like counts) right, so `flask reconcile-counters` finds nothing
+# to fix at any point of a purge.
+
+def _purge_likes(connection, user_id, batch_size):
+    """Their likes of other users' messages."""
+
+    rows = _delete_batch(connection, likes, likes.c.id,
+                         likes.c.user_id == user_id, batch_size,
+                         likes.c.message_id)
+    _uncount(connection, 'like_count', [m for m, in rows], messages)
+    adjust_counts(connection, 'likes_count', -len(rows), user_id)
+    return len(rows)
+
+
+def _purge_liked(connection, user_id, batch_size):
+    """Other users' likes of their messages."""
+
+    theirs = select(messages.c.id).where(messages.c.user_id == user_id)
+    rows = _delete_batch(connection, likes, likes.c.id,
+                         likes.c.message_id.in_(theirs), batch_size,
+                         likes.c.user_id, likes.c.message_id)
+    _uncount(connection, 'likes_count', [u for u, _ in rows])
+    _uncount(connection, 'like_count', [m for _, m in rows], messages)
+    return len(rows)
+
+
+def _purge_followers(connection, user_id, batch_size):
+    """Other users' follows of them, and their messages on those timelines."""
+
+    followers = [f for f, in _delete_batch(
+        connection, follows, follows.c.user_following_id,
+        follows.c.user_being_followed_id == user_id, batch_size,
+        follows.c.user_following_id)]
+    _uncount(connection, 'following_count', followers)
+    adjust_counts(connection, 'followers_count', -len(followers), user_id)
+
+    if followers and fanout_enabled():
+        store = get_timeline_store()
+        for follower_id in followers:
+            store.prune(follower_id, user_id)
+
+    return len(followers)
+
+
+def _purge_following(connection, user_id, batch_size):
+    """Their follows of other users."""
+
+    rows = _delete_batch(connection, follows, follows.c.user_being_followed_id,
+                         follows.c.user_following_id == user_id, batch_size,
+                         follows.c.user_being_followed_id)
+    _uncount(connection, 'followers_count', [f for f, in rows])
+    adjust_counts(connection, 'following_count', -len(rows), user_id)
+    return len(rows)
+
+
+def _purge_messages(connection, user_id, batch_size):
+    """Their messages."""
+
+    rows = _delete_batch(connection, messages, messages.c.id,
+                         messages.c.user_id == user_id, batch_size,
+                         messages.c.id)
+    adjust_counts(connection, 'messages_count', -len(rows), user_id)
+    return len(rows)
+
+
+PURGERS = {
+    'likes': _purge_likes,
+    'liked': _purge_liked,
+    'followers': _purge_followers,
+    'following': _purge_following,
+    'messages': _purge_messages,
+}
+
+
+def purge_account(purge, batch_size):
+    """Carry `purge` on from its stage to the end; returns rows deleted.
+
+    Commits after every batch.
+    """
+
+    deleted = 0
+
+    while purge.finished_at is None:
+        connection = db.session.connection()
+
+        if purge.stage == 'account':
+            # anything that slipped in since its stage ran goes in the cascade
+            uncount_user_rows(connection, [purge.user_id])
+            connection.execute(delete(User.__table__)
+                               .where(User.__table__.c.id == purge.user_id))
+            purge.finished_at = datetime.utcnow()
+        else:
+            batch = PURGERS[purge.stage](connection, purge.user_id, batch_size)
+            if batch:
+                purge.rows_deleted += batch
+                deleted += batch
+            else:
+                purge.stage = STAGES[STAGES.index(purge.stage) + 1]
+
+        db.session.commit()
+
+    return deleted
+
+
+# after the jobs users are waiting on, and one at a time
+@job('purge_account', priority=10, concurrency=1)
+def purge_job(user_id):
+    """Job: purge the deleted account `user_id`."""
+
+    purge = db.session.get(AccountPurge, user_id)
+
+    if purge is not None:
+        purge_account(purge, current_app.config['PURGE_BATCH_SIZE'])
+
+
+def purge_accounts(batch_size=None):
+    """Finish every pending purge, oldest first.
+
+    Returns `(accounts, rows)` purged.
+    """
+
+    batch_size = batch_size or current_app.config['PURGE_BATCH_SIZE']
+    pending = (AccountPurge.query
+               .filter(AccountPurge.finished_at.is_(None))
+               .order_by(AccountPurge.requested_at)
+               .all())
+
+    rows = sum(purge_account(purge, batch_size) for purge in pending)
+    return len(pending), rows
+
+
+@click.command('purge-accounts')
+@click.option('--batch-size', type=int, help='Rows deleted per transaction.')
+@with_appcontext
+def purge_accounts_command(batch_size):
+    """Remove what deleted accounts left behind, a batch at a time."""
+
+    accounts, rows = purge_accounts(batch_size)
+    click.echo(f"Purged {accounts} account(s), {rows} row(s).")
@@ -0,0 +1,214 @@
+"""EXPLAIN the hot queries and confirm they're served by their indexes.
+
+Run it with `flask check-query-plans` after a migration, or against a
+production snapshot. Sequential scans, bitmap scans and explicit sorts are
+disabled for the check, so even a nearly empty test database shows whether
+an ordered index scan *can* serve each query; on real data the planner
+should pick the same one on its own.
+
+Naming the index isn't enough: it has to be searched (an ``Index Cond``,
+not a full index scan filtered row by row), and nothing may be sorted
+afterwards, since a sort over an index scan is the full scan this check is
+meant to catch.
+"""
+
+import re
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import func, literal_column, select, text
+
+from models import db, Follows, Job, Likes, Message, TimelineEntry, User
+from timelines import home_timeline_query
+
+SAMPLE_USER_ID = 1
+SAMPLE_USER_IDS = [1, 2, 3]
+SAMPLE_MESSAGE_ID = 1
+
+
+def hot_queries():
+    """`(name, statement, expected index)` for each query worth watching.
+
+    Where more than one index serves a query equally well the expected index
+    is a tuple of their names, and any of them will do.
+    """
+
+    newest_first = (Message.timestamp.desc(), Message.id.desc())
+
+    return [
+        # exactly what read_home_timeline runs without precomputed timelines
+        ('home timeline',
+         home_timeline_query(SAMPLE_USER_ID, None, 101).statement,
+         'ix_messages_user_timestamp'),
+
+        ('profile messages',
+         select(Message)
+         .where(Message.user_id == SAMPLE_USER_ID)
+         .order_by(*newest_first)
+         .limit(101),
+         'ix_messages_user_timestamp'),
+
+        ('following',
+         select(Follows.user_being_followed_id)
+         .where(Follows.user_following_id == SAMPLE_USER_ID),
+         'ix_follows_following_created'),
+
+        ('follows among',
+         select(Follows.user_being_followed_id)
+         .where(Follows.user_following_id == SAMPLE_USER_ID,
+                Follows.user_being_followed_id.in_(SAMPLE_USER_IDS)),
+         # on real data the follower's own index is as good as the key
+         ('follows_pkey', 'ix_follows_following_created')),
+
+        ('followers page',
+         select(Follows.user_following_id)
+         .where(Follows.user_being_followed_id == SAMPLE_USER_ID)
+         .order_by(Follows.created_at.desc(), Follows.user_following_id.desc())
+         .limit(51),
+         'ix_follows_followed_created'),
+
+        ('following page',
+         select(Follows.user_being_followed_id)
+         .where(Follows.user_following_id == SAMPLE_USER_ID)
+         .order_by(Follows.created_at.desc(), Follows.user_being_followed_id.desc())
+         .limit(51),
+         'ix_follows_following_created'),
+
+        ('likes by user',
+         select(Likes.message_id)
+         .where(Likes.user_id == SAMPLE_USER_ID),
+         'uq_likes_user_message'),
+
+        ('likes of message',
+         select(Likes.user_id)
+         .where(Likes.message_id == SAMPLE_MESSAGE_ID),
+         'ix_likes_message_id'),
+
+        ('recent likes (trending)',
+         select(Likes.message_id, Likes.created_at)
+         .where(Likes.created_at
+                > func.now() - literal_column("interval '2 days'")),
+         'ix_likes_created_at'),
+
+        ('precomputed timeline',
+         select(TimelineEntry.message_id)
+         .where(TimelineEntry.owner_id == SAMPLE_USER_ID)
+         .order_by(TimelineEntry.timestamp.desc(),
+                   TimelineEntry.message_id.desc())
+         .limit(101),
+         'ix_timeline_entries_owner_timestamp'),
+
+        ('accounts being purged',
+         select(User.__table__.c.id)
+         .where(User.__table__.c.deleted_at.is_not(None)),
+         'ix_users_deleted'),
+
+        ('due jobs',
+         select(Job.id)
+         .where(Job.status == 'queued', Job.run_at <= func.now())
+         .order_by(Job.priority, Job.run_at, Job.id)
+         .limit(4),
+         'ix_jobs_status_priority'),
+
+        ('user by username',
+         select(User.id).where(User.username == 'someone'),
+         'users_username_key'),
+    ]
+
+
+def explain(statement):
+    """Return Postgres' plan for `statement`, forcing it onto an index."""
+
+    sql = statement.compile(dialect=db.engine.dialect,
+                            compile_kwargs={'literal_binds': True})
+
+    try:
+        for setting in ("enable_seqscan", "enable_bitmapscan", "enable_sort"):
+            db.session.execute(text(f"SET LOCAL {setting} = off"))
+        rows = db.session.execute(text(f"EXPLAIN {sql}"))
+        return "\n".join(row[0] for row in rows)
+    finally:
+        db.session.rollback()
+
+
+def _partial_indexes():
+    """Names of the indexes that only cover rows matching a WHERE clause."""
+
+    return {index.name
+            for table in db.metadata.tables.values()
+            for index in table.indexes
+            if index.dialect_options['postgresql']['where'] is not None}
+
+
+def uses_index(plan, index, partial=False):
+    """Whether `plan` searches `index` and sorts nothing.
+
+    A `partial` index's predicate already picks its rows, so reading all
+    of it counts too, as long as nothing is filtered out on the way.
+    """
+
+    lines = plan.splitlines()
+
+    if any(re.match(r"\s*(->\s+)?(Incremental )?Sort\s+\(", line)
+           for line in lines):
+        return False
+
+    for i, line in enumerate(lines):
+        if f" using {index} " not in line:
+            continue
+
+        # the scan's own details are indented deeper, up to the next node
+        depth = len(line) - len(line.lstrip())
+        details = []
+        for detail in lines[i + 1:]:
+            if (len(detail) - len(detail.lstrip()) <= depth
+                    or detail.lstrip().startswith("->")):
+                break
+            details.append(detail.lstrip())
+
+        if any(d.startswith("Index Cond:") for d in details):
+            return True
+        if partial and not any(d.startswith("Filter:") for d in details):
+            return True
+
+    return False
+
+
+def check_query_plans():
+    """Explain every hot query.
+
+    Returns a list of `(name, expected_index, ok, plan)`.
+    """
+
+    if db.engine.dialect.name != 'postgresql':
+        raise RuntimeError("query plan checks need PostgreSQL")
+
+    partial = _partial_indexes()
+
+    results = []
+    for name, statement, index in hot_queries():
+        plan = explain(statement)
+        names = (index,) if isinstance(index, str) else index
+        results.append((name, " or ".join(names),
+                        any(uses_index(plan, n, n in partial) for n in names),
+                        plan))
+
+    return results
+
+
+@click.command('check-query-plans')
+@click.option('--verbose', is_flag=True, help='Print every plan.')
+@with_appcontext
+def check_query_plans_command(verbose):
+    """EXPLAIN the hot queries; exit 1 if any of them misses its index."""
+
+    failed = 0
+
+    for name, index, ok, plan in check_query_plans():
+        click.echo(f"{'ok  ' if ok else 'FAIL'} {name} (expects {index})")
+        if verbose or not ok:
+            click.echo("    " + plan.replace("\n", "\n    "))
+        failed += not ok
+
+    if failed:
+        raise SystemExit(1)
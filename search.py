@@ -0,0 +1,334 @@
+"""Ranked, paginated user search for /users?q=.
+
+Searching used to run ``username LIKE '%q%'``, a scan of the whole users
+table, and render every match. Searches now go through an index and come
+back a page at a time, best matches first:
+
+1. exact username (ignoring case)
+2. usernames starting with the query
+3. usernames containing it (queries of 3+ characters)
+4. similar usernames, by trigram similarity (queries of 3+ characters)
+
+Three backends ship here:
+
+* ``trigram`` uses Postgres' pg_trgm. Migration 0005 creates a GIN trigram
+  index on ``lower(username)`` when the extension is available, and every
+  match condition above can be answered from it.
+* ``like`` runs the same ranked query with plain ILIKE-style matching and no
+  similar names, for databases without pg_trgm. It scans the users table,
+  but serves every process the same, current answers.
+* ``memory`` keeps an n-gram index of usernames in this process, built from
+  the users table on first use and updated by `index_user`/`unindex_user`.
+  Only the process that handled a signup, rename or deletion sees it, so
+  this is for tests and single-process development, never for several
+  workers.
+
+``USER_SEARCH_BACKEND`` picks one; ``auto`` (the default) uses ``trigram``
+when the index exists and ``like`` otherwise. Ranked results can't be
+keyset-paginated, so pages are numbered and only the first
+``USER_SEARCH_MAX_PAGES`` are served, which keeps the OFFSET (and so the
+latency) bounded however many users match.
+"""
+
+import heapq
+import threading
+from collections import Counter, defaultdict
+
+from flask import current_app
+from sqlalchemy import case, func, or_, select, text
+
+from models import db, User
+
+TRIGRAM_INDEX = 'ix_users_username_trgm'
+
+# pg_trgm's default threshold for the `%` operator
+SIMILARITY_THRESHOLD = 0.3
+
+SEARCH_BACKENDS = {}
+
+
+def register_backend(name):
+    """Class decorator: make a search backend available as `name`."""
+
+    def register(cls):
+        SEARCH_BACKENDS[name] = cls
+        return cls
+
+    return register
+
+
+def trigrams(word):
+    """pg_trgm-style trigrams of `word`: lowercased, padded with two spaces
+    in front and one behind."""
+
+    padded = f"  {word.lower()} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class SearchBackend:
+    """Interface every search backend implements."""
+
+    def search(self, q, offset, limit):
+        """Up to `limit` Users matching `q`, best first, skipping `offset`."""
+
+        raise NotImplementedError
+
+    def add(self, user_id, username):
+        """A user was created or renamed."""
+
+    def remove(self, user_id):
+        """A user was deleted."""
+
+
+@register_backend('trigram')
+class TrigramSearchBackend(SearchBackend):
+    """Searches with pg_trgm operators, served by the GIN trigram index."""
+
+    # whether to look for similar names too (needs pg_trgm)
+    similar = True
+
+    def search(self, q, offset, limit):
+        q = q.lower()
+        name = func.lower(User.username)
+        escaped = q.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+        exact = name == q
+        prefix = name.like(f"{escaped}%", escape='\\')
+        matches = [prefix]
+        rank = [(exact, 0), (prefix, 1)]
+
+        order = [case(*rank, else_=3), User.username]
+
+        # shorter queries have no trigram of their own to look up
+        if len(q) >= 3:
+            substring = name.like(f"%{escaped}%", escape='\\')
+            matches.append(substring)
+            rank.append((substring, 2))
+            if self.similar:
+                matches.append(name.op('%')(q))
+                order.insert(1, func.similarity(name, q).desc())
+
+        return (User.query
+                .filter(or_(*matches))
+                .order_by(*order)
+                .offset(offset)
+                .limit(limit)
+                .all())
+
+
+@register_backend('like')
+class LikeSearchBackend(TrigramSearchBackend):
+    """The trigram backend's query without pg_trgm: exact, prefix and
+    substring matches only, found by scanning the users table."""
+
+    similar = False
+
+
+class _TrigramIndex:
+    """Usernames by id, and trigram -> ids of usernames containing it."""
+
+    def __init__(self):
+        self.names = {}
+        self.postings = defaultdict(set)
+
+    def add(self, user_id, username):
+        self.remove(user_id)
+        self.names[user_id] = username
+        for gram in trigrams(username):
+            self.postings[gram].add(user_id)
+
+    def remove(self, user_id):
+        username = self.names.pop(user_id, None)
+        if username is None:
+            return
+
+        for gram in trigrams(username):
+            ids = self.postings[gram]
+            ids.discard(user_id)
+            if not ids:
+                del self.postings[gram]
+
+    def candidates(self, q):
+        """`(user_id, username, shared trigrams)` for every possible match.
+
+        Queries under three characters only match prefixes, and have no
+        shared trigram count (None).
+        """
+
+        if len(q) < 3:
+            # only prefixes: every trigram of "  q" must be there
+            start = f"  {q}"
+            ids = set.intersection(
+                *(self.postings.get(start[i:i + 3], set())
+                  for i in range(len(start) - 2)))
+            return [(user_id, self.names[user_id], None) for user_id in ids]
+
+        # one pass over the postings counts shared trigrams per user
+        shared = Counter()
+        for gram in trigrams(q):
+            shared.update(self.postings.get(gram, ()))
+
+        return [(user_id, self.names[user_id], count)
+                for user_id, count in shared.items()]
+
+
+def _ranked(q, candidates):
+    """`(sort key, user_id)` for each of `candidates` that matches `q`."""
+
+    grams = trigrams(q)
+
+    for user_id, username, shared in candidates:
+        name = username.lower()
+
+        if name == q:
+            rank = 0
+        elif name.startswith(q):
+            rank = 1
+        elif shared is not None and q in name:
+            rank = 2
+        else:
+            rank = 3
+
+        # pg_trgm's similarity: shared trigrams over all distinct trigrams
+        score = 0.0
+        if shared is not None:
+            score = shared / (len(grams) + len(trigrams(name)) - shared)
+
+        if rank < 3 or score >= SIMILARITY_THRESHOLD:
+            yield (rank, -score, username), user_id
+
+
+@register_backend('memory')
+class MemorySearchBackend(SearchBackend):
+    """An in-process trigram index of every username; see the module notes
+    on why it only suits a single process."""
+
+    def __init__(self):
+        self._index = None
+        # changes made while the index is being built, replayed onto it
+        self._pending = None
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+
+    def _load(self):
+        """Build the index on first use.
+
+        The users table is streamed into a new index without holding
+        `_lock`, so edits carry on meanwhile and are replayed at the end.
+        """
+
+        with self._load_lock:
+            if self._index is not None:
+                return
+
+            with self._lock:
+                self._pending = []
+
+            index = _TrigramIndex()
+            rows = db.session.execute(
+                select(User.id, User.username).execution_options(yield_per=10000))
+            for user_id, username in rows:
+                index.add(user_id, username)
+
+            with self._lock:
+                for method, args in self._pending:
+                    getattr(index, method)(*args)
+                self._index, self._pending = index, None
+
+    def _change(self, method, *args):
+        with self._lock:
+            if self._index is not None:
+                getattr(self._index, method)(*args)
+            elif self._pending is not None:
+                self._pending.append((method, args))
+
+    def add(self, user_id, username):
+        self._change('add', user_id, username)
+
+    def remove(self, user_id):
+        self._change('remove', user_id)
+
+    def search(self, q, offset, limit):
+        q = q.lower()
+
+        if self._index is None:
+            self._load()
+
+        with self._lock:
+            candidates = self._index.candidates(q)
+
+        # only the requested page's worth is ever put in order
+        best = heapq.nsmallest(offset + limit, _ranked(q, candidates))
+
+        ids = [user_id for _, user_id in best[offset:]]
+        by_id = {u.id: u for u in User.query.filter(User.id.in_(ids))}
+        return [by_id[i] for i in ids if i in by_id]
+
+
+def _trigram_index_exists():
+    if db.engine.dialect.name != 'postgresql':
+        return False
+
+    return db.session.execute(
+        text("SELECT 1 FROM pg_indexes WHERE indexname = :name"),
+        {'name': TRIGRAM_INDEX}).first() is not None
+
+
+def get_search_backend():
+    """Return the search backend configured for the current app."""
+
+    backend = current_app.extensions.get('user_search')
+
+    if backend is None:
+        name = current_app.config['USER_SEARCH_BACKEND']
+        if name == 'auto':
+            name = 'trigram' if _trigram_index_exists() else 'like'
+
+        backend = current_app.extensions['user_search'] = SEARCH_BACKENDS[name]()
+
+    return backend
+
+
+def search_users(q, page, per_page):
+    """One page of users, as `(users, has_next)`.
+
+    With a query `q` the users are ranked matches; without one, everyone,
+    newest first. Pages past ``USER_SEARCH_MAX_PAGES`` come back empty.
+    """
+
+    if page > current_app.config['USER_SEARCH_MAX_PAGES']:
+        return [], False
+
+    offset = (page - 1) * per_page
+
+    if q:
+        users = get_search_backend().search(q, offset, per_page + 1)
+    else:
+        users = (User.query
+                 .order_by(User.id.desc())
+                 .offset(offset)
+                 .limit(per_page + 1)
+                 .all())
+
+    has_next = (len(users) > per_page
+                and page < current_app.config['USER_SEARCH_MAX_PAGES'])
+    return users[:per_page], has_next
+
+
+def index_user(user):
+    """Call after committing a new or edited user."""
+
+    get_search_backend().add(user.id, user.username)
+
+
+def unindex_user(user_id):
+    """Call after committing a user's deletion."""
+
+    get_search_backend().remove(user_id)
+
+
+def include_object(object, name, type_, reflected, compare_to):
+    """Alembic autogenerate filter: the trigram index lives only in migration
+    0005 (it needs pg_trgm), so don't offer to drop it."""
+
+    return not (type_ == 'index' and name == TRIGRAM_INDEX)
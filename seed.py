@@ -1,20 +1,15 @@
-"""Seed database with sample data from CSV Files."""
+"""Seed database with sample data from CSV Files.
 
-from csv import DictReader
-from app import db, app
-from models import User, Message, Follows
+Brings the schema up to date (`flask db upgrade`), then the same as
+`flask load-csvs generator`; see loader.py.
+"""
 
-with app.app_context():
-    db.drop_all()
-    db.create_all()
-
-    with open('generator/users.csv') as users:
-        db.session.bulk_insert_mappings(User, DictReader(users))
+from flask_migrate import upgrade
 
-    with open('generator/messages.csv') as messages:
-        db.session.bulk_insert_mappings(Message, DictReader(messages))
+from app import app
+from loader import find_csvs, load_csvs
 
-    with open('generator/follows.csv') as follows:
-        db.session.bulk_insert_mappings(Follows, DictReader(follows))
-
-    db.session.commit()
+with app.app_context():
+    upgrade()
+    for load in load_csvs(find_csvs('generator')):
+        print(f"{load.table}: {load.rows} rows in {load.seconds:.2f}s")
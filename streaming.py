@@ -0,0 +1,75 @@
+"""Streamed rendering for long list pages.
+
+The user list, following, followers and likes pages used to load every row
+and render the whole document before sending a byte. With
+``STREAM_LIST_PAGES`` on, they're rendered with Jinja's `stream_template`
+instead: the page header goes out straight away, and rows are pulled from
+a server-side cursor (`yield_per`) as the template reaches them, so a
+worker only ever holds one batch of rows and one chunk of HTML.
+
+Views hand templates iterators (never lists) in both modes, so templates
+loop over them once with ``{% for %}...{% else %}`` rather than asking for
+their length.
+"""
+
+from itertools import islice
+
+from flask import Response, current_app, render_template, stream_template
+
+# how much HTML to collect before handing a chunk to the server
+STREAM_CHUNK_SIZE = 8192
+
+
+def stream_rows(query):
+    """Iterate over `query` in ``LIST_BATCH_SIZE`` batches off a server-side cursor."""
+
+    return iter(query.yield_per(current_app.config['LIST_BATCH_SIZE']))
+
+
+def with_follow_state(users, viewer):
+    """Yield `(user, viewer follows user)` for each of `users`.
+
+    Follow state is looked up a batch at a time, so this streams as well as
+    `users` does. Without a `viewer` every user comes back unfollowed.
+    """
+
+    users = iter(users)
+    batch_size = current_app.config['LIST_BATCH_SIZE']
+
+    while True:
+        batch = list(islice(users, batch_size))
+        if not batch:
+            return
+
+        following_ids = (viewer.following_ids_among(u.id for u in batch)
+                         if viewer else set())
+        for user in batch:
+            yield user, user.id in following_ids
+
+
+def _chunked(pieces):
+    """Join Jinja's many small output pieces into reasonably sized chunks."""
+
+    chunk = []
+    size = 0
+
+    for piece in pieces:
+        chunk.append(piece)
+        size += len(piece)
+        if size >= STREAM_CHUNK_SIZE:
+            yield "".join(chunk)
+            chunk = []
+            size = 0
+
+    if chunk:
+        yield "".join(chunk)
+
+
+def render_list(template_name, **context):
+    """`render_template`, or a streamed response when ``STREAM_LIST_PAGES`` is on."""
+
+    if not current_app.config['STREAM_LIST_PAGES']:
+        return render_template(template_name, **context)
+
+    return Response(_chunked(stream_template(template_name, **context)),
+                    mimetype='text/html')
@@ -0,0 +1,169 @@
+"""JSON API tests."""
+
+import os
+from unittest import TestCase
+
+from models import db, User, Follows, Likes, Message
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+# Now we can import app
+from app import app, CURR_USER_KEY
+
+app.config['TESTING'] = True
+app.config['WTF_CSRF_ENABLED'] = False
+
+with app.app_context():
+    db.create_all()
+
+
+class APITestCase(TestCase):
+    """Test the /api/v1 read endpoints."""
+
+    def setUp(self):
+        """alice and bob follow each other; carol follows alice."""
+
+        app.extensions['user_cache'].clear()
+
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+
+            for uid, name in [(1, "alice"), (2, "bob"), (3, "carol")]:
+                db.session.add(User(id=uid, username=name,
+                                    email=f"{name}@test.com", password="x"))
+            db.session.commit()
+
+            db.session.add_all([
+                Follows(user_being_followed_id=1, user_following_id=2),
+                Follows(user_being_followed_id=2, user_following_id=1),
+                Follows(user_being_followed_id=1, user_following_id=3),
+                Message(id=10, text="hi from alice", user_id=1),
+                Message(id=20, text="hi from bob", user_id=2),
+            ])
+            db.session.commit()
+
+        self.client = app.test_client()
+
+    def tearDown(self):
+
+        app.config['FOLLOWS_PER_PAGE'] = 50
+
+        with app.app_context():
+            db.session.rollback()
+            db.drop_all()
+
+    def login(self, client, uid):
+        with client.session_transaction() as session:
+            session[CURR_USER_KEY] = uid
+
+    def test_profile(self):
+        """profiles are compact JSON, without private fields"""
+
+        resp = self.client.get("/api/v1/users/1")
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.mimetype, "application/json")
+        self.assertEqual(resp.json["username"], "alice")
+        self.assertEqual(resp.json["followers_count"], 2)
+        self.assertNotIn("email", resp.json)
+        self.assertNotIn("password", resp.json)
+        self.assertNotIn(b", ", resp.data)
+        self.assertNotIn(b": ", resp.data)
+
+    def test_conditional_get(self):
+        """a matching If-None-Match gets an empty 304"""
+
+        resp = self.client.get("/api/v1/users/1")
+        etag = resp.headers["ETag"]
+        self.assertFalse(etag.startswith("W/"))
+        self.assertEqual(resp.headers["Cache-Control"], "private, no-cache")
+
+        resp = self.client.get("/api/v1/users/1",
+                               headers={"If-None-Match": etag})
+        self.assertEqual(resp.status_code, 304)
+        self.assertEqual(resp.data, b"")
+        self.assertEqual(resp.headers["ETag"], etag)
+
+    def test_etag_follows_row_version(self):
+        """counter changes count as a new version of the user"""
+
+        etag = self.client.get("/api/v1/users/2").headers["ETag"]
+
+        with app.app_context():
+            db.session.add(Likes(user_id=2, message_id=10))
+            db.session.commit()
+
+        resp = self.client.get("/api/v1/users/2",
+                               headers={"If-None-Match": etag})
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.json["likes_count"], 1)
+        self.assertNotEqual(resp.headers["ETag"], etag)
+
+    def test_timeline(self):
+        """the timeline needs a login and revalidates like everything else"""
+
+        self.assertEqual(self.client.get("/api/v1/timeline").status_code, 401)
+
+        with self.client as client:
+            self.login(client, 2)
+
+            resp = client.get("/api/v1/timeline")
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual([m["id"] for m in resp.json["messages"]], [20, 10])
+            self.assertEqual(resp.json["messages"][1]["user"]["username"], "alice")
+            self.assertIsNone(resp.json["next"])
+
+            etag = resp.headers["ETag"]
+            resp = client.get("/api/v1/timeline", headers={"If-None-Match": etag})
+            self.assertEqual(resp.status_code, 304)
+
+            client.post("/messages/new", data={"text": "another"})
+            resp = client.get("/api/v1/timeline", headers={"If-None-Match": etag})
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual(len(resp.json["messages"]), 3)
+
+    def test_user_messages_and_detail(self):
+        """a user's messages, and one message on its own"""
+
+        resp = self.client.get("/api/v1/users/1/messages")
+        self.assertEqual([m["text"] for m in resp.json["messages"]],
+                         ["hi from alice"])
+
+        resp = self.client.get("/api/v1/messages/20")
+        self.assertEqual(resp.json["user"]["id"], 2)
+        self.assertTrue(resp.json["timestamp"].endswith("Z"))
+
+        resp = self.client.get("/api/v1/messages/999")
+        self.assertEqual(resp.status_code, 404)
+        self.assertEqual(resp.json, {"error": "Not Found"})
+
+    def test_follow_lists(self):
+        """followers and following page by user id"""
+
+        app.config['FOLLOWS_PER_PAGE'] = 1
+
+        with self.client as client:
+            self.login(client, 1)
+
+            resp = client.get("/api/v1/users/1/followers")
+            self.assertEqual([u["username"] for u in resp.json["users"]], ["bob"])
+            self.assertEqual(resp.json["next"], 2)
+
+            resp = client.get("/api/v1/users/1/followers?after=2")
+            self.assertEqual([u["username"] for u in resp.json["users"]], ["carol"])
+            self.assertIsNone(resp.json["next"])
+
+            resp = client.get("/api/v1/users/1/following")
+            self.assertEqual([u["username"] for u in resp.json["users"]], ["bob"])
+
+    def test_html_policy_untouched(self):
+        """the API's Cache-Control doesn't leak into HTML pages"""
+
+        resp = self.client.get("/users/1")
+        self.assertEqual(resp.headers["Cache-Control"], "private, no-cache")
@@ -0,0 +1,117 @@
+"""Static asset pipeline tests."""
+
+import gzip
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from models import db
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+# Now we can import app
+from app import app
+from assets import IMMUTABLE, build_assets, load_manifest
+
+app.config['TESTING'] = True
+
+with app.app_context():
+    db.create_all()
+
+
+class AssetTestCase(TestCase):
+    """Build the real static/ into a scratch directory and serve it."""
+
+    def setUp(self):
+
+        self.built = tempfile.mkdtemp()
+        self.original_dir = app.config['ASSETS_DIR']
+        app.config['ASSETS_DIR'] = self.built
+
+        self.manifest = build_assets(app.static_folder, self.built)
+        load_manifest(app)
+
+        self.client = app.test_client()
+
+    def tearDown(self):
+
+        app.config['ASSETS_DIR'] = self.original_dir
+        load_manifest(app)
+        shutil.rmtree(self.built)
+
+    def read(self, path):
+        with open(os.path.join(self.built, path), 'rb') as f:
+            return f.read()
+
+    def test_build(self):
+        """hashed names, rewritten stylesheet urls, gzip where it helps"""
+
+        css = self.manifest['stylesheets/style.css']
+        self.assertRegex(css, r'^stylesheets/style\.[0-9a-f]{12}\.css$')
+
+        nav_bg = self.manifest['images/nav-bg.png']
+        self.assertIn(f"/static/dist/{nav_bg}".encode(), self.read(css))
+        self.assertNotIn(b'"/static/images/nav-bg.png"', self.read(css))
+
+        self.assertEqual(gzip.decompress(self.read(css + '.gz')), self.read(css))
+        self.assertFalse(os.path.exists(
+            os.path.join(self.built, self.manifest['images/warbler-hero.jpg'] + '.gz')))
+
+    def test_build_is_reproducible(self):
+        """the same sources give the same names and bytes"""
+
+        again = tempfile.mkdtemp()
+        try:
+            self.assertEqual(build_assets(app.static_folder, again), self.manifest)
+            css = self.manifest['stylesheets/style.css'] + '.gz'
+            with open(os.path.join(again, css), 'rb') as f:
+                self.assertEqual(f.read(), self.read(css))
+        finally:
+            shutil.rmtree(again)
+
+    def test_templates_use_fingerprints(self):
+        """base.html links the built files"""
+
+        html = self.client.get("/login").get_data(as_text=True)
+
+        self.assertIn(f'/static/dist/{self.manifest["stylesheets/style.css"]}', html)
+        self.assertIn(f'/static/dist/{self.manifest["app.js"]}', html)
+        self.assertNotIn('/static/app.js', html)
+
+    def test_serving(self):
+        """immutable caching, and the encoding the browser asked for"""
+
+        url = f'/static/dist/{self.manifest["stylesheets/style.css"]}'
+
+        resp = self.client.get(url, headers={"Accept-Encoding": "gzip, deflate"})
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.headers["Content-Encoding"], "gzip")
+        self.assertEqual(resp.mimetype, "text/css")
+        self.assertEqual(resp.headers["Cache-Control"], IMMUTABLE)
+        self.assertIn("Accept-Encoding", resp.headers["Vary"])
+        self.assertIn(b".navbar", gzip.decompress(resp.data))
+        resp.close()
+
+        resp = self.client.get(url, headers={"Accept-Encoding": "identity"})
+        self.assertNotIn("Content-Encoding", resp.headers)
+        self.assertIn(b".navbar", resp.data)
+        resp.close()
+
+        resp = self.client.get('/static/dist/nope.css')
+        self.assertEqual(resp.status_code, 404)
+
+    def test_unbuilt_fallback(self):
+        """with no manifest, templates link plain static files"""
+
+        shutil.rmtree(self.built)
+        os.mkdir(self.built)
+        load_manifest(app)
+
+        html = self.client.get("/login").get_data(as_text=True)
+        self.assertIn('/static/stylesheets/style.css', html)
@@ -0,0 +1,199 @@
+"""HTTP caching policy tests."""
+
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+from unittest import TestCase
+
+from flask import template_rendered
+
+from models import db, User, Follows, Message
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+# Now we can import app
+from app import app, CURR_USER_KEY
+from caching import code_version
+
+app.config['TESTING'] = True
+app.config['WTF_CSRF_ENABLED'] = False
+
+with app.app_context():
+    db.create_all()
+
+
+@contextmanager
+def count_renders():
+    """Count templates rendered inside the block: `with ... as n: n[0]`."""
+
+    counter = [0]
+
+    def rendered(sender, template, context, **extra):
+        counter[0] += 1
+
+    template_rendered.connect(rendered, app)
+    try:
+        yield counter
+    finally:
+        template_rendered.disconnect(rendered, app)
+
+
+class CachingTestCase(TestCase):
+    """Test Cache-Control policies and conditional page requests."""
+
+    def setUp(self):
+        """alice (viewer) follows bob, who has one message."""
+
+        app.extensions['user_cache'].clear()
+
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+
+            for uid, name in [(1, "alice"), (2, "bob")]:
+                db.session.add(User(id=uid, username=name,
+                                    email=f"{name}@test.com", password="x"))
+            db.session.commit()
+
+            db.session.add_all([
+                Follows(user_being_followed_id=2, user_following_id=1),
+                Message(id=10, text="hi from bob", user_id=2),
+            ])
+            db.session.commit()
+
+        self.client = app.test_client()
+
+    def tearDown(self):
+
+        with app.app_context():
+            db.session.rollback()
+            db.drop_all()
+
+    def login(self, client, uid=1):
+        with client.session_transaction() as session:
+            session[CURR_USER_KEY] = uid
+
+    def test_default_policy(self):
+        """pages are private and revalidated; the profile form isn't stored"""
+
+        with self.client as client:
+            self.login(client)
+
+            resp = client.get("/")
+            self.assertEqual(resp.headers["Cache-Control"], "private, no-cache")
+            self.assertNotIn("Pragma", resp.headers)
+            self.assertNotIn("ETag", resp.headers)
+
+            resp = client.get("/users/profile")
+            self.assertEqual(resp.headers["Cache-Control"], "no-store")
+
+    def test_static(self):
+        """static files are public and cached for a while"""
+
+        resp = self.client.get("/static/app.js")
+        self.assertEqual(resp.headers["Cache-Control"], "public, max-age=3600")
+        resp.close()
+
+    def test_not_modified(self):
+        """unchanged profile and message pages are 304s, with nothing rendered"""
+
+        for url in ("/users/2", "/messages/10"):
+            with self.subTest(url=url), self.client as client:
+                self.login(client)
+
+                resp = client.get(url)
+                self.assertEqual(resp.status_code, 200)
+                etag = resp.headers["ETag"]
+                last_modified = resp.headers["Last-Modified"]
+                self.assertIn("Cookie", resp.headers["Vary"])
+
+                with count_renders() as renders:
+                    resp = client.get(url, headers={"If-None-Match": etag})
+                self.assertEqual(resp.status_code, 304)
+                self.assertEqual(renders[0], 0)
+
+                resp = client.get(url, headers={"If-Modified-Since": last_modified})
+                self.assertEqual(resp.status_code, 304)
+
+    def test_viewer_changes_invalidate(self):
+        """liking or unfollowing changes what the page shows, and its ETag"""
+
+        with self.client as client:
+            self.login(client)
+
+            etag = client.get("/users/2").headers["ETag"]
+
+            client.post("/users/toggle_like/10")
+            resp = client.get("/users/2", headers={"If-None-Match": etag})
+            self.assertEqual(resp.status_code, 200)
+            etag = resp.headers["ETag"]
+
+            client.post("/users/stop-following/2")
+            resp = client.get("/users/2", headers={"If-None-Match": etag})
+            self.assertEqual(resp.status_code, 200)
+
+    def test_new_message_invalidates(self):
+        """a new message shows up on its author's page"""
+
+        with self.client as client:
+            self.login(client)
+            etag = client.get("/users/2").headers["ETag"]
+
+        with app.app_context():
+            db.session.add(Message(text="another", user_id=2))
+            db.session.commit()
+
+        with self.client as client:
+            self.login(client)
+            resp = client.get("/users/2", headers={"If-None-Match": etag})
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn("another", resp.get_data(as_text=True))
+
+    def test_other_viewer(self):
+        """someone else's copy of the page doesn't validate"""
+
+        with self.client as client:
+            self.login(client, 1)
+            etag = client.get("/users/2").headers["ETag"]
+
+        # a fresh client, without alice's session
+        resp = app.test_client().get("/users/2", headers={"If-None-Match": etag})
+        self.assertEqual(resp.status_code, 200)
+
+    def test_flash_is_never_cached(self):
+        """a page carrying a flash message gets no validators"""
+
+        with self.client as client:
+            self.login(client)
+            with client.session_transaction() as session:
+                session['_flashes'] = [("success", "Hello!")]
+
+            resp = client.get("/users/2")
+            self.assertIn("Hello!", resp.get_data(as_text=True))
+            self.assertNotIn("ETag", resp.headers)
+
+    def test_code_version(self):
+        """the default CACHE_VERSION is the same every time until the code changes"""
+
+        root = tempfile.mkdtemp()
+        try:
+            os.mkdir(os.path.join(root, "templates"))
+            for name, content in [("app.py", "x = 1\n"),
+                                  ("templates/home.html", "<p>hi</p>")]:
+                with open(os.path.join(root, name), "w") as f:
+                    f.write(content)
+
+            version = code_version(root)
+            self.assertEqual(code_version(root), version)
+
+            with open(os.path.join(root, "templates/home.html"), "w") as f:
+                f.write("<p>hello</p>")
+            self.assertNotEqual(code_version(root), version)
+        finally:
+            shutil.rmtree(root)
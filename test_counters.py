@@ -0,0 +1,204 @@
+"""Denormalized counter tests."""
+
+import os
+import threading
+from unittest import TestCase
+
+from models import db, Message, User, Follows, Likes
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+# Now we can import app
+from app import app, CURR_USER_KEY
+from counters import reconcile_counters
+from purge import purge_accounts
+
+app.config['TESTING'] = True
+app.config['WTF_CSRF_ENABLED'] = False
+
+with app.app_context():
+    db.create_all()
+
+
+class CounterTestCase(TestCase):
+    """Test that User counters follow the rows they count."""
+
+    def setUp(self):
+        """Two users who follow each other; one message liked by the other."""
+
+        app.extensions['user_cache'].clear()
+
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+
+            # password hashing is irrelevant here, so skip User.signup
+            for uid, name in [(1, "alice"), (2, "bob"), (3, "carol")]:
+                db.session.add(User(id=uid, username=name,
+                                    email=f"{name}@test.com", password="x"))
+            db.session.commit()
+
+            db.session.add_all([
+                Follows(user_being_followed_id=1, user_following_id=2),
+                Follows(user_being_followed_id=2, user_following_id=1),
+                Message(id=10, text="hi from alice", user_id=1),
+            ])
+            db.session.commit()
+
+            db.session.add(Likes(user_id=2, message_id=10))
+            db.session.commit()
+
+        self.client = app.test_client()
+
+    def tearDown(self):
+
+        with app.app_context():
+            db.session.rollback()
+            db.drop_all()
+
+    def counts(self, uid):
+        with app.app_context():
+            u = User.query.get(uid)
+            return (u.messages_count, u.following_count,
+                    u.followers_count, u.likes_count)
+
+    def login(self, client, uid):
+        with client.session_transaction() as session:
+            session[CURR_USER_KEY] = uid
+
+    def test_fixture_counts(self):
+        """Rows added through the session are counted."""
+
+        self.assertEqual(self.counts(1), (1, 1, 1, 0))
+        self.assertEqual(self.counts(2), (0, 1, 1, 1))
+
+    def test_follow_and_unfollow(self):
+        """Follow views update both sides of the relationship."""
+
+        with self.client as client:
+            self.login(client, 3)
+
+            client.post("/users/follow/1")
+            self.assertEqual(self.counts(3)[1], 1)
+            self.assertEqual(self.counts(1)[2], 2)
+
+            # following twice doesn't double count
+            client.post("/users/follow/1")
+            self.assertEqual(self.counts(1)[2], 2)
+
+            client.post("/users/stop-following/1")
+            self.assertEqual(self.counts(3)[1], 0)
+            self.assertEqual(self.counts(1)[2], 1)
+
+    def test_toggle_like(self):
+        """Liking and unliking moves likes_count."""
+
+        with self.client as client:
+            self.login(client, 2)
+
+            client.post("/users/toggle_like/10")
+            self.assertEqual(self.counts(2)[3], 0)
+
+            client.post("/users/toggle_like/10")
+            self.assertEqual(self.counts(2)[3], 1)
+
+    def test_concurrent_toggle_like(self):
+        """Simultaneous toggles never fail or leave the counter off."""
+
+        barrier = threading.Barrier(8)
+        statuses = []
+
+        def click():
+            client = app.test_client()
+            self.login(client, 3)
+            barrier.wait()
+            statuses.append(client.post("/users/toggle_like/10").status_code)
+
+        threads = [threading.Thread(target=click) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(statuses, [200] * 8)
+
+        with app.app_context():
+            likes = Likes.query.filter_by(user_id=3, message_id=10).count()
+            self.assertIn(likes, (0, 1))
+            self.assertEqual(self.counts(3)[3], likes)
+
+    def test_message_add_and_delete(self):
+        """Deleting a message uncounts it and the likes it had."""
+
+        with self.client as client:
+            self.login(client, 1)
+
+            client.post("/messages/new", data={"text": "another"})
+            self.assertEqual(self.counts(1)[0], 2)
+
+            client.post("/messages/10/delete")
+            self.assertEqual(self.counts(1)[0], 1)
+            self.assertEqual(self.counts(2)[3], 0)
+
+    def test_delete_user(self):
+        """Deleting an account fixes up everyone else's counters."""
+
+        with self.client as client:
+            self.login(client, 1)
+
+            resp = client.post("/users/delete")
+            self.assertEqual(resp.status_code, 302)
+
+        with app.app_context():
+            self.assertIsNone(User.query.get(1))
+            self.assertEqual(Message.query.count(), 0)
+
+            # the counters are fixed as the purge removes the rows
+            purge_accounts(batch_size=1)
+
+        self.assertEqual(self.counts(2), (0, 0, 0, 0))
+
+    def test_delete_several_at_once(self):
+        """Deleting many rows in one flush uncounts every one of them."""
+
+        with app.app_context():
+            db.session.add_all([
+                Follows(user_being_followed_id=3, user_following_id=1),
+                Follows(user_being_followed_id=3, user_following_id=2),
+                Message(id=11, text="more from alice", user_id=1),
+            ])
+            db.session.commit()
+            db.session.add_all([Likes(user_id=3, message_id=10),
+                                Likes(user_id=3, message_id=11)])
+            db.session.commit()
+            self.assertEqual(self.counts(3), (0, 0, 2, 2))
+
+            for msg in Message.query.all():
+                db.session.delete(msg)
+            db.session.commit()
+            self.assertEqual(self.counts(3), (0, 0, 2, 0))
+
+            db.session.delete(User.query.get(1))
+            db.session.delete(User.query.get(2))
+            db.session.commit()
+            self.assertEqual(self.counts(3), (0, 0, 0, 0))
+
+            self.assertEqual(reconcile_counters(), 0)
+
+    def test_reconcile(self):
+        """reconcile_counters repairs counters that drifted."""
+
+        with app.app_context():
+            User.query.update({User.followers_count: 99, User.likes_count: 7})
+            db.session.commit()
+
+            self.assertEqual(reconcile_counters(batch_size=2), 3)
+
+        self.assertEqual(self.counts(1), (1, 1, 1, 0))
+        self.assertEqual(self.counts(2), (0, 1, 1, 1))
+        self.assertEqual(self.counts(3), (0, 0, 0, 0))
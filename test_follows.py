@@ -0,0 +1,243 @@
+"""Follow/unfollow and follower/following page tests."""
+
+import os
+from datetime import datetime, timedelta
+from unittest import TestCase
+
+from bs4 import BeautifulSoup
+
+from models import db, User, Follows, Message
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+# Now we can import app
+from app import app, CURR_USER_KEY
+from follows import follow_page, follow_users, unfollow_users
+from pagination import decode_cursor
+from timelines import get_timeline_store
+
+app.config['TESTING'] = True
+app.config['WTF_CSRF_ENABLED'] = False
+
+with app.app_context():
+    db.create_all()
+
+
+class FollowsTestCase(TestCase):
+    """Five users; alice (1) already follows bob (2)."""
+
+    def setUp(self):
+
+        app.extensions['user_cache'].clear()
+
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+
+            for uid, name in enumerate(["alice", "bob", "carol", "dave", "erin"], 1):
+                db.session.add(User(id=uid, username=name,
+                                    email=f"{name}@test.com", password="x"))
+            db.session.commit()
+
+            db.session.add(Follows(user_being_followed_id=2, user_following_id=1))
+            db.session.add_all([Message(id=10 * uid, text=f"by {uid}", user_id=uid)
+                                for uid in (2, 3, 4)])
+            db.session.commit()
+
+        self.client = app.test_client()
+
+    def tearDown(self):
+
+        app.config['TIMELINE_FANOUT'] = False
+        app.config['BULK_FOLLOW_LIMIT'] = 1000
+        app.config['FOLLOWS_PER_PAGE'] = 50
+        app.extensions.pop('timelines', None)
+
+        with app.app_context():
+            db.session.rollback()
+            db.drop_all()
+
+    def login(self, client, uid=1):
+        with client.session_transaction() as session:
+            session[CURR_USER_KEY] = uid
+
+    def counts(self, uid):
+        u = db.session.get(User, uid)
+        return u.following_count, u.followers_count
+
+    def following(self, uid):
+        return sorted(db.session.scalars(
+            db.select(Follows.user_being_followed_id)
+            .where(Follows.user_following_id == uid)))
+
+    def test_follow_users(self):
+        """each id gets its own result; counters move only for new follows"""
+
+        with app.app_context():
+            results = follow_users(1, [3, 2, 99, 1, 4, 3])
+            db.session.commit()
+
+            self.assertEqual(list(results.items()), [
+                (3, "followed"), (2, "already_following"), (99, "not_found"),
+                (1, "self"), (4, "followed")])
+            self.assertEqual(self.following(1), [2, 3, 4])
+            self.assertEqual(self.counts(1), (3, 0))
+            self.assertEqual([self.counts(uid)[1] for uid in (2, 3, 4)], [1, 1, 1])
+
+    def test_unfollow_users(self):
+        """unfollowing what isn't followed is not an error"""
+
+        with app.app_context():
+            follow_users(1, [3])
+            results = unfollow_users(1, [2, 3, 4, 99])
+            db.session.commit()
+
+            self.assertEqual(results, {2: "unfollowed", 3: "unfollowed",
+                                       4: "not_following", 99: "not_following"})
+            self.assertEqual(self.following(1), [])
+            self.assertEqual(self.counts(1), (0, 0))
+            self.assertEqual(self.counts(2), (0, 0))
+
+    def test_timelines(self):
+        """a bulk change rebuilds the precomputed timeline once"""
+
+        app.config['TIMELINE_FANOUT'] = True
+        app.extensions.pop('timelines', None)
+
+        with app.app_context():
+            store = get_timeline_store()
+            store.rebuild(1)
+
+            follow_users(1, [3, 4])
+            db.session.commit()
+            self.assertEqual([m.id for m in store.read(1, 10)], [40, 30, 20])
+
+            unfollow_users(1, [2, 3])
+            db.session.commit()
+            self.assertEqual([m.id for m in store.read(1, 10)], [40])
+
+    def test_endpoint(self):
+        """POST /api/v1/following applies both lists and reports on each id"""
+
+        resp = self.client.post("/api/v1/following", json={"follow": [3]})
+        self.assertEqual(resp.status_code, 401)
+
+        with self.client as client:
+            self.login(client)
+
+            resp = client.post("/api/v1/following",
+                               json={"follow": [3, 4, 99], "unfollow": [2]})
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual(resp.headers["Cache-Control"], "no-store")
+            self.assertEqual(resp.json, {
+                "follow": [{"id": 3, "result": "followed"},
+                           {"id": 4, "result": "followed"},
+                           {"id": 99, "result": "not_found"}],
+                "unfollow": [{"id": 2, "result": "unfollowed"}],
+            })
+
+            with app.app_context():
+                self.assertEqual(self.following(1), [3, 4])
+
+            app.config['BULK_FOLLOW_LIMIT'] = 2
+            for body in ({"follow": [3, 4, 5]},
+                         {"follow": [3], "unfollow": [3]},
+                         {"follow": ["3"]},
+                         {"follow": 3},
+                         [3]):
+                with self.subTest(body=body):
+                    resp = client.post("/api/v1/following", json=body)
+                    self.assertEqual(resp.status_code, 400)
+                    self.assertEqual(resp.json, {"error": "Bad Request"})
+
+            # a form post (which another site could make) isn't accepted
+            resp = client.post("/api/v1/following", data={"follow": "5"})
+            self.assertEqual(resp.status_code, 400)
+
+    def test_single_views(self):
+        """the HTML follow buttons go through the same code"""
+
+        with self.client as client:
+            self.login(client)
+
+            resp = client.post("/users/follow/3")
+            self.assertEqual(resp.status_code, 302)
+            self.assertEqual(client.post("/users/follow/99").status_code, 404)
+
+            resp = client.post("/users/stop-following/2")
+            self.assertEqual(resp.status_code, 302)
+            # not following (or no such user) used to be an error
+            self.assertEqual(client.post("/users/stop-following/99").status_code, 302)
+
+        with app.app_context():
+            self.assertEqual(self.following(1), [3])
+            self.assertEqual(self.counts(1), (1, 0))
+
+    def test_follow_page(self):
+        """newest follow first, a page at a time, with both follow flags"""
+
+        start = datetime(2026, 10, 1)
+
+        with app.app_context():
+            # carol, dave and erin follow bob, a day apart; bob follows dave back
+            db.session.add_all([
+                Follows(user_being_followed_id=2, user_following_id=uid,
+                        created_at=start + timedelta(days=uid))
+                for uid in (3, 4, 5)])
+            db.session.add(Follows(user_being_followed_id=4, user_following_id=2))
+            db.session.commit()
+
+            # alice's follow, from setUp, is the newest
+            cards, cursor = follow_page(2, 'followers', 2, None, 2)
+            self.assertEqual([(c.user.id, c.you_follow, c.follows_you) for c in cards],
+                             [(1, False, True), (5, False, True)])
+
+            cards, cursor = follow_page(2, 'followers', 2, decode_cursor(cursor), 2)
+            self.assertEqual([(c.user.id, c.you_follow, c.follows_you) for c in cards],
+                             [(4, True, True), (3, False, True)])
+            self.assertIsNone(cursor)
+
+            # seen by alice, who follows bob only
+            cards, _ = follow_page(2, 'following', 1, None, 50)
+            self.assertEqual([(c.user.id, c.you_follow, c.follows_you) for c in cards],
+                             [(4, False, False)])
+
+    def test_follow_pages(self):
+        """the HTML pages show follow state and link to the next page"""
+
+        app.config['FOLLOWS_PER_PAGE'] = 2
+
+        with app.app_context():
+            follow_users(3, [2])
+            follow_users(2, [3])
+            follow_users(4, [2])
+            follow_users(5, [2])
+            db.session.commit()
+
+        with self.client as client:
+            self.login(client, 2)
+
+            resp = client.get("/users/2/followers")
+            html = resp.get_data(as_text=True)
+            self.assertIn("@erin", html)
+            self.assertNotIn("@carol", html)
+            self.assertNotIn("stop-following", html)
+
+            more = BeautifulSoup(html, 'html.parser').find(id="load-more")["href"]
+            html = client.get(more).get_data(as_text=True)
+            self.assertIn("@carol", html)
+            self.assertIn('action="/users/stop-following/3"', html)
+            self.assertIsNone(BeautifulSoup(html, 'html.parser').find(id="load-more"))
+
+            self.assertEqual(client.get("/users/2/followers?before=junk").status_code, 400)
+
+            # on someone else's list: carol follows bob, bob follows carol
+            self.login(client, 3)
+            html = client.get("/users/3/following").get_data(as_text=True)
+            self.assertIn("Follows you", html)
+            self.assertIn('action="/users/stop-following/2"', html)
@@ -0,0 +1,90 @@
+"""Synthetic data generator tests."""
+
+import csv
+import glob
+import os
+import shutil
+import sys
+import tempfile
+from collections import Counter
+from unittest import TestCase
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'generator'))
+
+import create_csvs
+
+
+def read(directory, table):
+    rows = []
+    for path in sorted(glob.glob(os.path.join(directory, f"{table}*.csv"))):
+        with open(path, newline='') as f:
+            rows.extend(csv.DictReader(f))
+    return rows
+
+
+class GeneratorTestCase(TestCase):
+    """Generate small datasets into scratch directories."""
+
+    ARGS = ['--users', '2500', '--messages', '3000', '--end', '2026-01-01',
+            '--workers', '2']
+
+    def setUp(self):
+        self.dirs = []
+
+    def tearDown(self):
+        for directory in self.dirs:
+            shutil.rmtree(directory)
+
+    def generate(self, *args):
+        directory = tempfile.mkdtemp()
+        self.dirs.append(directory)
+        create_csvs.main([*self.ARGS, *args, '--out', directory])
+        return directory
+
+    def test_deterministic_across_shards(self):
+        """the same seed gives the same rows, however they're split up"""
+
+        create_csvs.BLOCK_SIZE, block_size = 1000, create_csvs.BLOCK_SIZE
+        try:
+            whole = self.generate()
+            sharded = self.generate('--shards', '3')
+        finally:
+            create_csvs.BLOCK_SIZE = block_size
+
+        self.assertEqual(sorted(os.listdir(whole)),
+                         ["follows.csv", "messages.csv", "users.csv"])
+        self.assertIn("users.0002.csv", os.listdir(sharded))
+
+        for table in ("users", "messages", "follows"):
+            self.assertEqual(read(whole, table), read(sharded, table))
+
+        other = self.generate('--seed', 'other')
+        self.assertNotEqual(read(whole, "users"), read(other, "users"))
+
+    def test_shape(self):
+        """unique users, valid follows, popular users, recent messages"""
+
+        directory = self.generate()
+
+        users = read(directory, "users")
+        self.assertEqual([int(u["id"]) for u in users], list(range(1, 2501)))
+        self.assertEqual(len({u["username"] for u in users}), 2500)
+        self.assertEqual(len({u["email"] for u in users}), 2500)
+        self.assertTrue(all(u["header_image_url"].startswith("/static/")
+                            for u in users))
+
+        follows = read(directory, "follows")
+        pairs = [(f["user_being_followed_id"], f["user_following_id"])
+                 for f in follows]
+        self.assertEqual(len(pairs), len(set(pairs)))
+        self.assertFalse([p for p in pairs if p[0] == p[1]])
+
+        # a long tail: the most followed user has far more than the median
+        followers = sorted(Counter(p[0] for p in pairs).values(), reverse=True)
+        self.assertGreater(followers[0], 20 * followers[len(followers) // 2])
+
+        messages = read(directory, "messages")
+        self.assertEqual(len(messages), 3000)
+        self.assertTrue(all(len(m["text"]) <= 140 for m in messages))
+        last_quarter = [m for m in messages if m["timestamp"] >= "2025-07-03"]
+        self.assertGreater(len(last_quarter), len(messages) / 2)
@@ -0,0 +1,176 @@
+"""Background job tests."""
+
+import os
+import threading
+from datetime import datetime, timedelta
+from unittest import TestCase
+
+from models import db, Job
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+# Now we can import app
+from app import app
+from jobs import Worker, claim_jobs, enqueue, job
+
+app.config['TESTING'] = True
+app.config['WTF_CSRF_ENABLED'] = False
+
+with app.app_context():
+    db.create_all()
+
+LEASE = timedelta(minutes=5)
+
+# what the test jobs did, in order
+done = []
+done_lock = threading.Lock()
+
+
+@job('test_record')
+def record(value):
+    with done_lock:
+        done.append(value)
+
+
+@job('test_flaky', max_attempts=2)
+def flaky(key, fail_times):
+    with done_lock:
+        done.append(key)
+        if done.count(key) <= fail_times:
+            raise RuntimeError(f"failure {done.count(key)}")
+
+
+@job('test_single', concurrency=1)
+def single():
+    pass
+
+
+class JobsTestCase(TestCase):
+
+    def setUp(self):
+
+        done.clear()
+
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+
+        self.runner = app.test_cli_runner()
+
+    def tearDown(self):
+
+        with app.app_context():
+            db.session.rollback()
+            db.drop_all()
+
+    def job_states(self):
+        return [(j.name, j.status, j.attempts)
+                for j in Job.query.order_by(Job.id)]
+
+    def test_runs_by_priority(self):
+        """due jobs run most urgent first; held back ones wait"""
+
+        with app.app_context():
+            enqueue('test_record', value="later", priority=5)
+            enqueue('test_record', value="first", priority=-1)
+            enqueue('test_record', value="next")
+            enqueue('test_record', value="tomorrow", delay=timedelta(days=1))
+            db.session.commit()
+
+        Worker(app, threads=1).run(burst=True)
+
+        self.assertEqual(done, ["first", "next", "later"])
+        with app.app_context():
+            self.assertEqual([s for _, s, _ in self.job_states()],
+                             ["done", "done", "done", "queued"])
+
+    def test_rolled_back(self):
+        """a job queued by a transaction that rolls back is never run"""
+
+        with app.app_context():
+            enqueue('test_record', value="nope")
+            db.session.rollback()
+            self.assertEqual(Job.query.count(), 0)
+
+    def test_retries(self):
+        """a failing job is retried later, then left failed"""
+
+        with app.app_context():
+            enqueue('test_flaky', key="once", fail_times=1)
+            enqueue('test_flaky', key="always", fail_times=5)
+            db.session.commit()
+
+        Worker(app).run(burst=True)
+
+        with app.app_context():
+            first, second = Job.query.order_by(Job.id).all()
+            self.assertEqual((first.status, first.attempts), ("queued", 1))
+            self.assertIn("RuntimeError: failure", first.last_error)
+            # JOBS_RETRY_SECONDS from now
+            self.assertGreater(first.run_at, datetime.utcnow() + timedelta(seconds=5))
+
+            Job.query.update({'run_at': datetime.utcnow()})
+            db.session.commit()
+
+        Worker(app).run(burst=True)
+
+        with app.app_context():
+            self.assertEqual([s for _, s, _ in self.job_states()], ["done", "failed"])
+
+        result = self.runner.invoke(args=["jobs", "list", "--status", "failed"])
+        self.assertIn("test_flaky", result.output)
+        self.assertIn("RuntimeError: failure", result.output)
+
+        result = self.runner.invoke(args=["jobs", "retry", "--all"])
+        self.assertIn("Queued 1 job(s) again.", result.output)
+        with app.app_context():
+            self.assertEqual(self.job_states()[1], ("test_flaky", "queued", 0))
+
+    def test_concurrency(self):
+        """a type at its limit is passed over for others"""
+
+        with app.app_context():
+            enqueue('test_single')
+            enqueue('test_single')
+            enqueue('test_record', value="x", priority=1)
+            db.session.commit()
+
+            claimed = claim_jobs("one", 5, LEASE)
+            self.assertEqual([name for _, name, _ in claimed],
+                             ["test_single", "test_record"])
+
+            # still running elsewhere
+            self.assertEqual(claim_jobs("two", 5, LEASE), [])
+
+    def test_lapsed_claim(self):
+        """a dead worker's jobs are claimed again once its lease runs out"""
+
+        with app.app_context():
+            enqueue('test_record', value="x")
+            db.session.commit()
+
+            (job_id, _, _), = claim_jobs("dead", 1, LEASE)
+            Job.query.update({'locked_until': datetime.utcnow() - timedelta(seconds=1)})
+            db.session.commit()
+
+            self.assertEqual(claim_jobs("alive", 1, LEASE),
+                             [(job_id, "test_record", {"value": "x"})])
+            self.assertEqual(db.session.get(Job, job_id).attempts, 2)
+
+    def test_stats(self):
+        """`flask jobs stats` counts jobs by name and status"""
+
+        with app.app_context():
+            enqueue('test_record', value="x")
+            enqueue('test_record', value="y", delay=timedelta(hours=1))
+            db.session.commit()
+
+        result = self.runner.invoke(args=["jobs", "stats"])
+        self.assertEqual(result.exit_code, 0)
+        line, = [l for l in result.output.splitlines() if l.startswith("test_record")]
+        self.assertEqual(line.split()[1:6], ["1", "1", "0", "0", "0"])
@@ -0,0 +1,227 @@
+"""Bulk CSV loader tests."""
+
+import os
+import shutil
+import tempfile
+from datetime import datetime
+from unittest import TestCase
+
+from psycopg2 import DataError
+from sqlalchemy import create_engine, inspect, select, text
+
+from models import db, User, Message, Follows, Likes
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+# Now we can import app
+from app import app
+from loader import TABLES, find_csvs, insert_table, load_csvs, load_stages
+
+app.config['TESTING'] = True
+
+with app.app_context():
+    db.create_all()
+
+USERS = '''id,email,username,password,bio
+1,alice@test.com,alice,x,"likes commas, and ""quotes"""
+2,bob@test.com,bob,x,
+3,carol@test.com,carol,x,hi
+'''
+
+MESSAGES = """text,timestamp,user_id
+first,2020-01-01 10:00:00,1
+second,2020-01-02 10:00:00.5,2
+third,2020-01-03 10:00:00,1
+"""
+
+FOLLOWS = """user_being_followed_id,user_following_id
+1,2
+1,3
+2,1
+"""
+
+
+def schema():
+    """Index and foreign key names on the loaded tables."""
+
+    inspector = inspect(db.engine)
+    return {t.name: (sorted(i['name'] for i in inspector.get_indexes(t.name)),
+                     sorted(u['name'] for u in inspector.get_unique_constraints(t.name)),
+                     sorted(f['name'] for f in inspector.get_foreign_keys(t.name)))
+            for t in TABLES}
+
+
+class LoaderTestCase(TestCase):
+    """Load small CSVs into the test database."""
+
+    def setUp(self):
+
+        app.extensions['user_cache'].clear()
+
+        self.dir = tempfile.mkdtemp()
+        self.sources = {}
+        for name, content in [("users", USERS), ("messages", MESSAGES),
+                              ("follows", FOLLOWS)]:
+            self.sources[name] = [self.write(f"{name}.csv", content)]
+
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+
+    def tearDown(self):
+
+        shutil.rmtree(self.dir)
+
+        with app.app_context():
+            db.session.rollback()
+            db.drop_all()
+
+    def write(self, name, content):
+        path = os.path.join(self.dir, name)
+        with open(path, 'w') as f:
+            f.write(content)
+        return path
+
+    def test_stages(self):
+        """messages and follows both wait for users, then go together"""
+
+        stages = load_stages(TABLES)
+        self.assertEqual([[t.name for t in stage] for stage in stages],
+                         [["users"], ["messages", "follows"]])
+
+    def test_fresh_load(self):
+        """rows, counters, sequences and indexes all end up right"""
+
+        with app.app_context():
+            before = schema()
+            results = load_csvs(self.sources)
+
+            self.assertEqual({r.table: r.rows for r in results},
+                             {"users": 3, "messages": 3, "follows": 3})
+            self.assertEqual(schema(), before)
+
+            alice = db.session.get(User, 1)
+            self.assertEqual(alice.bio, 'likes commas, and "quotes"')
+            self.assertIsNone(db.session.get(User, 2).bio)
+            self.assertEqual((alice.messages_count, alice.followers_count,
+                              alice.following_count), (2, 2, 1))
+
+            msg = db.session.scalar(select(Message).filter_by(text="second"))
+            self.assertEqual(msg.timestamp, datetime(2020, 1, 2, 10, 0, 0, 500000))
+
+            # the sequence moved past the ids in the file
+            db.session.add(User(username="dave", email="dave@test.com",
+                                password="x"))
+            db.session.commit()
+            self.assertEqual(db.session.scalar(
+                select(User.id).filter_by(username="dave")), 4)
+
+    def test_reload_keeps_schema(self):
+        """a fresh load empties the tables but leaves what migrations made"""
+
+        with app.app_context():
+            load_csvs(self.sources)
+            db.session.add(Likes(user_id=1, message_id=1))
+            db.session.execute(text("CREATE INDEX ix_users_bio_test ON users (bio)"))
+            db.session.commit()
+
+            load_csvs(self.sources)
+
+            self.assertIn("ix_users_bio_test",
+                          [i['name'] for i in inspect(db.engine).get_indexes("users")])
+            self.assertEqual(db.session.scalar(select(db.func.count(Likes.id))), 0)
+            self.assertEqual(db.session.scalar(select(db.func.count(User.id))), 3)
+
+    def test_append(self):
+        """appending keeps what's there and adds to the counters"""
+
+        with app.app_context():
+            load_csvs(self.sources)
+            more = {"messages": [self.write("more.csv",
+                                            "text,timestamp,user_id\n"
+                                            "fourth,2020-01-04 10:00:00,3\n")]}
+            results = load_csvs(more, append=True)
+
+            self.assertEqual([(r.table, r.rows) for r in results],
+                             [("messages", 1)])
+            self.assertEqual(db.session.scalar(select(db.func.count(Message.id))), 4)
+            self.assertEqual(db.session.get(User, 3).messages_count, 1)
+            self.assertEqual(db.session.scalar(select(db.func.count())
+                                               .select_from(Follows)), 3)
+
+    def test_shards(self):
+        """a table split over several files loads them all"""
+
+        shutil.rmtree(self.dir)
+        os.mkdir(self.dir)
+        header, *rows = USERS.splitlines()
+        self.write("users.0000.csv", "\n".join([header, *rows[:2]]) + "\n")
+        self.write("users.0001.csv", "\n".join([header, rows[2]]) + "\n")
+        self.write("follows.csv", FOLLOWS)
+
+        sources = find_csvs(self.dir)
+        self.assertEqual({name: [os.path.basename(p) for p in paths]
+                          for name, paths in sources.items()},
+                         {"users": ["users.0000.csv", "users.0001.csv"],
+                          "follows": ["follows.csv"]})
+
+        with app.app_context():
+            results = load_csvs(sources)
+            self.assertEqual([(r.table, r.rows) for r in results],
+                             [("users", 3), ("follows", 3)])
+            self.assertEqual(db.session.get(User, 1).followers_count, 2)
+
+    def test_failed_load_restores_schema(self):
+        """a bad file doesn't leave the tables without their indexes"""
+
+        self.sources["follows"] = [self.write("bad.csv",
+                                              "user_being_followed_id,user_following_id\n"
+                                              "1,nope\n")]
+
+        with app.app_context():
+            before = schema()
+            with self.assertRaises(DataError):
+                load_csvs(self.sources)
+            self.assertEqual(schema(), before)
+
+    def test_restore_failure_is_reported(self):
+        """a constraint the rows break is named; the rest still come back"""
+
+        self.sources["users"] = [self.write("dupes.csv",
+                                            USERS + "4,bob2@test.com,bob,x,\n")]
+
+        with app.app_context():
+            before = schema()
+            with self.assertRaises(RuntimeError) as raised:
+                load_csvs(self.sources)
+
+            self.assertIn("ADD CONSTRAINT users_username_key", str(raised.exception))
+            self.assertIn("could not create unique index", str(raised.exception))
+
+            # everything but the broken constraint is back
+            after = schema()
+            self.assertEqual(after["messages"], before["messages"])
+            self.assertEqual(after["follows"], before["follows"])
+            self.assertEqual(after["users"],
+                             tuple([n for n in names if n != "users_username_key"]
+                                   for names in before["users"]))
+
+    def test_insert_fallback(self):
+        """databases without COPY get batched INSERTs"""
+
+        engine = create_engine("sqlite://")
+        Message.__table__.create(engine)
+
+        rows = insert_table(engine, Message.__table__, self.sources["messages"][0],
+                            batch_size=2)
+
+        self.assertEqual(rows, 3)
+        with engine.connect() as connection:
+            stamps = connection.scalars(
+                select(Message.timestamp).order_by(Message.timestamp)).all()
+        self.assertEqual(stamps[1], datetime(2020, 1, 2, 10, 0, 0, 500000))
@@ -39,6 +39,8 @@ class MessageViewTestCase(TestCase):
     def setUp(self):
         """Create test client, add sample data."""
 
+        app.extensions['user_cache'].clear()
+
         with app.app_context():
             
             db.drop_all()
@@ -0,0 +1,172 @@
+"""Metrics endpoint tests."""
+
+import os
+import re
+from unittest import TestCase
+
+from flask import g
+from sqlalchemy import text
+from sqlalchemy.exc import ProgrammingError
+
+from models import db, Message, User
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+# Now we can import app
+from app import app, CURR_USER_KEY
+from metrics import Histogram
+from test_query_counts import count_queries
+
+app.config['TESTING'] = True
+
+with app.app_context():
+    db.create_all()
+
+
+def sample(text, name, **labels):
+    """Value of the metric line `name{labels...}` in an exposition."""
+
+    wanted = ",".join(f'{k}="{v}"' for k, v in labels.items())
+    match = re.search(rf'^{name}{{{re.escape(wanted)}}} (\S+)$', text, re.M)
+    return float(match.group(1)) if match else None
+
+
+class MetricsTestCase(TestCase):
+    """Test request/DB instrumentation."""
+
+    def setUp(self):
+
+        app.extensions['user_cache'].clear()
+
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+
+            db.session.add(User(id=1, username="metered",
+                                email="metered@test.com", password="x"))
+            db.session.add(Message(id=1, text="counted", user_id=1))
+            db.session.commit()
+
+        self.client = app.test_client()
+        self.metrics = app.extensions['metrics']
+
+    def tearDown(self):
+
+        with app.app_context():
+            db.session.rollback()
+            db.drop_all()
+
+        app.config['METRICS_TOKEN'] = None
+
+    def scrape(self):
+        resp = self.client.get("/metrics")
+        self.assertEqual(resp.status_code, 200)
+        return resp.get_data(as_text=True)
+
+    def test_records_requests(self):
+        """requests show up by endpoint and status, with DB query counts"""
+
+        before = sample(self.scrape(), "warbler_requests_total",
+                        endpoint="users_show", method="GET", status="200") or 0
+
+        with self.client as client:
+            with client.session_transaction() as session:
+                session[CURR_USER_KEY] = 1
+            client.get("/users/1")
+            client.get("/users/99999")
+
+        text = self.scrape()
+        self.assertEqual(sample(text, "warbler_requests_total",
+                                endpoint="users_show", method="GET", status="200"),
+                         before + 1)
+        self.assertIsNotNone(sample(text, "warbler_requests_total",
+                                    endpoint="users_show", method="GET",
+                                    status="404"))
+        self.assertGreater(sample(text, "warbler_request_db_queries_sum",
+                                  endpoint="users_show"), 0)
+        self.assertIsNotNone(sample(text, "warbler_request_duration_seconds_bucket",
+                                    endpoint="users_show", le="+Inf"))
+
+    def test_streamed_pages(self):
+        """a streamed page is recorded with the queries its body ran"""
+
+        with app.app_context():
+            for i in range(2, 5):
+                db.session.add(User(id=i, username=f"other{i}",
+                                    email=f"other{i}@test.com", password="x"))
+            db.session.commit()
+
+        text = self.scrape()
+        requests = sample(text, "warbler_requests_total", endpoint="list_users",
+                          method="GET", status="200") or 0
+        queries = sample(text, "warbler_request_db_queries_sum",
+                         endpoint="list_users") or 0
+
+        # one batch per user, so follow state is looked up while streaming
+        app.config['STREAM_LIST_PAGES'] = True
+        app.config['LIST_BATCH_SIZE'] = 1
+        try:
+            with self.client as client:
+                with client.session_transaction() as session:
+                    session[CURR_USER_KEY] = 1
+                # the server closes a streamed response once it has sent it
+                with count_queries() as ran:
+                    resp = client.get("/users", buffered=True)
+        finally:
+            app.config['STREAM_LIST_PAGES'] = False
+            app.config['LIST_BATCH_SIZE'] = 500
+
+        self.assertIn("@other4", resp.get_data(as_text=True))
+
+        text = self.scrape()
+        self.assertEqual(sample(text, "warbler_requests_total",
+                                endpoint="list_users", method="GET", status="200"),
+                         requests + 1)
+        self.assertEqual(sample(text, "warbler_request_db_queries_sum",
+                                endpoint="list_users"), queries + ran[0])
+
+    def test_failed_statement(self):
+        """a statement that raises leaves nothing behind on its connection"""
+
+        with app.test_request_context("/"):
+            app.preprocess_request()
+            connection = db.session.connection()
+            info = dict(connection.info)
+
+            for _ in range(3):
+                with self.assertRaises(ProgrammingError):
+                    db.session.execute(text("SELECT nope FROM nowhere"))
+                db.session.rollback()
+                connection = db.session.connection()
+
+            db.session.execute(text("SELECT 1"))
+            self.assertEqual(dict(connection.info), info)
+            self.assertEqual(g.db_queries, 1)
+
+    def test_token(self):
+        """METRICS_TOKEN protects the endpoint"""
+
+        app.config['METRICS_TOKEN'] = "sekrit"
+
+        self.assertEqual(self.client.get("/metrics").status_code, 403)
+        resp = self.client.get("/metrics",
+                               headers={"Authorization": "Bearer sekrit"})
+        self.assertEqual(resp.status_code, 200)
+
+    def test_histogram_buckets(self):
+        """buckets are cumulative and +Inf equals the count"""
+
+        h = Histogram("h", "test", (1, 5))
+        for value in (0.5, 1, 3, 9):
+            h.observe("x", value)
+
+        lines = list(h.render("label"))
+        self.assertIn('h_bucket{label="x",le="1"} 2', lines)
+        self.assertIn('h_bucket{label="x",le="5"} 3', lines)
+        self.assertIn('h_bucket{label="x",le="+Inf"} 4', lines)
+        self.assertIn('h_count{label="x"} 4', lines)
@@ -0,0 +1,125 @@
+"""Password hashing tests."""
+
+import os
+from unittest import TestCase
+
+from models import db, User
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+# Now we can import app
+from app import app
+from passwords import (HasherBusy, PasswordHasher, hash_password, hash_rounds,
+                       init_password_hasher)
+
+app.config['TESTING'] = True
+app.config['WTF_CSRF_ENABLED'] = False
+
+with app.app_context():
+    db.create_all()
+
+
+class PasswordHasherTestCase(TestCase):
+    """Test the hasher on its own."""
+
+    def test_modes_hash_and_check(self):
+        """every mode produces hashes the others can check"""
+
+        for mode in ('inline', 'thread', 'process'):
+            with self.subTest(mode=mode):
+                hasher = PasswordHasher(rounds=4, mode=mode, workers=1)
+                try:
+                    pw_hash = hasher.hash("secret")
+                    self.assertEqual(hash_rounds(pw_hash), 4)
+                    self.assertTrue(hasher.check(pw_hash, "secret"))
+                    self.assertFalse(hasher.check(pw_hash, "wrong"))
+                finally:
+                    hasher.shutdown()
+
+    def test_empty_password(self):
+        """empty passwords are refused before reaching the pool"""
+
+        hasher = PasswordHasher(rounds=4, mode='thread', workers=1)
+        try:
+            with self.assertRaises(ValueError):
+                hasher.hash(None)
+        finally:
+            hasher.shutdown()
+
+    def test_busy(self):
+        """past max_pending the hasher refuses instead of queueing"""
+
+        hasher = PasswordHasher(rounds=4, mode='thread', workers=1, max_pending=1)
+
+        # stand in for a hash that's still running
+        hasher._slots.acquire()
+        with self.assertRaises(HasherBusy):
+            hasher.hash("secret")
+        hasher._slots.release()
+
+        self.assertTrue(hasher.check(hasher.hash("secret"), "secret"))
+        hasher.shutdown()
+
+
+class PasswordViewTestCase(TestCase):
+    """Test rehashing and load shedding through the app."""
+
+    def setUp(self):
+
+        app.extensions['user_cache'].clear()
+
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+
+            db.session.add(User(id=1, username="old", email="old@test.com",
+                                password=hash_password("password", 5)))
+            db.session.commit()
+
+        self.client = app.test_client()
+
+    def tearDown(self):
+
+        app.config['BCRYPT_LOG_ROUNDS'] = 12
+        app.config['PASSWORD_HASH_MODE'] = 'inline'
+        app.config['PASSWORD_HASH_MAX_PENDING'] = None
+        init_password_hasher(app)
+
+        with app.app_context():
+            db.session.rollback()
+            db.drop_all()
+
+    def test_rehash_on_login(self):
+        """logging in upgrades a hash made at another cost"""
+
+        app.config['BCRYPT_LOG_ROUNDS'] = 4
+        init_password_hasher(app)
+
+        resp = self.client.post("/login", data={"username": "old",
+                                                "password": "password"})
+        self.assertEqual(resp.status_code, 302)
+
+        with app.app_context():
+            pw_hash = User.query.get(1).password
+            self.assertEqual(hash_rounds(pw_hash), 4)
+            self.assertTrue(User.authenticate("old", "password"))
+
+    def test_busy_is_503(self):
+        """a saturated hasher turns logins away with a 503"""
+
+        app.config['PASSWORD_HASH_MODE'] = 'thread'
+        app.config['PASSWORD_HASH_MAX_PENDING'] = 1
+        hasher = init_password_hasher(app)
+        hasher._slots.acquire()
+
+        resp = self.client.post("/login", data={"username": "old",
+                                                "password": "password"})
+        self.assertEqual(resp.status_code, 503)
+        self.assertEqual(resp.headers['Retry-After'], '1')
+
+        hasher._slots.release()
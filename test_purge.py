@@ -0,0 +1,186 @@
+"""Account deletion and purge tests."""
+
+import os
+from unittest import TestCase, mock
+
+from models import (db, User, Follows, Likes, Message, AccountPurge, Job,
+                    TimelineEntry)
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+# Now we can import app
+from app import app, CURR_USER_KEY
+from counters import reconcile_counters
+from jobs import Worker
+from purge import PURGERS, purge_accounts
+from timelines import get_timeline_store
+
+app.config['TESTING'] = True
+app.config['WTF_CSRF_ENABLED'] = False
+
+with app.app_context():
+    db.create_all()
+
+
+class PurgeTestCase(TestCase):
+    """alice (1) follows and is followed by bob (2) and carol (3); bob and
+    carol like her two messages, and she likes one of bob's."""
+
+    def setUp(self):
+
+        app.extensions['user_cache'].clear()
+        app.extensions.pop('user_search', None)
+
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+
+            for uid, name in enumerate(["alice", "bob", "carol", "dave"], 1):
+                db.session.add(User(id=uid, username=name,
+                                    email=f"{name}@test.com", password="x"))
+            db.session.commit()
+
+            for other in (2, 3):
+                db.session.add(Follows(user_being_followed_id=other, user_following_id=1))
+                db.session.add(Follows(user_being_followed_id=1, user_following_id=other))
+            db.session.add(Follows(user_being_followed_id=2, user_following_id=4))
+            db.session.add_all([
+                Message(id=10, text="alice's first", user_id=1),
+                Message(id=11, text="alice's second", user_id=1),
+                Message(id=20, text="bob's", user_id=2),
+            ])
+            db.session.commit()
+
+            db.session.add_all([
+                Likes(user_id=2, message_id=10),
+                Likes(user_id=2, message_id=11),
+                Likes(user_id=3, message_id=10),
+                Likes(user_id=1, message_id=20),
+            ])
+            db.session.commit()
+
+        self.client = app.test_client()
+
+    def tearDown(self):
+
+        app.config['TIMELINE_FANOUT'] = False
+        app.extensions.pop('timelines', None)
+
+        with app.app_context():
+            db.session.rollback()
+            db.drop_all()
+
+    def login(self, client, uid):
+        with client.session_transaction() as session:
+            session[CURR_USER_KEY] = uid
+
+    def delete_alice(self):
+        with self.client as client:
+            self.login(client, 1)
+            self.assertEqual(client.post("/users/delete").status_code, 302)
+
+    def counts(self, uid):
+        u = db.session.get(User, uid)
+        return (u.messages_count, u.following_count,
+                u.followers_count, u.likes_count)
+
+    def test_hidden(self):
+        """a deleted account and its messages disappear at once"""
+
+        self.delete_alice()
+
+        with app.app_context():
+            self.assertIsNone(User.query.get(1))
+            self.assertEqual([m.id for m in Message.query], [20])
+            self.assertIsNotNone(User.query.execution_options(include_deleted=True)
+                                 .filter_by(id=1).one().deleted_at)
+            self.assertEqual(AccountPurge.query.one().stage, "likes")
+
+        with self.client as client:
+            self.login(client, 2)
+
+            self.assertEqual(client.get("/users/1").status_code, 404)
+            self.assertEqual(client.get("/messages/10").status_code, 404)
+            self.assertEqual(client.get("/api/v1/users/1").status_code, 404)
+            self.assertNotIn("alice", client.get("/").get_data(as_text=True))
+            self.assertNotIn("@alice", client.get("/users").get_data(as_text=True))
+            self.assertNotIn("@alice",
+                             client.get("/users/2/followers").get_data(as_text=True))
+            self.assertEqual(client.post("/users/follow/1").status_code, 404)
+
+    def test_purge(self):
+        """everything goes, a batch at a time, and the counters follow"""
+
+        app.config['TIMELINE_FANOUT'] = True
+        app.extensions.pop('timelines', None)
+
+        with app.app_context():
+            for uid in (2, 3):
+                get_timeline_store().rebuild(uid)
+            db.session.commit()
+
+        self.delete_alice()
+
+        with app.app_context():
+            self.assertEqual(purge_accounts(batch_size=1), (1, 10))
+            self.assertEqual(purge_accounts(batch_size=1), (0, 0))
+
+            self.assertIsNone(db.session.get(
+                User, 1, execution_options={'include_deleted': True}))
+            self.assertEqual(Follows.query.count(), 1)
+            self.assertEqual(Likes.query.count(), 0)
+            self.assertEqual(db.session.scalar(
+                db.select(db.func.count()).select_from(Message.__table__)), 1)
+            self.assertEqual(TimelineEntry.query.filter_by(author_id=1).count(), 0)
+
+            purge = AccountPurge.query.one()
+            self.assertEqual((purge.stage, purge.rows_deleted), ("account", 10))
+            self.assertIsNotNone(purge.finished_at)
+
+            self.assertEqual(self.counts(2), (1, 0, 1, 0))
+            self.assertEqual(db.session.get(Message, 20).like_count, 0)
+            self.assertEqual(reconcile_counters(), 0)
+
+    def test_purged_by_job(self):
+        """deleting queues a job that does the purge"""
+
+        self.delete_alice()
+
+        with app.app_context():
+            self.assertEqual(Job.query.one().payload, {"user_id": 1})
+
+        Worker(app).run(burst=True)
+
+        with app.app_context():
+            self.assertEqual(Job.query.one().status, "done")
+            self.assertIsNotNone(AccountPurge.query.one().finished_at)
+            self.assertEqual(Follows.query.count(), 1)
+            self.assertEqual(reconcile_counters(), 0)
+
+    def test_resume(self):
+        """a purge that dies part way picks up from its stage"""
+
+        self.delete_alice()
+
+        def crash(connection, user_id, batch_size):
+            raise RuntimeError("lost the database")
+
+        with app.app_context():
+            with mock.patch.dict(PURGERS, following=crash):
+                with self.assertRaises(RuntimeError):
+                    purge_accounts(batch_size=1)
+            db.session.rollback()
+
+            purge = AccountPurge.query.one()
+            self.assertEqual((purge.stage, purge.rows_deleted), ("following", 6))
+            # what was done so far was counted as it went
+            self.assertEqual(reconcile_counters(), 0)
+
+            self.assertEqual(purge_accounts(batch_size=1), (1, 4))
+            self.assertEqual(AccountPurge.query.one().rows_deleted, 10)
+            self.assertEqual(reconcile_counters(), 0)
@@ -0,0 +1,168 @@
+"""Query count tests: listing pages must not issue a query per author."""
+
+import os
+from contextlib import contextmanager
+from unittest import TestCase
+
+from sqlalchemy import event
+
+from models import db, Message, User, Follows, Likes
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+# Now we can import app
+from app import app, CURR_USER_KEY
+from timelines import get_timeline_store
+
+app.config['TESTING'] = True
+
+with app.app_context():
+    db.create_all()
+
+NUM_AUTHORS = 12
+VIEWER_ID = 1
+
+
+@contextmanager
+def count_queries():
+    """Count the SQL statements run inside the block: `with ... as n: n[0]`."""
+
+    counter = [0]
+
+    def bump(*args):
+        counter[0] += 1
+
+    with app.app_context():
+        engine = db.engine
+
+    event.listen(engine, 'before_cursor_execute', bump)
+    try:
+        yield counter
+    finally:
+        event.remove(engine, 'before_cursor_execute', bump)
+
+
+class QueryCountTestCase(TestCase):
+    """A page of messages from many authors costs a small, fixed number of queries."""
+
+    def setUp(self):
+        """The viewer follows NUM_AUTHORS users, each with two messages."""
+
+        app.extensions['user_cache'].clear()
+
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+
+            db.session.add(User(id=VIEWER_ID, username="viewer",
+                                email="viewer@test.com", password="x"))
+            for uid in range(2, NUM_AUTHORS + 2):
+                db.session.add(User(id=uid, username=f"author{uid}",
+                                    email=f"author{uid}@test.com", password="x"))
+            db.session.commit()
+
+            for uid in range(2, NUM_AUTHORS + 2):
+                db.session.add(Follows(user_being_followed_id=uid,
+                                       user_following_id=VIEWER_ID))
+                db.session.add_all([
+                    Message(id=uid * 10, text=f"first by {uid}", user_id=uid),
+                    Message(id=uid * 10 + 1, text=f"second by {uid}", user_id=uid),
+                ])
+            db.session.commit()
+
+            for uid in range(2, NUM_AUTHORS + 2):
+                db.session.add(Likes(user_id=VIEWER_ID, message_id=uid * 10))
+            db.session.commit()
+
+        self.client = app.test_client()
+
+    def tearDown(self):
+
+        with app.app_context():
+            db.session.rollback()
+            db.drop_all()
+
+    def get(self, url):
+        """GET `url` as the viewer; return (response, number of queries)."""
+
+        with self.client as client:
+            with client.session_transaction() as session:
+                session[CURR_USER_KEY] = VIEWER_ID
+
+            with count_queries() as queries:
+                resp = client.get(url)
+
+        self.assertEqual(resp.status_code, 200)
+        return resp, queries[0]
+
+    def test_homepage(self):
+        """home timeline: bounded regardless of how many authors are shown"""
+
+        resp, queries = self.get("/")
+        self.assertIn(f"author{NUM_AUTHORS + 1}", resp.get_data(as_text=True))
+        # one of these fills the who-to-follow sidebar, and one looks up
+        # whose messages to merge
+        self.assertLessEqual(queries, 5)
+
+        # the viewer's snapshot, counters and all, is cached by now
+        resp, queries = self.get("/")
+        self.assertLessEqual(queries, 4)
+
+    def test_homepage_fanout(self):
+        """home timeline read from precomputed timelines"""
+
+        app.config['TIMELINE_FANOUT'] = True
+        # a page the precomputed timeline fills on its own
+        app.config['MESSAGES_PER_PAGE'] = NUM_AUTHORS
+        try:
+            with app.app_context():
+                get_timeline_store().rebuild(VIEWER_ID)
+                db.session.commit()
+
+            resp, queries = self.get("/")
+            self.assertIn(f"author{NUM_AUTHORS + 1}", resp.get_data(as_text=True))
+            self.assertLessEqual(queries, 4)
+
+            # one it can't costs the messages table read on top
+            app.config['MESSAGES_PER_PAGE'] = 100
+            resp, queries = self.get("/")
+            self.assertLessEqual(queries, 5)
+        finally:
+            app.config['TIMELINE_FANOUT'] = False
+            app.config['MESSAGES_PER_PAGE'] = 100
+
+    def test_user_show(self):
+        """profile page"""
+
+        resp, queries = self.get("/users/2")
+        self.assertIn("second by 2", resp.get_data(as_text=True))
+        # one of these reads the viewer's row version for the page's ETag
+        self.assertLessEqual(queries, 6)
+
+    def test_show_likes(self):
+        """liked messages page, one author per message"""
+
+        resp, queries = self.get(f"/users/{VIEWER_ID}/likes")
+        self.assertIn(f"@author{NUM_AUTHORS + 1}", resp.get_data(as_text=True))
+        self.assertLessEqual(queries, 4)
+
+    def test_follow_pages(self):
+        """followers/following pages, with follow state for every card"""
+
+        with app.app_context():
+            # half the authors follow the viewer back
+            db.session.add_all([Follows(user_being_followed_id=VIEWER_ID,
+                                        user_following_id=uid)
+                                for uid in range(2, NUM_AUTHORS + 2, 2)])
+            db.session.commit()
+
+        for url in (f"/users/{VIEWER_ID}/following", f"/users/{VIEWER_ID}/followers"):
+            with self.subTest(url=url):
+                resp, queries = self.get(url)
+                self.assertIn("@author2", resp.get_data(as_text=True))
+                self.assertLessEqual(queries, 4)
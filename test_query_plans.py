@@ -0,0 +1,67 @@
+"""Query plan tests."""
+
+import os
+from unittest import TestCase
+
+from models import db
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+# Now we can import app
+from app import app
+from query_plans import check_query_plans, uses_index
+
+app.config['TESTING'] = True
+
+with app.app_context():
+    db.create_all()
+
+
+class QueryPlanTestCase(TestCase):
+    """Hot queries must be able to use their indexes."""
+
+    def setUp(self):
+
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+
+    def tearDown(self):
+
+        with app.app_context():
+            db.session.rollback()
+            db.drop_all()
+
+    def test_hot_queries_use_indexes(self):
+        """every hot query's plan names its index"""
+
+        with app.app_context():
+            for name, index, ok, plan in check_query_plans():
+                with self.subTest(query=name):
+                    self.assertTrue(ok, f"{name} should use {index}:\n{plan}")
+
+    def test_uses_index(self):
+        """an index only counts when searched, with nothing sorted after it"""
+
+        searched = (
+            "Limit  (cost=0.28..24.32 rows=5 width=99)\n"
+            "  ->  Index Scan using ix_x on messages  (cost=0.28..24.32 rows=5 width=99)\n"
+            "        Index Cond: (user_id = 1)")
+        filtered = (
+            "Limit  (cost=1.00..1.25 rows=101 width=99)\n"
+            "  ->  Sort  (cost=1.00..1.87 rows=342 width=99)\n"
+            "        Sort Key: \"timestamp\" DESC, id DESC\n"
+            "        ->  Index Scan using ix_x on messages  (cost=0.28..1.63 rows=342 width=99)\n"
+            "              Filter: ((user_id = 1) OR (hashed SubPlan 1))")
+        whole = "Index Only Scan using ix_x on users  (cost=0.12..4.14 rows=1 width=4)"
+
+        self.assertTrue(uses_index(searched, "ix_x"))
+        self.assertFalse(uses_index(searched, "ix_y"))
+        self.assertFalse(uses_index(filtered, "ix_x"))
+        self.assertFalse(uses_index(whole, "ix_x"))
+        self.assertTrue(uses_index(whole, "ix_x", partial=True))
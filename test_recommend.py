@@ -0,0 +1,144 @@
+"""Who-to-follow recommendation tests."""
+
+import os
+from unittest import TestCase
+
+from models import db, User, Follows, Recommendation
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+# Now we can import app
+from app import app, CURR_USER_KEY
+from recommend import compute_recommendations
+
+app.config['TESTING'] = True
+app.config['WTF_CSRF_ENABLED'] = False
+
+with app.app_context():
+    db.create_all()
+
+# who follows whom
+GRAPH = {
+    1: [2, 3],
+    2: [4, 5],
+    3: [1, 4],
+    6: [2],
+}
+
+
+class RecommendTestCase(TestCase):
+    """Six users following each other as in GRAPH."""
+
+    def setUp(self):
+
+        app.extensions['user_cache'].clear()
+
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+
+            for uid in range(1, 7):
+                db.session.add(User(id=uid, username=f"user{uid}",
+                                    email=f"user{uid}@test.com", password="x"))
+            db.session.commit()
+
+            for follower, followed in GRAPH.items():
+                db.session.add_all([Follows(user_following_id=follower,
+                                            user_being_followed_id=uid)
+                                    for uid in followed])
+            db.session.commit()
+
+        self.client = app.test_client()
+
+    def tearDown(self):
+
+        app.config['RECOMMENDATIONS_PER_USER'] = 20
+        app.config['RECOMMENDATIONS_CHUNK_PATHS'] = 20000000
+
+        with app.app_context():
+            db.session.rollback()
+            db.drop_all()
+
+    def recommendations(self):
+        return [(r.user_id, r.recommended_id, r.score) for r in
+                Recommendation.query.order_by(Recommendation.user_id,
+                                              Recommendation.score.desc(),
+                                              Recommendation.recommended_id)]
+
+    def compute(self):
+        try:
+            return compute_recommendations()
+        except RuntimeError as exc:
+            self.skipTest(str(exc))
+
+    def test_compute(self):
+        """friends of friends, by paths to them, minus self and followed"""
+
+        with app.app_context():
+            self.assertEqual(self.compute(), (3, 5))
+            expected = [(1, 4, 2), (1, 5, 1), (3, 2, 1), (6, 4, 1), (6, 5, 1)]
+            self.assertEqual(self.recommendations(), expected)
+
+            # one user per chunk comes to the same thing
+            app.config['RECOMMENDATIONS_CHUNK_PATHS'] = 1
+            self.compute()
+            self.assertEqual(self.recommendations(), expected)
+
+            app.config['RECOMMENDATIONS_PER_USER'] = 1
+            self.assertEqual(self.compute(), (3, 3))
+            self.assertEqual(self.recommendations(),
+                             [(1, 4, 2), (3, 2, 1), (6, 4, 1)])
+
+    def test_skips_deleted_accounts(self):
+        """accounts waiting to be purged are neither paths nor suggestions"""
+
+        with app.app_context():
+            # user 4 deleted their account; user 2's follows still go through
+            User.query.filter_by(id=4).update({User.deleted_at: db.func.now()})
+            db.session.commit()
+
+            self.compute()
+            self.assertEqual(self.recommendations(),
+                             [(1, 5, 1), (3, 2, 1), (6, 5, 1)])
+
+            # nor does a deleted follower lead anywhere
+            User.query.filter_by(id=3).update({User.deleted_at: db.func.now()})
+            db.session.commit()
+
+            self.compute()
+            self.assertEqual(self.recommendations(), [(1, 5, 1), (6, 5, 1)])
+
+    def test_sidebar(self):
+        """the home page suggests who to follow, best first"""
+
+        with app.app_context():
+            db.session.add_all([
+                Recommendation(user_id=1, recommended_id=5, score=1),
+                Recommendation(user_id=1, recommended_id=4, score=2),
+                Recommendation(user_id=1, recommended_id=6, score=1),
+            ])
+            db.session.commit()
+
+        with self.client as client:
+            with client.session_transaction() as session:
+                session[CURR_USER_KEY] = 1
+
+            html = client.get("/").get_data(as_text=True)
+            self.assertIn("Who to follow", html)
+            self.assertLess(html.index('action="/users/follow/4"'),
+                            html.index('action="/users/follow/5"'))
+
+            # followed since the job ran: no longer suggested
+            client.post("/users/follow/4")
+            html = client.get("/").get_data(as_text=True)
+            self.assertNotIn('action="/users/follow/4"', html)
+            self.assertIn('action="/users/follow/6"', html)
+
+            with client.session_transaction() as session:
+                session[CURR_USER_KEY] = 2
+            self.assertNotIn("Who to follow", client.get("/").get_data(as_text=True))
@@ -0,0 +1,220 @@
+"""User search tests."""
+
+import os
+from unittest import TestCase
+from unittest.mock import patch
+
+from bs4 import BeautifulSoup
+from sqlalchemy import text
+
+from models import db, User
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+# Now we can import app
+from app import app, CURR_USER_KEY
+from search import TRIGRAM_INDEX, get_search_backend, search_users
+
+app.config['TESTING'] = True
+app.config['WTF_CSRF_ENABLED'] = False
+
+with app.app_context():
+    db.create_all()
+
+USERNAMES = ["anna", "annabel", "joanna", "hannah", "bob", "bobby", "zed", "annie"]
+
+
+class SearchTestCase(TestCase):
+    """Ranking and pagination, whichever backend is in use."""
+
+    backend = 'memory'
+
+    def setUp(self):
+
+        app.extensions['user_cache'].clear()
+        app.extensions.pop('user_search', None)
+        app.config['USER_SEARCH_BACKEND'] = self.backend
+
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+
+            # ids come from the sequence, so signups later don't collide
+            for name in USERNAMES:
+                db.session.add(User(username=name, email=f"{name}@test.com",
+                                    password="x"))
+                db.session.flush()
+            db.session.commit()
+
+        self.client = app.test_client()
+
+    def tearDown(self):
+
+        app.config['USER_SEARCH_BACKEND'] = 'auto'
+        app.config['USERS_PER_PAGE'] = 30
+        app.extensions.pop('user_search', None)
+
+        with app.app_context():
+            db.session.rollback()
+            db.drop_all()
+
+    def search(self, q, page=1, per_page=30):
+        with app.test_request_context():
+            users, has_next = search_users(q, page, per_page)
+            return [u.username for u in users], has_next
+
+    def test_ranking(self):
+        """exact, then prefix, then substring, then similar names"""
+
+        names, _ = self.search("ANNA")
+        self.assertEqual(names, ["anna", "annabel", "joanna", "hannah", "annie"])
+
+    def test_short_query_is_prefix_only(self):
+        """one or two characters only match the start of a name"""
+
+        self.assertEqual(self.search("bo")[0], ["bob", "bobby"])
+        self.assertEqual(self.search("n")[0], [])
+
+    def test_no_query_lists_everyone(self):
+        """browsing without a query pages through everyone, newest first"""
+
+        names, has_next = self.search("", per_page=4)
+        self.assertEqual(names, ["annie", "zed", "bobby", "bob"])
+        self.assertTrue(has_next)
+
+        names, has_next = self.search("", page=2, per_page=4)
+        self.assertEqual(names, ["hannah", "joanna", "annabel", "anna"])
+        self.assertFalse(has_next)
+
+    def test_max_pages(self):
+        """pages past USER_SEARCH_MAX_PAGES are empty"""
+
+        app.config['USER_SEARCH_MAX_PAGES'] = 2
+        try:
+            self.assertEqual(self.search("", page=2, per_page=2)[1], False)
+            self.assertEqual(self.search("", page=3, per_page=2), ([], False))
+        finally:
+            app.config['USER_SEARCH_MAX_PAGES'] = 50
+
+    def test_view_pagination(self):
+        """/users?q= links to the next page of results"""
+
+        app.config['USERS_PER_PAGE'] = 2
+
+        resp = self.client.get("/users?q=anna")
+        soup = BeautifulSoup(resp.get_data(as_text=True), 'html.parser')
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(len(soup.select(".user-card")), 2)
+        self.assertEqual(soup.select_one("#next-page")["href"],
+                         "/users?q=anna&page=2")
+
+        resp = self.client.get("/users?q=anna&page=2")
+        soup = BeautifulSoup(resp.get_data(as_text=True), 'html.parser')
+        self.assertIn("@joanna", resp.get_data(as_text=True))
+        self.assertIsNotNone(soup.select_one("#prev-page"))
+
+        self.assertEqual(self.client.get("/users?page=0").status_code, 400)
+
+    def test_index_follows_edits(self):
+        """signups, renames and deletions show up in search"""
+
+        with self.client as client:
+            # build the index before anything changes
+            self.assertEqual(self.search("zed")[0], ["zed"])
+
+            client.post("/signup", data={"username": "zebra",
+                                         "email": "zebra@test.com",
+                                         "password": "password"})
+            self.assertEqual(self.search("ze")[0], ["zebra", "zed"])
+
+            client.post("/users/profile", data={"username": "quagga",
+                                          "email": "zebra@test.com",
+                                          "password": "password"})
+            self.assertEqual(self.search("ze")[0], ["zed"])
+            self.assertEqual(self.search("quagga")[0], ["quagga"])
+
+            client.post("/users/delete")
+            self.assertEqual(self.search("quagga")[0], [])
+
+    def test_signup_while_index_loads(self):
+        """the memory index keeps a signup made while it was being built"""
+
+        if self.backend != 'memory':
+            self.skipTest("only the memory backend builds an index")
+
+        with app.app_context():
+            backend = get_search_backend()
+            execute = db.session.execute
+
+            def load_rows(*args, **kwargs):
+                rows = execute(*args, **kwargs)
+                # committed elsewhere after the table was read
+                with db.engine.begin() as connection:
+                    new_id = connection.execute(
+                        User.__table__.insert().values(
+                            username="zeta", email="zeta@test.com",
+                            password="x")).inserted_primary_key[0]
+                backend.add(new_id, "zeta")
+                return rows
+
+            with patch.object(db.session, 'execute', load_rows):
+                backend._load()
+
+        self.assertEqual(self.search("ze")[0], ["zed", "zeta"])
+
+
+class LikeSearchTestCase(SearchTestCase):
+    """The same tests against the plain LIKE query."""
+
+    backend = 'like'
+
+    def test_ranking(self):
+        """exact, then prefix, then substring; no similar names"""
+
+        names, _ = self.search("ANNA")
+        self.assertEqual(names, ["anna", "annabel", "hannah", "joanna"])
+
+    def test_auto_falls_back_to_like(self):
+        """'auto' without the trigram index searches the database, not
+        a per-process index"""
+
+        app.config['USER_SEARCH_BACKEND'] = 'auto'
+        with app.app_context():
+            self.assertEqual(type(get_search_backend()).__name__,
+                             'LikeSearchBackend')
+
+
+class TrigramSearchTestCase(SearchTestCase):
+    """The same tests against pg_trgm, where the server has it."""
+
+    backend = 'trigram'
+
+    def setUp(self):
+
+        with app.app_context():
+            available = db.session.execute(text(
+                "SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'")).first()
+        if available is None:
+            self.skipTest("pg_trgm is not available")
+
+        super().setUp()
+
+        with app.app_context():
+            db.session.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+            db.session.execute(text(
+                f"CREATE INDEX {TRIGRAM_INDEX} ON users "
+                "USING gin (lower(username) gin_trgm_ops)"))
+            db.session.commit()
+
+    def test_auto_picks_trigram(self):
+        """'auto' notices the trigram index"""
+
+        app.config['USER_SEARCH_BACKEND'] = 'auto'
+        with app.app_context():
+            self.assertEqual(type(get_search_backend()).__name__,
+                             'TrigramSearchBackend')
@@ -0,0 +1,126 @@
+"""Streamed list page tests."""
+
+import os
+from unittest import TestCase
+
+from bs4 import BeautifulSoup
+
+from models import db, User, Follows, Likes, Message
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+# Now we can import app
+from app import app, CURR_USER_KEY
+
+app.config['TESTING'] = True
+
+with app.app_context():
+    db.create_all()
+
+VIEWER_ID = 1
+STAR_ID = 2
+
+
+class StreamingTestCase(TestCase):
+    """The list pages render the same whether streamed or not."""
+
+    def setUp(self):
+        """A star followed by five fans, the viewer following fans 3 and 5."""
+
+        app.extensions['user_cache'].clear()
+        app.extensions.pop('user_search', None)
+
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+
+            for uid in range(1, 8):
+                db.session.add(User(id=uid, username=f"user{uid}",
+                                    email=f"user{uid}@test.com", password="x"))
+            db.session.commit()
+
+            for uid in range(3, 8):
+                db.session.add(Follows(user_being_followed_id=STAR_ID,
+                                       user_following_id=uid))
+            for uid in (3, 5):
+                db.session.add(Follows(user_being_followed_id=uid,
+                                       user_following_id=VIEWER_ID))
+            for mid in range(10, 15):
+                db.session.add(Message(id=mid, text=f"message {mid}", user_id=STAR_ID))
+            db.session.commit()
+
+            for mid in range(10, 15):
+                db.session.add(Likes(user_id=VIEWER_ID, message_id=mid))
+            db.session.commit()
+
+        # small batches, so every page crosses a few batch boundaries
+        app.config['LIST_BATCH_SIZE'] = 2
+        self.client = app.test_client()
+
+    def tearDown(self):
+
+        app.config['STREAM_LIST_PAGES'] = False
+        app.config['LIST_BATCH_SIZE'] = 500
+
+        with app.app_context():
+            db.session.rollback()
+            db.drop_all()
+
+    def get(self, url, stream):
+        app.config['STREAM_LIST_PAGES'] = stream
+
+        with self.client as client:
+            with client.session_transaction() as session:
+                session[CURR_USER_KEY] = VIEWER_ID
+
+            resp = client.get(url)
+
+        self.assertEqual(resp.status_code, 200)
+        # streamed responses can't know their length up front
+        self.assertEqual('Content-Length' not in resp.headers, stream)
+        return resp.get_data(as_text=True)
+
+    def test_same_html(self):
+        """streaming doesn't change what's rendered"""
+
+        for url in ("/users", f"/users/{STAR_ID}/followers",
+                    f"/users/{VIEWER_ID}/following", f"/users/{VIEWER_ID}/likes"):
+            with self.subTest(url=url):
+                self.assertEqual(self.get(url, stream=True),
+                                 self.get(url, stream=False))
+
+    def test_follow_state_across_batches(self):
+        """each card knows whether the viewer follows that user"""
+
+        html = self.get(f"/users/{STAR_ID}/followers", stream=True)
+        soup = BeautifulSoup(html, 'html.parser')
+
+        unfollow = {form["action"] for form in soup.select(".user-card form")
+                    if form.button.text == "Unfollow"}
+        follow = {form["action"] for form in soup.select(".user-card form")
+                  if form.button.text == "Follow"}
+
+        self.assertEqual(unfollow, {"/users/stop-following/3",
+                                    "/users/stop-following/5"})
+        self.assertEqual(follow, {"/users/follow/4", "/users/follow/6",
+                                  "/users/follow/7"})
+
+    def test_likes(self):
+        """every liked message is listed, most recently liked first"""
+
+        html = self.get(f"/users/{VIEWER_ID}/likes", stream=True)
+        soup = BeautifulSoup(html, 'html.parser')
+
+        texts = [p.text for p in soup.select("#messages p")]
+        self.assertEqual(texts, [f"message {mid}" for mid in range(14, 9, -1)])
+
+    def test_no_users(self):
+        """an empty result says so"""
+
+        html = self.get("/users?q=nobody", stream=True)
+        self.assertIn("Sorry, no users found", html)
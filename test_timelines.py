@@ -0,0 +1,247 @@
+"""Fan-out timeline tests."""
+
+import os
+from datetime import datetime, timedelta
+from unittest import TestCase
+
+from bs4 import BeautifulSoup
+
+from models import db, Message, User, Follows, TimelineEntry
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+# Now we can import app
+from app import app, CURR_USER_KEY
+from jobs import Worker
+from timelines import fan_out_message, get_timeline_store
+
+app.config['TESTING'] = True
+app.config['WTF_CSRF_ENABLED'] = False
+
+with app.app_context():
+    db.create_all()
+
+
+class DatabaseTimelineTestCase(TestCase):
+    """Test fan-out-on-write with the database backend."""
+
+    backend = 'database'
+
+    def setUp(self):
+        """Create users, follows and a few older messages."""
+
+        app.extensions['user_cache'].clear()
+
+        app.config['TIMELINE_FANOUT'] = True
+        app.config['TIMELINE_BACKEND'] = self.backend
+        app.extensions.pop('timelines', None)
+
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+
+            # password hashing is irrelevant here, so skip User.signup
+            for uid, name in [(1, "author"), (2, "fan"), (3, "bystander")]:
+                db.session.add(User(id=uid, username=name,
+                                    email=f"{name}@test.com", password="x"))
+            db.session.commit()
+
+            db.session.add(Follows(user_being_followed_id=1, user_following_id=2))
+
+            then = datetime(2020, 1, 1)
+            for i in range(5):
+                db.session.add(Message(id=100 + i, text=f"old {i}", user_id=1,
+                                       timestamp=then + timedelta(minutes=i)))
+            db.session.commit()
+
+        self.client = app.test_client()
+
+    def tearDown(self):
+
+        with app.app_context():
+            db.session.rollback()
+            db.drop_all()
+
+        app.config['TIMELINE_FANOUT'] = False
+        app.config['TIMELINE_BACKEND'] = 'database'
+        app.extensions.pop('timelines', None)
+
+    def timeline_ids(self, owner_id, limit=100):
+        with app.app_context():
+            return [m.id for m in get_timeline_store().read(owner_id, limit)]
+
+    def test_new_message_fans_out(self):
+        """Posting pushes onto the author's and followers' timelines only."""
+
+        with self.client as client:
+            with client.session_transaction() as session:
+                session[CURR_USER_KEY] = 1
+
+            resp = client.post("/messages/new", data={"text": "fresh"})
+            self.assertEqual(resp.status_code, 302)
+
+            # the author sees it at once
+            self.assertIn("fresh", client.get("/").get_data(as_text=True))
+
+        with app.app_context():
+            msg_id = Message.query.filter_by(text="fresh").one().id
+            shared = get_timeline_store().shared
+
+        # followers get it from a background job, if the store can take one
+        self.assertEqual(self.timeline_ids(1), [msg_id])
+        self.assertEqual(self.timeline_ids(2), [] if shared else [msg_id])
+        Worker(app).run(burst=True)
+
+        self.assertEqual(self.timeline_ids(1), [msg_id])
+        self.assertEqual(self.timeline_ids(2), [msg_id])
+        self.assertEqual(self.timeline_ids(3), [])
+
+    def test_fan_out_repeated(self):
+        """Fanning a message out again, or after a follow backfilled it, is harmless."""
+
+        with app.app_context():
+            db.session.add(Message(id=200, text="new", user_id=1))
+            db.session.commit()
+
+            # a follow lands before the job runs
+            db.session.add(Follows(user_being_followed_id=1, user_following_id=3))
+            get_timeline_store().backfill(3, 1)
+            db.session.commit()
+
+            for _ in range(2):
+                fan_out_message(200)
+                db.session.commit()
+
+        self.assertEqual(self.timeline_ids(1), [])
+        self.assertEqual(self.timeline_ids(2), [200])
+        self.assertEqual(self.timeline_ids(3), [200, 104, 103, 102, 101, 100])
+
+    def test_homepage_reads_timeline(self):
+        """The homepage renders from the precomputed timeline."""
+
+        with app.app_context():
+            get_timeline_store().rebuild(2)
+            db.session.commit()
+
+        with self.client as client:
+            with client.session_transaction() as session:
+                session[CURR_USER_KEY] = 2
+
+            html = client.get("/").get_data(as_text=True)
+            self.assertIn("old 4", html)
+            self.assertLess(html.index("old 4"), html.index("old 0"))
+
+    def test_follow_backfills_and_unfollow_prunes(self):
+        """Following copies recent messages in; unfollowing removes them."""
+
+        with self.client as client:
+            with client.session_transaction() as session:
+                session[CURR_USER_KEY] = 3
+
+            client.post("/users/follow/1")
+            self.assertEqual(self.timeline_ids(3), [104, 103, 102, 101, 100])
+
+            client.post("/users/stop-following/1")
+            self.assertEqual(self.timeline_ids(3), [])
+
+    def test_timeline_is_bounded(self):
+        """Timelines never hold more than TIMELINE_MAX_LENGTH entries."""
+
+        app.config['TIMELINE_MAX_LENGTH'] = 3
+        app.extensions.pop('timelines', None)
+
+        try:
+            with app.app_context():
+                store = get_timeline_store()
+                store.rebuild(2)
+                store.backfill(2, 1)
+                db.session.commit()
+
+            self.assertEqual(self.timeline_ids(2), [104, 103, 102])
+        finally:
+            app.config['TIMELINE_MAX_LENGTH'] = 800
+
+    def test_message_delete_removes_entry(self):
+        """Deleted messages disappear from timelines."""
+
+        with app.app_context():
+            get_timeline_store().rebuild(2)
+            db.session.commit()
+
+        with self.client as client:
+            with client.session_transaction() as session:
+                session[CURR_USER_KEY] = 1
+
+            client.post("/messages/104/delete")
+
+        Worker(app).run(burst=True)
+        self.assertEqual(self.timeline_ids(2), [103, 102, 101, 100])
+
+    def test_paging_past_bounded_timeline(self):
+        """Older pages continue from the messages table once the timeline ends."""
+
+        app.config['TIMELINE_MAX_LENGTH'] = 3
+        app.config['MESSAGES_PER_PAGE'] = 2
+        app.extensions.pop('timelines', None)
+
+        try:
+            with app.app_context():
+                get_timeline_store().rebuild(2)
+                db.session.commit()
+
+            seen = []
+            url = "/"
+            with self.client as client:
+                with client.session_transaction() as session:
+                    session[CURR_USER_KEY] = 2
+
+                while url:
+                    soup = BeautifulSoup(client.get(url).data, 'html.parser')
+                    seen += [p.text for p in soup.select("#messages li p")]
+                    more = soup.find("a", id="load-more")
+                    url = more["href"] if more else None
+
+            self.assertEqual(seen, [f"old {i}" for i in range(4, -1, -1)])
+        finally:
+            app.config['TIMELINE_MAX_LENGTH'] = 800
+            app.config['MESSAGES_PER_PAGE'] = 100
+
+    def test_unbuilt_timeline(self):
+        """An account with no precomputed timeline still sees its first page."""
+
+        app.config['MESSAGES_PER_PAGE'] = 2
+
+        try:
+            with self.client as client:
+                with client.session_transaction() as session:
+                    session[CURR_USER_KEY] = 2
+
+                soup = BeautifulSoup(client.get("/").data, 'html.parser')
+        finally:
+            app.config['MESSAGES_PER_PAGE'] = 100
+
+        self.assertEqual(self.timeline_ids(2), [])
+        self.assertEqual([p.text for p in soup.select("#messages li p")],
+                         ["old 4", "old 3"])
+        self.assertIsNotNone(soup.find("a", id="load-more"))
+
+
+class MemoryTimelineTestCase(DatabaseTimelineTestCase):
+    """Same behaviour with the in-process backend."""
+
+    backend = 'memory'
+
+    def test_nothing_written_to_database(self):
+        """The memory backend leaves timeline_entries empty."""
+
+        with app.app_context():
+            get_timeline_store().rebuild(2)
+            db.session.commit()
+            self.assertEqual(TimelineEntry.query.count(), 0)
+
+        self.assertEqual(len(self.timeline_ids(2)), 5)
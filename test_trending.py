@@ -0,0 +1,177 @@
+"""Per-message like count and trending tests."""
+
+import os
+from datetime import datetime, timedelta
+from unittest import TestCase
+
+from models import db, User, Message, Likes, TrendingMessage
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+# Now we can import app
+from app import app, CURR_USER_KEY
+from counters import reconcile_counters
+from trending import compute_trending, get_trending
+
+app.config['TESTING'] = True
+app.config['WTF_CSRF_ENABLED'] = False
+
+with app.app_context():
+    db.create_all()
+
+NOW = datetime(2026, 10, 17, 12, 0)
+
+
+class TrendingTestCase(TestCase):
+    """Five users; alice (1) wrote four messages, the others like them."""
+
+    def setUp(self):
+
+        app.extensions['user_cache'].clear()
+        app.extensions.pop('trending', None)
+        app.config['TRENDING_CACHE_TTL'] = 0
+
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+
+            for uid, name in enumerate(["alice", "bob", "carol", "dave", "erin"], 1):
+                db.session.add(User(id=uid, username=name,
+                                    email=f"{name}@test.com", password="x"))
+            db.session.commit()
+
+            db.session.add_all([
+                Message(id=10, text="fresh", user_id=1, timestamp=NOW - timedelta(hours=2)),
+                Message(id=20, text="was hot", user_id=1, timestamp=NOW - timedelta(days=1)),
+                Message(id=30, text="liked long ago", user_id=1, timestamp=NOW - timedelta(days=4)),
+                Message(id=40, text="ancient", user_id=1, timestamp=NOW - timedelta(days=30)),
+            ])
+            db.session.commit()
+
+        self.client = app.test_client()
+
+    def tearDown(self):
+
+        app.config['TRENDING_CACHE_TTL'] = 30
+        app.config['TRENDING_SIZE'] = 50
+
+        with app.app_context():
+            db.session.rollback()
+            db.drop_all()
+
+    def login(self, client, uid):
+        with client.session_transaction() as session:
+            session[CURR_USER_KEY] = uid
+
+    def like(self, message_id, hours_ago, *user_ids):
+        for uid in user_ids:
+            db.session.add(Likes(user_id=uid, message_id=message_id,
+                                 created_at=NOW - timedelta(hours=hours_ago)))
+        db.session.commit()
+
+    def like_count(self, message_id):
+        return db.session.get(Message, message_id).like_count
+
+    def test_like_count(self):
+        """likes through the session, the toggle and cascades all count"""
+
+        with app.app_context():
+            self.like(10, 1, 2, 3)
+            self.assertEqual(self.like_count(10), 2)
+
+            db.session.delete(Likes.query.filter_by(user_id=2).one())
+            db.session.commit()
+            self.assertEqual(self.like_count(10), 1)
+
+        with self.client as client:
+            self.login(client, 4)
+            resp = client.post("/users/toggle_like/10")
+            self.assertEqual(resp.json, {"msg_liked": True, "like_count": 2})
+
+        with app.app_context():
+            # carol's account goes, and her like with it
+            db.session.delete(db.session.get(User, 3))
+            db.session.commit()
+            self.assertEqual(self.like_count(10), 1)
+
+            db.session.execute(db.update(Message).values(like_count=7))
+            db.session.commit()
+            reconcile_counters()
+            self.assertEqual(self.like_count(10), 1)
+            self.assertEqual(self.like_count(20), 0)
+
+    def test_ranking(self):
+        """fewer but fresher likes beat more, older ones; stale ones don't count"""
+
+        with app.app_context():
+            self.like(10, 1, 2, 3)
+            self.like(20, 20, 2, 3, 4)
+            self.like(30, 72, 2, 3, 4, 5)
+            self.like(40, 1, 2, 3, 4, 5)
+
+            self.assertEqual(compute_trending(NOW), 2)
+            computed_at, ranked = get_trending()
+
+            self.assertEqual(computed_at, NOW)
+            self.assertEqual([message_id for message_id, _ in ranked], [10, 20])
+            # two likes an hour old: 2 * 2^(-1/6)
+            self.assertAlmostEqual(ranked[0][1], 2 * 2 ** (-1 / 6), places=6)
+
+            # a new ranking replaces the old one, bounded in size
+            app.config['TRENDING_SIZE'] = 1
+            compute_trending(NOW)
+            self.assertEqual(TrendingMessage.query.count(), 1)
+
+    def test_cached(self):
+        """each process rereads the ranking only once the TTL is up"""
+
+        app.config['TRENDING_CACHE_TTL'] = 60
+
+        with app.app_context():
+            self.assertEqual(get_trending(), (None, []))
+
+            db.session.add(TrendingMessage(message_id=10, score=1, computed_at=NOW))
+            db.session.commit()
+            self.assertEqual(get_trending(), (None, []))
+
+            app.extensions.pop('trending')
+            self.assertEqual(get_trending(), (NOW, [(10, 1)]))
+
+    def test_page_and_api(self):
+        """/trending and the API show the ranking and live like counts"""
+
+        with app.app_context():
+            self.like(10, 1, 2, 3)
+            self.like(20, 20, 2)
+            compute_trending(NOW)
+
+        resp = self.client.get("/trending")
+        html = resp.get_data(as_text=True)
+        self.assertEqual(resp.status_code, 200)
+        self.assertLess(html.index("fresh"), html.index("was hot"))
+        self.assertIn("2 likes", html)
+        self.assertIn("1 like<", html)
+        self.assertNotIn("ancient", html)
+
+        resp = self.client.get("/trending", headers={"If-None-Match": resp.headers["ETag"]})
+        self.assertEqual(resp.status_code, 304)
+
+        resp = self.client.get("/api/v1/trending")
+        self.assertEqual([(m["id"], m["like_count"]) for m in resp.json["messages"]],
+                         [(10, 2), (20, 1)])
+        self.assertEqual(resp.json["computed_at"], "2026-10-17T12:00:00Z")
+        etag = resp.headers["ETag"]
+
+        with self.client as client:
+            self.login(client, 4)
+            client.post("/users/toggle_like/20")
+
+        # the ranking hasn't been recomputed, but the count has changed
+        resp = app.test_client().get("/api/v1/trending", headers={"If-None-Match": etag})
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.json["messages"][1]["like_count"], 2)
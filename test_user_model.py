@@ -197,8 +197,35 @@ class UserModelTestCase(TestCase):
             
             self.assertTrue(ut2.is_followed_by(ut1))
             self.assertFalse(ut1.is_followed_by(ut2))
-        
-        
-        
-    
-    
\ No newline at end of file
+
+    def test_follow_checks_skip_collections(self):
+        """is_following / is_followed_by don't load the follow collections"""
+        with app.app_context():
+            db.session.add(Follows(user_being_followed_id=self.uid2,
+                                   user_following_id=self.uid1))
+            db.session.commit()
+
+            ut1 = User.query.get(self.uid1)
+            ut2 = User.query.get(self.uid2)
+
+            self.assertTrue(ut1.is_following(ut2))
+            self.assertTrue(ut2.is_followed_by(ut1))
+            self.assertFalse(ut2.is_following(ut1))
+
+            self.assertNotIn('following', ut1.__dict__)
+            self.assertNotIn('followers', ut2.__dict__)
+
+    def test_following_ids_among(self):
+        """batched follow check for a page of users"""
+        with app.app_context():
+            db.session.add_all([
+                Follows(user_being_followed_id=self.uid2, user_following_id=self.uid),
+                Follows(user_being_followed_id=self.uid3, user_following_id=self.uid),
+            ])
+            db.session.commit()
+
+            u = User.query.get(self.uid)
+            self.assertEqual(
+                u.following_ids_among([self.uid1, self.uid2, self.uid3]),
+                {self.uid2, self.uid3})
+            self.assertEqual(u.following_ids_among([]), set())
@@ -37,6 +37,10 @@ class UserViewTestCase(TestCase):
     def setUp(self):
         """Create test client, add sample data."""
 
+        app.extensions['user_cache'].clear()
+        # ...and so would an in-process search index
+        app.extensions.pop('user_search', None)
+
         with app.app_context():
             
             db.drop_all()
@@ -190,10 +194,15 @@ class UserViewTestCase(TestCase):
             likes = Likes.query.filter(Likes.message_id==522).all()
             self.assertEqual(len(likes), 1)
             self.assertEqual(likes[0].user_id, self.uid1)
+            self.assertEqual(resp.json, {"msg_liked": True, "like_count": 1})
             
             resp = client.post("/users/toggle_like/522")
             likes = Likes.query.filter(Likes.message_id==522).all()
             self.assertEqual(len(likes), 0)
+            self.assertEqual(resp.json, {"msg_liked": False, "like_count": 0})
+
+            resp = client.post("/users/toggle_like/99999")
+            self.assertEqual(resp.status_code, 404)
     
     def test_show_following(self):
         """test showing following users page"""    
@@ -227,3 +236,60 @@ class UserViewTestCase(TestCase):
             resp = client.get(f"/users/{self.uid}/followers", follow_redirects=True)
             self.assertEqual(resp.status_code, 200)
             self.assertIn("Access unauthorized", str(resp.data))
+
+    def test_user_show_pagination(self):
+        """profile messages page with a ?before= cursor"""
+        app.config['MESSAGES_PER_PAGE'] = 1
+        try:
+            with self.client as client:
+                resp = client.get(f"/users/{self.uid}")
+                soup = BeautifulSoup(resp.data, 'html.parser')
+                self.assertEqual(len(soup.select("#messages li")), 1)
+                first_page = soup.select_one("#messages li p").text
+
+                more = soup.find("a", id="load-more")
+                self.assertIsNotNone(more)
+
+                resp = client.get(more["href"])
+                soup = BeautifulSoup(resp.data, 'html.parser')
+                self.assertEqual(len(soup.select("#messages li")), 1)
+                self.assertNotEqual(soup.select_one("#messages li p").text, first_page)
+                self.assertIsNone(soup.find("a", id="load-more"))
+        finally:
+            app.config['MESSAGES_PER_PAGE'] = 100
+
+    def test_homepage_pagination(self):
+        """home timeline pages through followed users' messages"""
+        app.config['MESSAGES_PER_PAGE'] = 2
+        try:
+            with self.client as client:
+                with client.session_transaction() as session:
+                    session[CURR_USER_KEY] = self.uid
+                resp = client.get("/")
+                soup = BeautifulSoup(resp.data, 'html.parser')
+                self.assertEqual(len(soup.select("#messages li")), 2)
+
+                resp = client.get(soup.find("a", id="load-more")["href"])
+                soup = BeautifulSoup(resp.data, 'html.parser')
+                self.assertEqual(len(soup.select("#messages li")), 1)
+                self.assertIsNone(soup.find("a", id="load-more"))
+        finally:
+            app.config['MESSAGES_PER_PAGE'] = 100
+
+    def test_bad_cursor(self):
+        """a malformed ?before= token is a 400"""
+        with self.client as client:
+            resp = client.get(f"/users/{self.uid}?before=not-a-cursor")
+            self.assertEqual(resp.status_code, 400)
+
+    def test_liked_button_state(self):
+        """liked messages render with the 'liked' button style"""
+        with self.client as client:
+            with client.session_transaction() as session:
+                session[CURR_USER_KEY] = self.uid
+
+            for url in [f"/users/{self.uid1}", "/", "/messages/9876"]:
+                resp = client.get(url)
+                soup = BeautifulSoup(resp.data, 'html.parser')
+                button = soup.find("i", {"data-id": "9876"}).parent
+                self.assertIn("btn-primary", button["class"], url)
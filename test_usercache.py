@@ -0,0 +1,129 @@
+"""Logged-in user snapshot cache tests."""
+
+import os
+from unittest import TestCase
+from unittest.mock import patch
+
+from models import db, User
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+# Now we can import app
+from app import app, CURR_USER_KEY
+from test_query_counts import count_queries
+from usercache import MemoryBackend, get_user_snapshot
+
+app.config['TESTING'] = True
+app.config['WTF_CSRF_ENABLED'] = False
+
+with app.app_context():
+    db.create_all()
+
+
+class UserCacheTestCase(TestCase):
+    """Test the snapshot cache behind g.user."""
+
+    def setUp(self):
+
+        app.extensions['user_cache'].clear()
+
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+
+            u = User.signup("cached", "cached@test.com", "password", None)
+            u.id = 1
+            db.session.commit()
+
+        self.client = app.test_client()
+
+    def tearDown(self):
+
+        with app.app_context():
+            db.session.rollback()
+            db.drop_all()
+
+    def test_second_request_skips_user_query(self):
+        """a warm cache saves the users lookup"""
+
+        with self.client as client:
+            with client.session_transaction() as session:
+                session[CURR_USER_KEY] = 1
+
+            with count_queries() as cold:
+                client.get("/messages/new")
+            with count_queries() as warm:
+                client.get("/messages/new")
+
+        self.assertEqual(cold[0], 1)
+        self.assertEqual(warm[0], 0)
+
+    def test_profile_edit_invalidates(self):
+        """editing the profile shows the new name straight away"""
+
+        with self.client as client:
+            with client.session_transaction() as session:
+                session[CURR_USER_KEY] = 1
+
+            client.get("/messages/new")
+            resp = client.post("/users/profile", data={
+                "username": "renamed",
+                "email": "cached@test.com",
+                "password": "password",
+            })
+            self.assertEqual(resp.status_code, 302)
+
+        with app.test_request_context():
+            self.assertEqual(get_user_snapshot(1).username, "renamed")
+
+    def test_own_changes_refresh_counters(self):
+        """the home page sidebar counts what the user just did"""
+
+        with app.app_context():
+            db.session.add(User(id=2, username="other", email="other@test.com",
+                                password="x"))
+            db.session.commit()
+
+        with self.client as client:
+            with client.session_transaction() as session:
+                session[CURR_USER_KEY] = 1
+
+            client.get("/")
+            client.post("/users/follow/2")
+            html = client.get("/").get_data(as_text=True)
+
+        self.assertIn('<a href="/users/1/following">1</a>', html)
+
+    def test_deleted_user_is_logged_out(self):
+        """deleting the account drops its snapshot"""
+
+        with self.client as client:
+            with client.session_transaction() as session:
+                session[CURR_USER_KEY] = 1
+
+            client.post("/users/delete")
+
+        with app.test_request_context():
+            self.assertIsNone(get_user_snapshot(1))
+
+    def test_memory_backend_lru_and_ttl(self):
+        """entries expire after the TTL and the least recently used go first"""
+
+        cache = MemoryBackend(maxsize=2, ttl=10)
+
+        with patch("usercache.monotonic", return_value=100):
+            cache.set("a", 1)
+            cache.set("b", 2)
+            cache.get("a")
+            cache.set("c", 3)
+
+            self.assertEqual(cache.get("a"), 1)
+            self.assertIsNone(cache.get("b"))
+
+        with patch("usercache.monotonic", return_value=111):
+            self.assertIsNone(cache.get("a"))
@@ -0,0 +1,436 @@
+"""Fan-out-on-write home timelines for Warbler.
+
+With ``TIMELINE_FANOUT`` turned on, every new message is pushed onto a
+bounded, precomputed timeline for its author and each of their followers.
+The author's own timeline gets it at once; the followers' get it from a
+background job (see jobs.py), so posting doesn't wait on them.
+The homepage then reads that short list instead of collecting everyone the
+user follows and sorting all of their messages on every page view.
+
+Two backends ship here: ``database`` keeps timelines in the
+``timeline_entries`` table, ``memory`` keeps them in this process (handy for
+development and tests, and fanned out inline, since a worker in another
+process would only fill its own copy). Others can be added with
+`register_backend`.
+"""
+
+import bisect
+import threading
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import delete, func, literal, or_, select, tuple_, union_all
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import aliased
+
+from jobs import enqueue, job
+from models import db, Follows, Message, TimelineEntry, User
+from pagination import keyset_filter, newest_first, page_of
+
+
+TIMELINE_BACKENDS = {}
+
+
+def register_backend(name):
+    """Class decorator: make a timeline store available as `name`."""
+
+    def register(cls):
+        TIMELINE_BACKENDS[name] = cls
+        return cls
+
+    return register
+
+
+class TimelineStore:
+    """Interface every timeline backend implements.
+
+    Stores never commit; the caller owns the transaction. Pushing a message
+    that is already on a timeline leaves it as it is.
+    """
+
+    # seen by every process, so background jobs may write to it
+    shared = True
+
+    def __init__(self, max_length):
+        self.max_length = max_length
+
+    def push(self, message, author=True, followers=True):
+        """Add `message` to its author's and/or their followers' timelines."""
+
+        raise NotImplementedError
+
+    def remove(self, message_id):
+        """Drop a deleted message from every timeline."""
+
+        raise NotImplementedError
+
+    def backfill(self, owner_id, author_id):
+        """`owner_id` just followed `author_id`: add the author's messages."""
+
+        raise NotImplementedError
+
+    def prune(self, owner_id, author_id):
+        """`owner_id` stopped following `author_id`: drop their messages."""
+
+        raise NotImplementedError
+
+    def rebuild(self, owner_id):
+        """Regenerate `owner_id`'s timeline from scratch."""
+
+        raise NotImplementedError
+
+    def read(self, owner_id, limit, before=None):
+        """Return up to `limit` Messages from the timeline, newest first.
+
+        `before` is a decoded `(timestamp, id)` cursor; only older entries
+        are returned.
+        """
+
+        raise NotImplementedError
+
+
+def home_author_ids(owner_id):
+    """`owner_id` and the ids of everyone they follow."""
+
+    followed_ids = db.session.scalars(
+        select(Follows.user_being_followed_id)
+        .where(Follows.user_following_id == owner_id))
+
+    return list(dict.fromkeys([owner_id, *followed_ids]))
+
+
+def home_messages(owner_id, before, limit):
+    """The newest `limit` messages of each of `owner_id`'s home timeline
+    authors, as a Message alias over their UNION ALL.
+
+    Every branch is one author's newest-first run of the (user_id,
+    timestamp, id) index, so ordering the union newest first merges them
+    without a sort, and no author contributes more than `limit` rows.
+    """
+
+    # each branch in its own subquery: SQLAlchemy can't adapt the deleted
+    # user criterion into a bare (SELECT ... LIMIT) union member
+    branches = [select(newest_first(select(Message)
+                                    .where(Message.user_id == author_id),
+                                    before, limit).subquery())
+                for author_id in home_author_ids(owner_id)]
+
+    return aliased(Message, union_all(*branches).subquery('home_messages'))
+
+
+def home_timeline_query(owner_id, before, limit):
+    """The home timeline read straight from the messages table (not yet run)."""
+
+    home = home_messages(owner_id, before, limit)
+
+    return (db.session.query(home)
+            .options(db.joinedload(home.user))
+            .order_by(home.timestamp.desc(), home.id.desc())
+            .limit(limit))
+
+
+def _source_messages(owner_id, limit):
+    """`(id, user_id, timestamp)` of the newest messages that belong on
+    `owner_id`'s timeline."""
+
+    home = home_messages(owner_id, None, limit)
+
+    return (select(home.id, home.user_id, home.timestamp)
+            .order_by(home.timestamp.desc(), home.id.desc())
+            .limit(limit))
+
+
+@register_backend('database')
+class DatabaseTimelineStore(TimelineStore):
+    """Timelines kept in the `timeline_entries` table."""
+
+    def push(self, message, author=True, followers=True):
+        follower_ids = (select(Follows.user_following_id)
+                        .where(Follows.user_being_followed_id == message.user_id))
+
+        def owner_filter(column):
+            return or_(*([column == message.user_id] if author else []),
+                       *([column.in_(follower_ids)] if followers else []))
+
+        owners = (select(User.id,
+                         literal(message.id),
+                         literal(message.user_id),
+                         literal(message.timestamp, db.DateTime))
+                  .where(owner_filter(User.id)))
+
+        # already there: a repeated job, or backfilled by a follow since
+        db.session.execute(
+            insert(TimelineEntry).from_select(
+                ['owner_id', 'message_id', 'author_id', 'timestamp'], owners)
+            .on_conflict_do_nothing())
+        self._trim(owner_filter(TimelineEntry.owner_id))
+
+    def remove(self, message_id):
+        db.session.execute(
+            delete(TimelineEntry).where(TimelineEntry.message_id == message_id))
+
+    def backfill(self, owner_id, author_id):
+        already_there = (select(TimelineEntry.message_id)
+                         .where(TimelineEntry.owner_id == owner_id))
+        recent = (select(literal(owner_id),
+                         Message.id,
+                         Message.user_id,
+                         Message.timestamp)
+                  .where(Message.user_id == author_id,
+                         Message.id.not_in(already_there))
+                  .order_by(Message.timestamp.desc(), Message.id.desc())
+                  .limit(self.max_length))
+
+        db.session.execute(
+            insert(TimelineEntry).from_select(
+                ['owner_id', 'message_id', 'author_id', 'timestamp'], recent))
+        self._trim(TimelineEntry.owner_id == owner_id)
+
+    def prune(self, owner_id, author_id):
+        db.session.execute(
+            delete(TimelineEntry).where(TimelineEntry.owner_id == owner_id,
+                                        TimelineEntry.author_id == author_id))
+
+    def rebuild(self, owner_id):
+        db.session.execute(
+            delete(TimelineEntry).where(TimelineEntry.owner_id == owner_id))
+
+        newest = _source_messages(owner_id, self.max_length).subquery()
+        db.session.execute(
+            insert(TimelineEntry).from_select(
+                ['owner_id', 'message_id', 'author_id', 'timestamp'],
+                select(literal(owner_id), newest.c.id, newest.c.user_id,
+                       newest.c.timestamp)))
+
+    def read(self, owner_id, limit, before=None):
+        query = (Message
+                 .with_authors()
+                 .join(TimelineEntry, TimelineEntry.message_id == Message.id)
+                 .filter(TimelineEntry.owner_id == owner_id))
+
+        if before:
+            query = query.filter(keyset_filter(TimelineEntry.timestamp,
+                                               TimelineEntry.message_id,
+                                               before))
+
+        return (query
+                .order_by(TimelineEntry.timestamp.desc(),
+                          TimelineEntry.message_id.desc())
+                .limit(limit)
+                .all())
+
+    def _trim(self, owner_filter):
+        """Delete entries past `max_length` on the timelines matching the filter."""
+
+        position = (func.row_number()
+                    .over(partition_by=TimelineEntry.owner_id,
+                          order_by=(TimelineEntry.timestamp.desc(),
+                                    TimelineEntry.message_id.desc()))
+                    .label('position'))
+        ranked = (select(TimelineEntry.owner_id, TimelineEntry.message_id, position)
+                  .where(owner_filter)
+                  .subquery())
+        overflow = (select(ranked.c.owner_id, ranked.c.message_id)
+                    .where(ranked.c.position > self.max_length))
+
+        db.session.execute(
+            delete(TimelineEntry)
+            .where(tuple_(TimelineEntry.owner_id,
+                          TimelineEntry.message_id).in_(overflow))
+            .execution_options(synchronize_session=False))
+
+
+@register_backend('memory')
+class MemoryTimelineStore(TimelineStore):
+    """Timelines kept in a dict in this process.
+
+    Each timeline is a list of ``(timestamp, message_id, author_id)`` tuples
+    in ascending order, so the newest entries are at the end.
+    """
+
+    # a job run by another process would fill that process's copy
+    shared = False
+
+    def __init__(self, max_length):
+        super().__init__(max_length)
+        self._timelines = {}
+        self._lock = threading.Lock()
+
+    def push(self, message, author=True, followers=True):
+        owner_ids = [message.user_id] if author else []
+        if followers:
+            owner_ids += db.session.scalars(
+                select(Follows.user_following_id)
+                .where(Follows.user_being_followed_id == message.user_id))
+        entry = (message.timestamp, message.id, message.user_id)
+
+        with self._lock:
+            for owner_id in owner_ids:
+                self._insert(owner_id, [entry])
+
+    def remove(self, message_id):
+        with self._lock:
+            for owner_id, entries in self._timelines.items():
+                self._timelines[owner_id] = [e for e in entries
+                                             if e[1] != message_id]
+
+    def backfill(self, owner_id, author_id):
+        recent = (Message
+                  .query
+                  .filter(Message.user_id == author_id)
+                  .order_by(Message.timestamp.desc(), Message.id.desc())
+                  .limit(self.max_length)
+                  .with_entities(Message.timestamp, Message.id, Message.user_id))
+
+        with self._lock:
+            present = {e[1] for e in self._timelines.get(owner_id, [])}
+            self._insert(owner_id,
+                         [tuple(row) for row in recent if row.id not in present])
+
+    def prune(self, owner_id, author_id):
+        with self._lock:
+            entries = self._timelines.get(owner_id, [])
+            self._timelines[owner_id] = [e for e in entries if e[2] != author_id]
+
+    def rebuild(self, owner_id):
+        newest = db.session.execute(_source_messages(owner_id, self.max_length))
+
+        with self._lock:
+            self._timelines[owner_id] = sorted(
+                (timestamp, message_id, author_id)
+                for message_id, author_id, timestamp in newest)
+
+    def read(self, owner_id, limit, before=None):
+        with self._lock:
+            timeline = self._timelines.get(owner_id, [])
+            end = bisect.bisect_left(timeline, before) if before else len(timeline)
+            entries = timeline[max(end - limit, 0):end]
+
+        ids = [message_id for _, message_id, _ in reversed(entries)]
+        by_id = {m.id: m
+                 for m in Message.with_authors().filter(Message.id.in_(ids))}
+        return [by_id[i] for i in ids if i in by_id]
+
+    def _insert(self, owner_id, entries):
+        """Merge new `entries` into a timeline and cut it back to `max_length`.
+
+        Messages already on it are skipped.
+        """
+
+        timeline = self._timelines.setdefault(owner_id, [])
+        present = {e[1] for e in timeline}
+        for entry in entries:
+            if entry[1] not in present:
+                bisect.insort(timeline, entry)
+                present.add(entry[1])
+        del timeline[:-self.max_length]
+
+
+def get_timeline_store():
+    """Return the timeline store configured for the current app."""
+
+    backend = current_app.config['TIMELINE_BACKEND']
+    stores = current_app.extensions.setdefault('timelines', {})
+
+    if backend not in stores:
+        stores[backend] = TIMELINE_BACKENDS[backend](
+            current_app.config['TIMELINE_MAX_LENGTH'])
+
+    return stores[backend]
+
+
+def fanout_enabled():
+    """Is fan-out-on-write turned on for the current app?"""
+
+    return current_app.config['TIMELINE_FANOUT']
+
+
+def publish_message(message):
+    """Fan out a new (flushed) message. The caller commits.
+
+    It goes on the author's timeline now, so their home page shows it
+    straight away, and on their followers' from a job.
+    """
+
+    store = get_timeline_store()
+
+    if store.shared:
+        store.push(message, followers=False)
+        enqueue('fan_out_message', message_id=message.id)
+    else:
+        store.push(message)
+
+
+def withdraw_message(message_id):
+    """Take a deleted message off every timeline, from a job where possible."""
+
+    store = get_timeline_store()
+
+    if store.shared:
+        enqueue('remove_message', message_id=message_id)
+    else:
+        store.remove(message_id)
+
+
+@job('fan_out_message')
+def fan_out_message(message_id):
+    """Job: push a new message onto its author's followers' timelines."""
+
+    message = db.session.get(Message, message_id)
+
+    # deleted (or its author was) before the job ran
+    if message is not None and fanout_enabled():
+        get_timeline_store().push(message, author=False)
+
+
+@job('remove_message')
+def remove_message(message_id):
+    """Job: take a deleted message off every timeline."""
+
+    if fanout_enabled():
+        get_timeline_store().remove(message_id)
+
+
+def read_home_timeline(user_id, before, per_page):
+    """One page of `user_id`'s home timeline, as `(messages, next_cursor)`.
+
+    Reads the precomputed timeline when fan-out is on, and the messages
+    table otherwise, or wherever the precomputed one runs short.
+    """
+
+    messages = []
+
+    if fanout_enabled():
+        # timeline was precomputed when the messages were posted
+        messages = get_timeline_store().read(user_id, per_page + 1, before)
+
+    # precomputed timelines are bounded, and may be missing altogether (an
+    # account from before fan-out, or one never rebuilt), so whenever one
+    # can't fill the page, carry on from the messages table
+    if len(messages) <= per_page:
+
+        if messages:
+            before = (messages[-1].timestamp, messages[-1].id)
+
+        messages += home_timeline_query(
+            user_id, before, per_page + 1 - len(messages)).all()
+
+    return page_of(messages, per_page)
+
+
+@click.command('rebuild-timelines')
+@click.option('--user-id', 'user_ids', type=int, multiple=True,
+              help="Only rebuild these users' timelines (default: everyone).")
+@with_appcontext
+def rebuild_timelines_command(user_ids):
+    """Regenerate precomputed home timelines from the messages table."""
+
+    store = get_timeline_store()
+    user_ids = user_ids or db.session.scalars(select(User.id)).all()
+
+    for user_id in user_ids:
+        store.rebuild(user_id)
+        db.session.commit()
+
+    click.echo(f"Rebuilt {len(user_ids)} timeline(s).")
@@ -0,0 +1,112 @@
+"""Trending warbles: recent messages ranked by time-decayed like velocity.
+
+`flask compute-trending`, run every few minutes (from cron, say), sums the
+last ``TRENDING_WINDOW_HOURS`` of likes per message in one GROUP BY over the
+``likes.created_at`` index. Each like counts for less the older it is,
+halving every ``TRENDING_HALF_LIFE_HOURS``, so a message's score follows how
+fast it's being liked *now*. Only messages younger than
+``TRENDING_MAX_AGE_DAYS`` qualify. The best ``TRENDING_SIZE`` replace the
+contents of ``trending_messages`` in one transaction.
+
+/trending and /api/v1/trending read that small table, and each process
+keeps what it read for ``TRENDING_CACHE_TTL`` seconds. A spike in traffic
+to the page costs a primary key fetch of the ranked messages, and none of
+the aggregation.
+"""
+
+import math
+from datetime import datetime, timedelta
+from time import monotonic
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import DateTime, delete, func, insert, literal, select
+
+from models import db, Likes, Message, TrendingMessage
+
+
+def compute_trending(now=None):
+    """Rank messages by decayed likes into ``trending_messages``.
+
+    Returns how many messages were ranked. Commits.
+    """
+
+    config = current_app.config
+    now = now or datetime.utcnow()
+    stamp = literal(now, DateTime)
+
+    half_life = config['TRENDING_HALF_LIFE_HOURS'] * 3600
+    age = func.extract('epoch', stamp - Likes.created_at)
+    weight = func.exp(-math.log(2) * age / half_life)
+    score = func.sum(weight).label('score')
+
+    ranked = (select(Likes.message_id, score, stamp)
+              .join(Message, Message.id == Likes.message_id)
+              .where(Likes.created_at > now - timedelta(
+                         hours=config['TRENDING_WINDOW_HOURS']),
+                     Likes.created_at <= now,
+                     Message.timestamp > now - timedelta(
+                         days=config['TRENDING_MAX_AGE_DAYS']))
+              .group_by(Likes.message_id)
+              .order_by(score.desc(), Likes.message_id.desc())
+              .limit(config['TRENDING_SIZE']))
+
+    db.session.execute(delete(TrendingMessage))
+    result = db.session.execute(
+        insert(TrendingMessage)
+        .from_select(['message_id', 'score', 'computed_at'], ranked))
+    db.session.commit()
+
+    current_app.extensions.pop('trending', None)
+    return result.rowcount
+
+
+def get_trending():
+    """``(computed_at, [(message id, score), ...])``, best first.
+
+    Read from ``trending_messages`` at most once per TRENDING_CACHE_TTL
+    seconds in each process. `computed_at` is None before the first run.
+    """
+
+    cached = current_app.extensions.get('trending')
+    if cached is not None and cached[0] > monotonic():
+        return cached[1]
+
+    rows = db.session.execute(
+        select(TrendingMessage.message_id, TrendingMessage.score,
+               TrendingMessage.computed_at)
+        .order_by(TrendingMessage.score.desc(),
+                  TrendingMessage.message_id.desc())).all()
+
+    trending = (rows[0].computed_at if rows else None,
+                [(row.message_id, row.score) for row in rows])
+
+    current_app.extensions['trending'] = (
+        monotonic() + current_app.config['TRENDING_CACHE_TTL'], trending)
+    return trending
+
+
+def trending_messages():
+    """``(computed_at, messages)``: the trending messages with their authors."""
+
+    computed_at, ranked = get_trending()
+
+    if not ranked:
+        return computed_at, []
+
+    by_id = {m.id: m for m in
+             Message.with_authors().filter(
+                 Message.id.in_([message_id for message_id, _ in ranked]))}
+
+    # anything deleted since the ranking is simply skipped
+    return computed_at, [by_id[message_id] for message_id, _ in ranked
+                         if message_id in by_id]
+
+
+@click.command('compute-trending')
+@with_appcontext
+def compute_trending_command():
+    """Rank recent messages by time-decayed likes for /trending."""
+
+    click.echo(f"Ranked {compute_trending()} trending message(s).")
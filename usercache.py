@@ -0,0 +1,172 @@
+"""Cached snapshots of the logged-in user.
+
+Every request used to start with ``User.query.get(...)`` for the logged-in
+user, just so templates could show their name and avatar. Instead, `g.user`
+is now a `UserSnapshot`: a read-only copy of the user's profile columns kept
+in a TTL'd LRU cache keyed by user id. Views that change the user call
+`snapshot.load()` to get the real ORM object, and call `invalidate_user`
+once the change is committed. The snapshot carries the user's counters too,
+for the home page sidebar; the app drops it after every POST they make.
+
+The cache backend is pluggable. The default `MemoryBackend` lives in this
+process; a shared backend (memcached, Redis, ...) just needs `get`, `set`
+and `delete` and can be passed to `init_user_cache`. Snapshots are stored as
+plain dicts, so they serialize cleanly.
+"""
+
+import threading
+from collections import OrderedDict
+from time import monotonic
+
+from flask import current_app
+from sqlalchemy import select
+
+from models import db, Follows, User
+
+SNAPSHOT_COLUMNS = ('id', 'username', 'email', 'image_url',
+                    'header_image_url', 'bio', 'location',
+                    # for the home page sidebar
+                    'messages_count', 'following_count', 'followers_count',
+                    'likes_count')
+
+
+class MemoryBackend:
+    """A thread-safe LRU cache whose entries expire after `ttl` seconds."""
+
+    def __init__(self, maxsize=10000, ttl=60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if entry is None:
+                return None
+
+            expires, value = entry
+            if expires < monotonic():
+                del self._entries[key]
+                return None
+
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        # nothing else drops snapshots of rows deleted behind the app's back
+        # (tests emptying the database between cases, say)
+        with self._lock:
+            self._entries.clear()
+
+
+class UserSnapshot:
+    """Read-only stand-in for the logged-in `User`.
+
+    Has the profile columns and the read helpers templates use. Anything
+    that writes should `load()` the ORM object.
+    """
+
+    def __init__(self, **columns):
+        self.__dict__.update(columns)
+
+    def __repr__(self):
+        return f"<UserSnapshot #{self.id}: {self.username}>"
+
+    def __eq__(self, other):
+        return isinstance(other, (User, UserSnapshot)) and other.id == self.id
+
+    def __hash__(self):
+        return hash(self.id)
+
+    def load(self):
+        """The full ORM `User`, for views that need to change it."""
+
+        return User.query.get(self.id)
+
+    def row_version(self):
+        """The user row's current `updated_at`, read fresh from the database.
+
+        It changes whenever they like, follow or edit anything, so it stands
+        in for all the viewer state a page shows.
+        """
+
+        return db.session.scalar(select(User.updated_at).where(User.id == self.id))
+
+    def is_following(self, other_user):
+        """Is this user following `other_user`?"""
+
+        return Follows.exists(self.id, other_user.id)
+
+    def is_followed_by(self, other_user):
+        """Is this user followed by `other_user`?"""
+
+        return Follows.exists(other_user.id, self.id)
+
+    def following_ids_among(self, user_ids):
+        """Which of `user_ids` does this user follow? Returns a set."""
+
+        return User.following_ids_among(self, user_ids)
+
+    def liked_ids_among(self, message_ids):
+        """Which of `message_ids` has this user liked? Returns a set."""
+
+        return User.liked_ids_among(self, message_ids)
+
+
+def init_user_cache(app, backend=None):
+    """Set up the snapshot cache for `app`.
+
+    Without a `backend`, snapshots are kept in this process, sized and
+    expired by the `USER_CACHE_SIZE` and `USER_CACHE_TTL` settings.
+    """
+
+    if backend is None:
+        backend = MemoryBackend(app.config['USER_CACHE_SIZE'],
+                                app.config['USER_CACHE_TTL'])
+
+    app.extensions['user_cache'] = backend
+    return backend
+
+
+def _cache_key(user_id):
+    return f"user-snapshot:{user_id}"
+
+
+def get_user_snapshot(user_id):
+    """Snapshot of user `user_id`, or None if there's no such user."""
+
+    cache = current_app.extensions['user_cache']
+    columns = cache.get(_cache_key(user_id))
+
+    if columns is None:
+        row = db.session.execute(
+            select(*(getattr(User, name) for name in SNAPSHOT_COLUMNS))
+            .where(User.id == user_id)).first()
+
+        if row is None:
+            return None
+
+        columns = dict(row._mapping)
+        cache.set(_cache_key(user_id), columns)
+
+    return UserSnapshot(**columns)
+
+
+def invalidate_user(user_id):
+    """Forget the cached snapshot after the user's row has changed."""
+
+    current_app.extensions['user_cache'].delete(_cache_key(user_id))